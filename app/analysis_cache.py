@@ -0,0 +1,100 @@
+"""分析结果缓存（内容寻址）
+========================
+
+同一份 Solidity 源码 + 合约名 + 工具版本 + 检测配置 只分析一次：
+
+- `analysis_key()` 计算 sha256 指纹；
+- `AnalysisCache` 以 SQLite 保存 指纹 → (doc_id, slither_findings, echidna_fails)，
+  多个 uvicorn worker 共享同一文件；
+- 命中时 `/analyze` 直接返回已有 doc_id 与计数，不再运行工具、不再重复入库；
+- 某个 doc_id 的已存行被改写（重新分析其他版本、/ingest、删除）时 `invalidate_doc()` 清除其全部条目，
+  否则再次提交旧版本会命中缓存而不写回，库中留下的却是新版本的发现。
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def analysis_key(source: bytes, contract_name: str, tool_versions: Dict[str, str], config: Dict) -> str:
+    h = hashlib.sha256()
+    h.update(hashlib.sha256(source).digest())
+    h.update(json.dumps(
+        {"contract": contract_name, "tools": tool_versions, "config": config},
+        sort_keys=True,
+        ensure_ascii=False,
+    ).encode("utf-8"))
+    return h.hexdigest()
+
+
+class AnalysisCache:
+    """指纹 → 分析结果；path 为 None 时仅进程内字典"""
+
+    def __init__(self, path: str | Path | None = None):
+        self._lock = threading.Lock()
+        self._mem: Dict[str, Dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS analyses ("
+                " key TEXT PRIMARY KEY, doc_id TEXT NOT NULL,"
+                " result TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS analyses_doc_id ON analyses(doc_id)")
+            self._db.commit()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            if self._db is None:
+                result = self._mem.get(key)
+            else:
+                # 每次查 SQLite：其他 worker 的 invalidate_doc() 立即生效
+                row = self._db.execute("SELECT result FROM analyses WHERE key = ?", (key,)).fetchone()
+                result = json.loads(row[0]) if row else None
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def put(self, key: str, result: Dict) -> None:
+        with self._lock:
+            if self._db is None:
+                self._mem[key] = result
+            else:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO analyses(key, doc_id, result, created_at) VALUES (?, ?, ?, ?)",
+                    (key, result["doc_id"], json.dumps(result, ensure_ascii=False), time.time()),
+                )
+                self._db.commit()
+
+    def invalidate_doc(self, doc_id: str) -> int:
+        """删除某个 doc_id 的全部缓存条目，返回删除条数"""
+        with self._lock:
+            if self._db is None:
+                keys = [k for k, r in self._mem.items() if r.get("doc_id") == doc_id]
+                for k in keys:
+                    del self._mem[k]
+                return len(keys)
+            cur = self._db.execute("DELETE FROM analyses WHERE doc_id = ?", (doc_id,))
+            self._db.commit()
+            return cur.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = (
+                self._db.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+                if self._db is not None
+                else len(self._mem)
+            )
+            return {"entries": entries, "hits": self.hits, "misses": self.misses}
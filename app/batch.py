@@ -0,0 +1,158 @@
+"""批量分析（/analyze/batch）
+=========================
+
+一次请求分析一个协议部署的全部合约（zip 压缩包或地址列表）：
+
+- `list_sol_members()` / `extract_sol_archive()`：校验并解压压缩包中的 `.sol` 文件，
+  保留目录结构（import 按相对路径解析），拒绝逃出根目录的路径与超限的解压体积；
+- `parse_addresses()`：JSON 数组或逗号/空白分隔的地址列表，去重并校验格式；
+- `InsertBatcher`：各合约的发现在工具跑完后交给它，凑满 `max_chunks` 个文本块
+  （或所有合约都已结束）才一次性向量化入库，代替每个合约各自的小批量请求。
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+import re
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+_ADDRESS = re.compile(r"^0x[0-9a-fA-F]{40}$")
+_SKIP_DIRS = {"__MACOSX", "node_modules", ".git"}
+
+
+def _member_path(name: str) -> str | None:
+    """压缩包成员名 → 安全的相对路径；目录、隐藏文件与非 .sol 文件返回 None"""
+    path = PurePosixPath(name.replace("\\", "/"))
+    parts = [p for p in path.parts if p not in ("/", "", ".")]
+    if not parts or path.suffix != ".sol" or ".." in parts:
+        return None
+    if any(p in _SKIP_DIRS or p.startswith(".") for p in parts):
+        return None
+    return "/".join(parts)
+
+
+def list_sol_members(data: bytes, max_files: int, max_bytes: int) -> List[str]:
+    """压缩包中 .sol 文件的相对路径（不解压）；格式错误或超限时抛 ValueError"""
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            infos = [(i, _member_path(i.filename)) for i in zf.infolist() if not i.is_dir()]
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"无效的 zip 文件: {e}")
+    members = [(i, p) for i, p in infos if p is not None]
+    if len(members) > max_files:
+        raise ValueError(f"压缩包包含 {len(members)} 个合约，超过上限 {max_files}")
+    total = sum(i.file_size for i, _ in members)
+    if total > max_bytes:
+        raise ValueError(f"解压后 {total} 字节，超过上限 {max_bytes}")
+    return sorted(p for _, p in members)
+
+
+def extract_sol_archive(data: bytes, dest: Path) -> List[str]:
+    """把压缩包中的 .sol 文件解压到 dest（保留目录结构），返回相对路径列表"""
+    paths = []
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        for info in zf.infolist():
+            rel = None if info.is_dir() else _member_path(info.filename)
+            if rel is None:
+                continue
+            target = dest / rel
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(zf.read(info))
+            paths.append(rel)
+    return sorted(paths)
+
+
+def parse_addresses(text: str) -> List[str]:
+    """JSON 数组或逗号/空白分隔的地址列表 → 去重后的地址（保持顺序）"""
+    text = (text or "").strip()
+    if text.startswith("["):
+        try:
+            raw = [str(a) for a in json.loads(text)]
+        except json.JSONDecodeError as e:
+            raise ValueError(f"地址列表 JSON 格式错误: {e}")
+    else:
+        raw = re.split(r"[\s,;]+", text)
+    seen, out = set(), []
+    for a in (a.strip() for a in raw):
+        if not a:
+            continue
+        if not _ADDRESS.match(a):
+            raise ValueError(f"无效的合约地址: {a}")
+        if a.lower() not in seen:
+            seen.add(a.lower())
+            out.append(a)
+    return out
+
+
+def _unique(short: Sequence[str], full: Sequence[str]) -> List[str]:
+    counts: Dict[str, int] = {}
+    for s in short:
+        counts[s] = counts.get(s, 0) + 1
+    return [s if counts[s] == 1 else f for s, f in zip(short, full)]
+
+
+def doc_ids_for(paths: Sequence[str]) -> List[str]:
+    """每个合约文件一个 doc_id：默认取文件名，同名文件改用完整相对路径"""
+    return _unique(
+        [PurePosixPath(p).stem for p in paths],
+        [str(PurePosixPath(p).with_suffix("")).replace("/", "_") for p in paths],
+    )
+
+
+class InsertBatcher:
+    """把多个合约的文本块合并成共享的向量化 + 入库调用
+
+    每个生产者（合约）最终调用一次 `add()`（有结果）或 `skip()`（命中缓存 / 失败 / 取消）。
+    待入库块数达到 `max_chunks`，或全部生产者都已交付时触发一次 `insert_fn(docs)`
+    （在线程中执行）；`add()` 在包含其数据的那次入库完成后返回。
+    """
+
+    def __init__(
+        self,
+        insert_fn: Callable[[List[Tuple[str, List[Any]]]], Any],
+        producers: int,
+        max_chunks: int = 256,
+    ):
+        self._insert = insert_fn
+        self._remaining = producers
+        self.max_chunks = max(1, max_chunks)
+        self._pending: List[Tuple[Tuple[str, List[Any]], asyncio.Future]] = []
+        self._pending_chunks = 0
+        self._lock = asyncio.Lock()
+        self.flushes = 0
+
+    async def add(self, doc_id: str, groups: List[Any]) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append(((doc_id, groups), fut))
+        self._pending_chunks += len(groups)
+        self._remaining -= 1
+        await self._maybe_flush()
+        await fut
+
+    async def skip(self) -> None:
+        self._remaining -= 1
+        await self._maybe_flush()
+
+    async def _maybe_flush(self) -> None:
+        if not self._pending:
+            return
+        if self._pending_chunks < self.max_chunks and self._remaining > 0:
+            return
+        batch, self._pending, self._pending_chunks = self._pending, [], 0
+        async with self._lock:  # 入库按提交顺序串行
+            try:
+                await asyncio.to_thread(self._insert, [docs for docs, _ in batch])
+            except BaseException as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e if isinstance(e, Exception) else RuntimeError("入库被取消"))
+                if not isinstance(e, Exception):
+                    raise
+            else:
+                self.flushes += 1
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_result(None)
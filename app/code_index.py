@@ -0,0 +1,274 @@
+"""Solidity 源码分块（代码索引）
+============================
+
+不依赖 solc：先把注释与字符串字面量替换为空格（保留换行与位置），再按 `;` 与花括号配对切分声明，
+每个源文件得到三级块：
+
+- `contract`：合约 / 接口 / 库的声明部分（状态变量、事件、结构体与各成员的签名），成员体以 `{ ... }` 省略；
+- `function` / `modifier`：单个函数（含 constructor / fallback / receive、文件级自由函数）或修饰器的完整源码，
+  连同紧挨着的 NatSpec 注释。
+
+每块带文件内行号范围（从 1 开始）与 `symbols`：函数 / 修饰器为自身名字，合约块为合约名与其中声明的
+状态变量、事件、结构体等名字。`link_findings()` 把分析工具报告的 `elements` 按名字对应到块，
+给每块记下引用它的发现指纹；入库行的 `elements` 字段为 `symbols` + 所属合约名，
+检索时可按某个发现的元素过滤出对应代码。
+"""
+from __future__ import annotations
+
+import bisect
+import hashlib
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTRACT = "contract"
+FUNCTION = "function"
+MODIFIER = "modifier"
+
+CODE_KINDS = (CONTRACT, FUNCTION, MODIFIER)
+CODE_FIELDS = ("kind", "symbol", "path", "start_line", "end_line", "elements", "findings")  # 入库行的元数据
+
+_TOKENS = re.compile(r"[{}();]")
+_CONTRACT_DECL = re.compile(r"\s*(?:abstract\s+)?(contract|interface|library)\s+([A-Za-z_]\w*)")
+_MEMBER_DECL = re.compile(
+    r"\s*(?:(function|modifier)\s+([A-Za-z_]\w*)|(constructor|fallback|receive))\s*\("
+)
+_NAMED_DECL = re.compile(r"\s*(event|error|struct|enum|type)\s+([A-Za-z_]\w*)")
+_SKIP_DECL = re.compile(r"\s*(using|pragma|import)\b")
+_WORD = re.compile(r"[A-Za-z_]\w*")
+_IDENT = re.compile(r"[A-Za-z_]\w{2,}")
+
+
+@dataclass
+class CodeChunk:
+    kind: str  # contract | function | modifier
+    name: str
+    contract: str  # 所属合约；合约块为自身，自由函数为空
+    path: str
+    start_line: int
+    end_line: int
+    text: str
+    symbols: List[str]
+    findings: List[str] = field(default_factory=list)  # 引用本块元素的发现指纹
+
+    @property
+    def qualified_name(self) -> str:
+        if self.kind == CONTRACT or not self.contract:
+            return self.name
+        return f"{self.contract}.{self.name}"
+
+    def content(self) -> str:
+        """入库文本：位置注释 + 源码"""
+        return f"// {self.path}:{self.start_line}-{self.end_line} {self.kind} {self.qualified_name}\n{self.text}"
+
+    def row(self, doc_id: str) -> Dict:
+        elements = list(dict.fromkeys(s for s in (*self.symbols, self.contract) if s))
+        content = self.content()
+        # 关联的发现变化时指纹随之变化：旧行删除、新行写入（相同文本的向量命中缓存）
+        digest = hashlib.sha1(
+            "\0".join([content, *sorted(self.findings)]).encode("utf-8")
+        ).hexdigest()
+        return {
+            "doc_id": doc_id,
+            "content": content,
+            "kind": self.kind,
+            "symbol": self.qualified_name,
+            "path": self.path,
+            "start_line": self.start_line,
+            "end_line": self.end_line,
+            "elements": elements,
+            "findings": list(self.findings),
+            "fingerprint": digest,
+        }
+
+
+def mask_source(source: str) -> str:
+    """注释与字符串字面量替换为空格（换行保留），其余字符与位置不变"""
+    out = list(source)
+    i, n = 0, len(source)
+    while i < n:
+        c = source[i]
+        if c == "/" and source.startswith("//", i):
+            end = source.find("\n", i)
+            end = n if end < 0 else end
+        elif c == "/" and source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            end = n if end < 0 else end + 2
+        elif c in "\"'":
+            end = i + 1
+            while end < n and source[end] != c and source[end] != "\n":
+                end += 2 if source[end] == "\\" else 1
+            end = min(end + 1, n)
+        else:
+            i += 1
+            continue
+        for j in range(i, end):
+            if out[j] != "\n":
+                out[j] = " "
+        i = end
+    return "".join(out)
+
+
+def _statements(masked: str, start: int, end: int) -> Iterable[Tuple[int, int, Optional[int]]]:
+    """[start, end) 内深度为 0 的声明：(起点, 终点, 花括号体起点或 None)"""
+    stmt, parens, body = start, 0, None
+    for m in _TOKENS.finditer(masked, start, end):
+        if m.start() < stmt:
+            continue  # 位于刚跳过的花括号体内
+        c = m.group()
+        if c == "(":
+            parens += 1
+        elif c == ")":
+            parens = max(0, parens - 1)
+        elif c == ";" and parens == 0:
+            yield stmt, m.end(), None
+            stmt = m.end()
+        elif c == "{" and parens == 0:
+            body = m.start()
+            close = _matching_brace(masked, body, end)
+            yield stmt, close + 1, body
+            stmt = close + 1
+        elif c == "}" and parens == 0:
+            stmt = m.end()  # 不配对的右括号：跳过
+
+
+def _matching_brace(masked: str, open_pos: int, end: int) -> int:
+    depth = 0
+    for m in _TOKENS.finditer(masked, open_pos, end):
+        c = m.group()
+        if c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return m.start()
+    return end - 1  # 未闭合：截到范围末尾
+
+
+class _Lines:
+    def __init__(self, source: str):
+        self.source = source
+        self.starts = [0] + [m.end() for m in re.finditer("\n", source)]
+
+    def line(self, pos: int) -> int:
+        return bisect.bisect_right(self.starts, pos)
+
+    def with_doc_comment(self, pos: int) -> int:
+        """把起点前移到紧挨着的注释行（NatSpec）开头"""
+        line = self.line(pos) - 1
+        while line > 0:
+            prev = self.source[self.starts[line - 1]: self.starts[line]].strip()
+            if not prev.startswith(("//", "/*", "*")):
+                break
+            line -= 1
+        return self.starts[line]
+
+
+def _first_code(masked: str, start: int, end: int) -> int:
+    while start < end and masked[start].isspace():
+        start += 1
+    return start
+
+
+def parse_solidity(source: str, path: str = "", max_chars: int = 8000) -> List[CodeChunk]:
+    """单个源文件 → 代码块（合约块在前，其后为其成员）；超过 max_chars 的块文本截断"""
+    masked = mask_source(source)
+    lines = _Lines(source)
+    chunks: List[CodeChunk] = []
+
+    def make(kind: str, name: str, contract: str, start: int, end: int, text: str, symbols: List[str]) -> CodeChunk:
+        if len(text) > max_chars:
+            text = text[:max_chars].rstrip() + "\n// ...（截断）"
+        return CodeChunk(kind, name, contract, path, lines.line(start), lines.line(end - 1), text, symbols)
+
+    def member(contract: str, start: int, end: int) -> Optional[CodeChunk]:
+        m = _MEMBER_DECL.match(masked, start, end)
+        if not m:
+            return None
+        kind = MODIFIER if m.group(1) == "modifier" else FUNCTION
+        name = m.group(2) or m.group(3)
+        begin = lines.with_doc_comment(_first_code(masked, start, end))
+        return make(kind, name, contract, begin, end, source[begin:end], [name])
+
+    for start, end, body in _statements(masked, 0, len(masked)):
+        decl = _CONTRACT_DECL.match(masked, start, end)
+        if decl is None:
+            if body is not None:
+                free = member("", start, end)  # 文件级自由函数
+                if free is not None:
+                    chunks.append(free)
+            continue
+        if body is None:
+            continue
+        name = decl.group(2)
+        symbols = [name]
+        members: List[CodeChunk] = []
+        outline, last = [], body + 1
+        for s, e, b in _statements(masked, body + 1, end - 1):
+            chunk = member(name, s, e)
+            if chunk is not None:
+                members.append(chunk)
+                if b is not None:  # 合约块中只保留成员签名
+                    outline.append(source[last:b] + "{ ... }")
+                    last = e
+                continue
+            named = _NAMED_DECL.match(masked, s, e)
+            if named:
+                symbols.append(named.group(2))
+            elif b is None and not _SKIP_DECL.match(masked, s, e):
+                # 状态变量：去掉初始值（mapping 的 `=>` 不是赋值）后的最后一个标识符
+                words = _WORD.findall(masked[s:e - 1].replace("=>", "  ").split("=", 1)[0])
+                if words:
+                    symbols.append(words[-1])
+        outline.append(source[last:end])
+        begin = lines.with_doc_comment(_first_code(masked, start, end))
+        text = source[begin:body + 1] + "".join(outline)
+        chunks.append(make(CONTRACT, name, name, begin, end, text, list(dict.fromkeys(symbols))))
+        chunks.extend(members)
+    return chunks
+
+
+def parse_files(files: Sequence[Path], root: Path, max_chunks: int = 0, max_chars: int = 8000) -> List[CodeChunk]:
+    """按顺序解析多个文件（路径相对 root）；max_chunks > 0 时最多返回这么多块"""
+    chunks: List[CodeChunk] = []
+    for f in files:
+        try:
+            rel = f.relative_to(root).as_posix()
+        except ValueError:
+            rel = f.name
+        chunks.extend(parse_solidity(f.read_text(encoding="utf-8", errors="replace"), rel, max_chars))
+        if max_chunks and len(chunks) >= max_chunks:
+            return chunks[:max_chunks]
+    return chunks
+
+
+def element_key(element: str) -> str:
+    """工具报告的元素名 → 用于匹配的名字：`Vault.withdraw(uint256)` → `withdraw`（小写）"""
+    return element.split("(", 1)[0].rsplit(".", 1)[-1].strip().lower()
+
+
+def link_findings(chunks: Sequence[CodeChunk], findings: Iterable[Tuple[str, Sequence[str]]]) -> int:
+    """findings 为 (发现指纹, 元素列表)：把指纹记到声明了其中任一元素的块上，返回关联数"""
+    by_symbol: Dict[str, List[CodeChunk]] = {}
+    for chunk in chunks:
+        for s in chunk.symbols:
+            by_symbol.setdefault(s.lower(), []).append(chunk)
+    links = 0
+    for fingerprint, elements in findings:
+        for key in {element_key(e) for e in elements if e}:
+            for chunk in by_symbol.get(key, ()):
+                if fingerprint not in chunk.findings:
+                    chunk.findings.append(fingerprint)
+                    links += 1
+    return links
+
+
+def identifiers(text: str) -> List[str]:
+    """问题中可能是代码符号的标识符（ASCII，至少 3 个字符，小写去重）"""
+    return list(dict.fromkeys(m.group().lower() for m in _IDENT.finditer(text)))
+
+
+def is_code_row(row: Dict) -> bool:
+    """检索结果是否来自代码索引（而非工具发现）"""
+    return row.get("kind") in CODE_KINDS and "start_line" in row
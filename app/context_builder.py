@@ -0,0 +1,107 @@
+"""按 token 预算组装问答上下文
+==========================
+
+检索阶段按 `top_k × overfetch` 多取候选，这里在 CPU 上完成剩余工作：
+
+1. `rerank`：向量相似度、BM25、RRF 与问题词覆盖率的加权和，各项先归一化到 [0, 1]；
+2. `mmr_order`：最大边际相关性排序，冗余度取两个块词集合的 Jaccard 相似度；
+3. 按 MMR 顺序装入块，直到达到 `max_chunks` 或 `token_budget`（`estimate_tokens` 估算）。
+
+返回选中的块与本次统计（候选数、保留数、估算 token 数）。
+"""
+from __future__ import annotations
+
+import math
+import re
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Sequence, Tuple
+
+from lexical_index import tokenize
+
+Row = Dict[str, Any]
+
+_CJK = re.compile(r"[\u3400-\u9fff\u3000-\u303f\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文（含全角标点）约 1 字 1 token，其余约 4 字符 1 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+@dataclass
+class ContextStats:
+    candidates: int = 0
+    kept: int = 0
+    tokens: int = 0
+    budget: int = 0
+    dropped_for_budget: int = 0
+
+    def to_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+
+def _scaled(values: Sequence[float]) -> List[float]:
+    hi = max(values, default=0.0)
+    return [v / hi if hi > 0 else 0.0 for v in values]
+
+
+def rerank(question: str, rows: Sequence[Row]) -> List[Tuple[float, Row]]:
+    """返回按相关度降序的 (score, row)"""
+    q_terms = set(tokenize(question))
+    sims = _scaled([max(float(r.get("similarity", 0.0)), 0.0) for r in rows])
+    bm25 = _scaled([float(r.get("bm25", 0.0)) for r in rows])
+    rrf = _scaled([float(r.get("rrf", 0.0)) for r in rows])
+    scored = []
+    for i, r in enumerate(rows):
+        overlap = len(q_terms & set(tokenize(r["content"]))) / len(q_terms) if q_terms else 0.0
+        score = 0.4 * sims[i] + 0.2 * bm25[i] + 0.2 * rrf[i] + 0.2 * overlap
+        scored.append((score, r))
+    scored.sort(key=lambda x: -x[0])
+    return scored
+
+
+def mmr_order(scored: Sequence[Tuple[float, Row]], lambda_: float = 0.7) -> List[Row]:
+    """最大边际相关性：λ·相关度 − (1−λ)·与已选块的最大 Jaccard 相似度"""
+    remaining = [(s, r, set(tokenize(r["content"]))) for s, r in scored]
+    redundancy = [0.0] * len(remaining)  # 与已选块的最大相似度，每选一个块增量更新
+    order: List[Row] = []
+    while remaining:
+        best_i = max(
+            range(len(remaining)),
+            key=lambda i: lambda_ * remaining[i][0] - (1 - lambda_) * redundancy[i],
+        )
+        _, row, terms = remaining.pop(best_i)
+        redundancy.pop(best_i)
+        order.append(row)
+        for i, (_, _, other) in enumerate(remaining):
+            redundancy[i] = max(redundancy[i], _jaccard(terms, other))
+    return order
+
+
+def build_context(
+    question: str,
+    candidates: Sequence[Row],
+    max_chunks: int,
+    token_budget: int,
+    lambda_: float = 0.7,
+) -> Tuple[List[Row], ContextStats]:
+    stats = ContextStats(candidates=len(candidates), budget=token_budget)
+    selected: List[Row] = []
+    for row in mmr_order(rerank(question, candidates), lambda_):
+        if len(selected) >= max_chunks:
+            break
+        cost = estimate_tokens(row["content"])
+        if token_budget > 0 and stats.tokens + cost > token_budget:
+            stats.dropped_for_budget += 1
+            continue  # 较短的后续块仍可能放得下
+        selected.append(row)
+        stats.tokens += cost
+    stats.kept = len(selected)
+    return selected, stats
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
@@ -0,0 +1,244 @@
+"""Echidna 常驻容器池
+=================
+
+每次 `docker run --rm` 都要付出容器启动成本。这里维护一组长期运行的
+eth-security-toolbox 容器，分析任务通过 `docker exec` 在池成员中执行：
+
+- 所有容器挂载同一个宿主机目录 `root`，每个任务在其中使用独立子目录；
+- 取用前按 `health_check_interval` 做健康检查，不健康的成员被丢弃重建；
+- 成员执行满 `max_jobs_per_worker` 个任务后回收；
+- 任务超时或被取消时该成员直接销毁（容器内进程无法随 `docker exec` 客户端退出）；
+- 最多 `max_size` 个成员，全部忙碌时排队等待。
+
+`LocalWorker` 在宿主机直接运行命令，可用于本地已安装 echidna 的环境或测试。
+"""
+from __future__ import annotations
+
+import abc
+import asyncio
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from subproc import run_command
+
+
+class PoolWorker(abc.ABC):
+    """池成员接口"""
+
+    name: str = ""
+
+    def __init__(self):
+        self.jobs_done = 0
+        self.last_check = 0.0
+
+    @abc.abstractmethod
+    async def start(self) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def exec(self, args: List[str], job_dir: str, timeout: float) -> tuple[int, str, str]:
+        """在成员内执行命令；job_dir 为相对池根目录的任务子目录"""
+
+    @abc.abstractmethod
+    async def healthy(self) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def stop(self) -> None:
+        ...
+
+
+class DockerWorker(PoolWorker):
+    """`docker run -d ... sleep infinity` 的常驻容器，任务通过 `docker exec -w` 执行"""
+
+    def __init__(self, image: str, root: Path, mount: str = "/work"):
+        super().__init__()
+        self.image = image
+        self.root = root
+        self.mount = mount
+        self.name = f"echidna-pool-{uuid.uuid4().hex[:12]}"
+
+    async def start(self) -> None:
+        code, _, err = await run_command(
+            [
+                "docker", "run", "-d", "--rm",
+                "--name", self.name,
+                "--label", "rag-audit.echidna-pool=1",
+                "-v", f"{self.root}:{self.mount}",
+                "--entrypoint", "sleep",
+                self.image, "infinity",
+            ],
+            timeout=120,
+        )
+        if code != 0:
+            raise RuntimeError(f"Echidna 容器启动失败: {err[:300]}")
+        self.last_check = time.time()
+
+    async def exec(self, args: List[str], job_dir: str, timeout: float) -> tuple[int, str, str]:
+        return await run_command(
+            ["docker", "exec", "-w", f"{self.mount}/{job_dir}", self.name, *args],
+            timeout=timeout,
+        )
+
+    async def healthy(self) -> bool:
+        try:
+            code, out, _ = await run_command(
+                ["docker", "inspect", "--format", "{{.State.Running}}", self.name], timeout=10
+            )
+        except Exception:
+            return False
+        return code == 0 and out.strip() == "true"
+
+    async def stop(self) -> None:
+        try:
+            await run_command(["docker", "rm", "-f", self.name], timeout=30)
+        except Exception as e:
+            print(f"⚠️  清理 Echidna 容器 {self.name} 失败: {e}")
+
+
+class LocalWorker(PoolWorker):
+    """本地执行器：直接在宿主机的任务目录中运行命令"""
+
+    def __init__(self, root: Path, prefix: List[str] | None = None):
+        super().__init__()
+        self.root = root
+        self.prefix = prefix or []
+        self.name = f"local-{uuid.uuid4().hex[:8]}"
+        self.stopped = False
+
+    async def start(self) -> None:
+        self.last_check = time.time()
+
+    async def exec(self, args: List[str], job_dir: str, timeout: float) -> tuple[int, str, str]:
+        return await run_command([*self.prefix, *args], timeout=timeout, cwd=self.root / job_dir)
+
+    async def healthy(self) -> bool:
+        return not self.stopped
+
+    async def stop(self) -> None:
+        self.stopped = True
+
+
+class EchidnaPool:
+    """有界的常驻执行器池（需在同一个事件循环中使用）"""
+
+    def __init__(
+        self,
+        factory: Callable[[], PoolWorker],
+        root: str | Path,
+        max_size: int = 2,
+        max_jobs_per_worker: int = 50,
+        health_check_interval: float = 30.0,
+    ):
+        self.factory = factory
+        self.root = Path(root)
+        self.max_size = max_size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.health_check_interval = health_check_interval
+        self._idle: List[PoolWorker] = []
+        self._size = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self.started = 0
+        self.recycled = 0
+        self.unhealthy = 0
+        self.jobs = 0
+
+    # ------------------------------------------------------------------ 接口
+    def job_dir(self) -> tuple[str, Path]:
+        """分配一个任务目录，返回 (相对名, 宿主机路径)"""
+        name = uuid.uuid4().hex
+        path = self.root / name
+        path.mkdir(parents=True, exist_ok=True)
+        return name, path
+
+    async def run(self, args: List[str], job_dir: str, timeout: float) -> tuple[int, str, str]:
+        worker = await self._acquire()
+        broken = True
+        try:
+            result = await worker.exec(args, job_dir, timeout)
+            broken = False
+            return result
+        finally:
+            await self._release(worker, broken)
+
+    async def close(self) -> None:
+        cond = self._condition()
+        async with cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for w in idle:
+            await w.stop()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self._size,
+            "idle": len(self._idle),
+            "max_size": self.max_size,
+            "jobs": self.jobs,
+            "started": self.started,
+            "recycled": self.recycled,
+            "unhealthy": self.unhealthy,
+        }
+
+    # ------------------------------------------------------------------ 内部
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def _acquire(self) -> PoolWorker:
+        cond = self._condition()
+        while True:
+            async with cond:
+                while not self._idle and self._size >= self.max_size:
+                    await cond.wait()
+                if not self._idle:
+                    self._size += 1
+                    break
+                worker = self._idle.pop()  # 已从空闲表取出：检查期间不会被其他任务取用
+            if time.time() - worker.last_check < self.health_check_interval:
+                return worker
+            # 健康检查（docker inspect，可能耗时数秒）不持锁，其他任务照常取用、归还成员；
+            # 检查出错或被取消时同样丢弃该成员
+            ok = False
+            try:
+                ok = await worker.healthy()
+            finally:
+                if ok:
+                    worker.last_check = time.time()
+                else:
+                    async with cond:
+                        self.unhealthy += 1
+                        self._size -= 1
+                        cond.notify()
+                    asyncio.create_task(worker.stop())
+            if ok:
+                return worker
+
+        worker = self.factory()
+        try:
+            await worker.start()
+        except BaseException:
+            async with cond:
+                self._size -= 1
+                cond.notify()
+            raise
+        self.started += 1
+        return worker
+
+    async def _release(self, worker: PoolWorker, broken: bool) -> None:
+        worker.jobs_done += 1
+        self.jobs += 1
+        retire = broken or worker.jobs_done >= self.max_jobs_per_worker
+        cond = self._condition()
+        async with cond:
+            if retire:
+                self._size -= 1
+                self.recycled += 1
+            else:
+                self._idle.append(worker)
+            cond.notify()
+        if retire:
+            await asyncio.shield(worker.stop())
@@ -0,0 +1,210 @@
+"""向量缓存（内容寻址）
+====================
+
+键为 sha256(model, task_type, text)：
+
+- 进程内 LRU（OrderedDict），命中无 I/O；
+- 可选 SQLite 磁盘层（WAL 模式），重启后仍有效，多个 uvicorn worker 可共享同一文件；
+- 内存 / 磁盘条目数上限，磁盘层按 last_used 淘汰；
+- hit/miss 计数，`stats()` 输出；
+- 更换 embedding 模型时 `purge_other_models()` 删除旧模型的向量。
+"""
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+Vector = List[float]
+
+
+def cache_key(model: str, task_type: str, text: str) -> str:
+    h = hashlib.sha256()
+    for part in (model, task_type, text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def _pack(vec: Sequence[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def _unpack(blob: bytes) -> Vector:
+    arr = array("f")
+    arr.frombytes(blob)
+    return arr.tolist()
+
+
+class EmbeddingCache:
+    """LRU + SQLite 两级向量缓存（线程安全）"""
+
+    def __init__(
+        self,
+        model: str,
+        path: str | Path | None = None,
+        max_memory_items: int = 10_000,
+        max_disk_items: int = 500_000,
+    ):
+        self.model = model
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self._mem: "OrderedDict[str, Vector]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts_since_prune = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, model TEXT NOT NULL,"
+                " vec BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)"
+            )
+            self._db.commit()
+
+    # ------------------------------------------------------------------ 读
+    def get_many(self, texts: Sequence[str], task_type: str) -> List[Optional[Vector]]:
+        keys = [cache_key(self.model, task_type, t) for t in texts]
+        out: List[Optional[Vector]] = [None] * len(keys)
+        missing: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, k in enumerate(keys):
+                vec = self._mem.get(k)
+                if vec is not None:
+                    self._mem.move_to_end(k)
+                    self.memory_hits += 1
+                    out[i] = vec
+                else:
+                    missing.setdefault(k, []).append(i)
+
+            if missing and self._db is not None:
+                found = self._db_get(list(missing))
+                for k, vec in found.items():
+                    self._remember(k, vec)
+                    for i in missing.pop(k):
+                        out[i] = vec
+                        self.disk_hits += 1
+
+            self.misses += sum(len(idx) for idx in missing.values())
+        return out
+
+    def get(self, text: str, task_type: str) -> Optional[Vector]:
+        return self.get_many([text], task_type)[0]
+
+    # ------------------------------------------------------------------ 写
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Vector], task_type: str) -> None:
+        now = time.time()
+        rows = []
+        with self._lock:
+            for t, vec in zip(texts, vectors):
+                k = cache_key(self.model, task_type, t)
+                vec = list(vec)
+                self._remember(k, vec)
+                rows.append((k, self.model, _pack(vec), now))
+            if self._db is not None and rows:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings(key, model, vec, last_used)"
+                    " VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                self._db.commit()
+                self._puts_since_prune += len(rows)
+                if self._puts_since_prune >= max(1, min(1000, self.max_disk_items // 10)):
+                    self._prune_disk()
+
+    def put(self, text: str, vector: Vector, task_type: str) -> None:
+        self.put_many([text], [vector], task_type)
+
+    # ------------------------------------------------------------------ 维护
+    def purge_other_models(self) -> int:
+        """删除非当前模型的磁盘条目，返回删除条数"""
+        with self._lock:
+            if self._db is None:
+                return 0
+            cur = self._db.execute("DELETE FROM embeddings WHERE model != ?", (self.model,))
+            self._db.commit()
+            return cur.rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, int | float | str]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            disk_items = (
+                self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                if self._db is not None
+                else 0
+            )
+            return {
+                "model": self.model,
+                "memory_items": len(self._mem),
+                "disk_items": disk_items,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # ------------------------------------------------------------------ 内部（调用方持有锁）
+    def _remember(self, key: str, vec: Vector) -> None:
+        self._mem[key] = vec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_memory_items:
+            self._mem.popitem(last=False)
+
+    def _db_get(self, keys: List[str]) -> Dict[str, Vector]:
+        found: Dict[str, Vector] = {}
+        for start in range(0, len(keys), 500):  # SQLite 参数个数上限
+            part = keys[start:start + 500]
+            marks = ",".join("?" * len(part))
+            for k, blob in self._db.execute(
+                f"SELECT key, vec FROM embeddings WHERE key IN ({marks})", part
+            ):
+                found[k] = _unpack(blob)
+        if found:
+            now = time.time()
+            self._db.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(now, k) for k in found],
+            )
+            self._db.commit()
+        return found
+
+    def _prune_disk(self) -> None:
+        self._puts_since_prune = 0
+        (count,) = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_disk_items
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self._db.commit()
@@ -0,0 +1,81 @@
+"""批量向量化流水线
+================
+
+把待入库的文本块切成批次，每批一次多内容 `embed_content` 请求，
+并用有界线程池控制同时在途的批次数；输出顺序与输入顺序一致。
+
+```
+vectors = embed_in_batches(chunks, embed_batch, batch_size=64, max_concurrency=4)
+```
+
+`embed_batch(texts) -> List[List[float]]` 由调用方提供（生产环境为 Gemini，
+测试/基准中为本地假 embedder），本模块不依赖任何外部服务。
+"""
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Sequence
+
+EmbedBatchFn = Callable[[List[str]], List[List[float]]]
+
+
+def make_batches(texts: Iterable[str], batch_size: int) -> Iterator[List[str]]:
+    """按 batch_size 切分文本（惰性，可接收生成器）"""
+    if batch_size < 1:
+        raise ValueError("batch_size 必须 >= 1")
+    batch: List[str] = []
+    for t in texts:
+        batch.append(t)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_embedded_batches(
+    batches: Iterable[List[str]],
+    embed_batch: EmbedBatchFn,
+    max_concurrency: int = 4,
+) -> Iterator[tuple[List[str], List[List[float]]]]:
+    """并发执行 embed_batch，按输入顺序逐批产出 (texts, vectors)
+
+    同一时刻最多 max_concurrency 个批次在途；上游是生成器时也只会
+    提前读取这么多批，内存占用与批大小成正比而非与总量成正比。
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency 必须 >= 1")
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        window: deque = deque()
+        for batch in batches:
+            if len(window) >= max_concurrency:
+                texts, fut = window.popleft()
+                yield texts, _checked(texts, fut.result())
+            window.append((batch, pool.submit(embed_batch, batch)))
+        while window:
+            texts, fut = window.popleft()
+            yield texts, _checked(texts, fut.result())
+
+
+def embed_in_batches(
+    texts: Sequence[str],
+    embed_batch: EmbedBatchFn,
+    batch_size: int = 64,
+    max_concurrency: int = 4,
+) -> List[List[float]]:
+    """对全部文本做批量向量化，返回与 texts 一一对应的向量列表"""
+    vectors: List[List[float]] = []
+    for _, vecs in iter_embedded_batches(
+        make_batches(texts, batch_size), embed_batch, max_concurrency
+    ):
+        vectors.extend(vecs)
+    return vectors
+
+
+def _checked(texts: List[str], vectors: List[List[float]]) -> List[List[float]]:
+    if len(vectors) != len(texts):
+        raise RuntimeError(
+            f"向量数量与文本数量不一致: {len(vectors)} != {len(texts)}"
+        )
+    return vectors
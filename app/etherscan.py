@@ -0,0 +1,306 @@
+"""Etherscan 源码客户端
+===================
+
+- 共享的 `requests.Session`（keep-alive 连接池），不再每次新建连接；首次发请求时才导入 requests 并创建；
+- 令牌桶限速，默认每秒 5 次（Etherscan 免费档上限），多线程共享；
+- 按 (chain, address) 缓存已验证源码（进程内 + SQLite），重复分析同一地址不再访问网络；
+- 多链：通过 Etherscan V2 接口的 `chainid` 参数访问，链名见 `CHAIN_IDS`；
+- 多文件合约的 `SourceCode` 是 standard-JSON（`{{...}}` 或 `{...}`），展开为文件树。
+"""
+from __future__ import annotations
+
+import json
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    import requests
+
+API_URL = "https://api.etherscan.io/v2/api"
+
+CHAIN_IDS: Dict[str, int] = {
+    "ethereum": 1,
+    "mainnet": 1,
+    "sepolia": 11155111,
+    "holesky": 17000,
+    "bsc": 56,
+    "polygon": 137,
+    "arbitrum": 42161,
+    "optimism": 10,
+    "base": 8453,
+    "avalanche": 43114,
+    "linea": 59144,
+    "scroll": 534352,
+}
+
+
+def chain_id(chain: str | int) -> int:
+    """链名（不区分大小写）或数字 chainid → chainid"""
+    if isinstance(chain, int):
+        return chain
+    name = str(chain).strip().lower()
+    if name.isdigit():
+        return int(name)
+    if name not in CHAIN_IDS:
+        raise ValueError(f"不支持的链: {chain}")
+    return CHAIN_IDS[name]
+
+
+def address_doc_id(address: str, chain: str | int) -> str:
+    """地址分析的 doc_id：带链的完整小写地址（CAIP-10，如 `eip155:1:0xabc...`）
+
+    重新分析会替换 doc_id 下的已存行，不同地址、不同链上的同一地址必须各自独立。
+    """
+    return f"eip155:{chain_id(chain)}:{address.strip().lower()}"
+
+
+class TokenBucket:
+    """线程安全令牌桶：每秒补充 rate 个，最多积累 capacity 个"""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """取一个令牌，必要时阻塞等待；返回等待秒数"""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+@dataclass
+class ContractSource:
+    address: str
+    chain_id: int
+    contract_name: str
+    files: Dict[str, str]  # 相对路径 → 源码
+    main_file: str
+    compiler_version: str = ""
+    remappings: List[str] = field(default_factory=list)
+
+    def digest(self) -> bytes:
+        """整个文件树的规范化字节，用作分析缓存指纹的源码部分"""
+        if len(self.files) == 1:
+            return next(iter(self.files.values())).encode("utf-8")
+        return json.dumps(
+            {"files": self.files, "remappings": self.remappings}, sort_keys=True, ensure_ascii=False
+        ).encode("utf-8")
+
+    def write_tree(self, root: Path) -> Path:
+        """把源码写入 root 下的文件树，返回主文件路径"""
+        for rel, content in self.files.items():
+            path = root / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content, encoding="utf-8")
+        return root / self.main_file
+
+
+def _safe_path(name: str) -> str:
+    """standard-JSON 中的源文件名 → 不会逃出根目录的相对路径"""
+    parts = [p for p in PurePosixPath(name.replace("\\", "/")).parts if p not in ("/", "", ".", "..")]
+    if not parts:
+        raise ValueError(f"非法的源文件路径: {name!r}")
+    return "/".join(parts)
+
+
+def parse_source_code(raw: str, contract_name: str, address: str = "") -> tuple[Dict[str, str], str, List[str]]:
+    """解析 `SourceCode` 字段，返回 (文件树, 主文件, remappings)
+
+    单文件源码写为 `<ContractName>.sol`；standard-JSON 的主文件为声明了该合约的文件。
+    """
+    text = raw.strip()
+    if not text:
+        raise RuntimeError(f"合约源码未验证: {address}")
+    if not text.startswith("{"):
+        return {f"{contract_name or 'Contract'}.sol": raw}, f"{contract_name or 'Contract'}.sol", []
+
+    if text.startswith("{{") and text.endswith("}}"):
+        text = text[1:-1]
+    data = json.loads(text)
+    sources = data.get("sources", data) if isinstance(data, dict) else {}
+    files = {_safe_path(name): (src or {}).get("content", "") for name, src in sources.items()}
+    if not files:
+        raise RuntimeError(f"无法解析 standard-JSON 源码: {address}")
+    remappings = list((data.get("settings") or {}).get("remappings") or [])
+
+    declares = re.compile(rf"\b(?:abstract\s+)?contract\s+{re.escape(contract_name)}\b") if contract_name else None
+    main = next(
+        (p for p in files if PurePosixPath(p).stem == contract_name),
+        None,
+    ) or next(
+        (p for p, c in files.items() if declares and declares.search(c)),
+        next(iter(files)),
+    )
+    return files, main, remappings
+
+
+class SourceCache:
+    """(chainid, address) → ContractSource；path 为 None 时仅进程内字典"""
+
+    def __init__(self, path: str | Path | None = None):
+        self._lock = threading.Lock()
+        self._mem: Dict[tuple[int, str], ContractSource] = {}
+        self.hits = 0
+        self.misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sources ("
+                " chain_id INTEGER NOT NULL, address TEXT NOT NULL,"
+                " source TEXT NOT NULL, fetched_at REAL NOT NULL,"
+                " PRIMARY KEY (chain_id, address))"
+            )
+            self._db.commit()
+
+    def get(self, chain: int, address: str) -> Optional[ContractSource]:
+        key = (chain, address.lower())
+        with self._lock:
+            source = self._mem.get(key)
+            if source is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT source FROM sources WHERE chain_id = ? AND address = ?", key
+                ).fetchone()
+                if row:
+                    source = ContractSource(**json.loads(row[0]))
+                    self._mem[key] = source
+            if source is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return source
+
+    def put(self, source: ContractSource) -> None:
+        key = (source.chain_id, source.address.lower())
+        with self._lock:
+            self._mem[key] = source
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sources(chain_id, address, source, fetched_at) VALUES (?, ?, ?, ?)",
+                    (*key, json.dumps(asdict(source), ensure_ascii=False), time.time()),
+                )
+                self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = (
+                self._db.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+                if self._db is not None
+                else len(self._mem)
+            )
+            return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+class EtherscanClient:
+    """带连接池、限速与源码缓存的 Etherscan `getsourcecode` 客户端"""
+
+    def __init__(
+        self,
+        api_key: str | None,
+        cache: SourceCache | None = None,
+        rate: float = 5.0,
+        timeout: float = 15.0,
+        max_retries: int = 3,
+        pool_size: int = 8,
+        session: requests.Session | None = None,
+        api_url: str = API_URL,
+    ):
+        self.api_key = api_key
+        self.cache = cache if cache is not None else SourceCache()
+        self.bucket = TokenBucket(rate)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.api_url = api_url
+        self.requests = 0  # 实际发出的 HTTP 请求数
+        self.pool_size = pool_size
+        self._session = session
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self) -> "requests.Session":
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def fetch(self, address: str, chain: str | int = "ethereum") -> ContractSource:
+        """已验证源码（先查缓存）"""
+        cid = chain_id(chain)
+        cached = self.cache.get(cid, address)
+        if cached is not None:
+            return cached
+        if not self.api_key:
+            raise RuntimeError("需要设置 ETHERSCAN_API_KEY 才能通过地址下载源码")
+
+        result = self._get_source(cid, address)
+        files, main, remappings = parse_source_code(
+            result.get("SourceCode", ""), result.get("ContractName", ""), address
+        )
+        source = ContractSource(
+            address=address,
+            chain_id=cid,
+            contract_name=result.get("ContractName") or PurePosixPath(main).stem,
+            files=files,
+            main_file=main,
+            compiler_version=result.get("CompilerVersion", ""),
+            remappings=remappings,
+        )
+        self.cache.put(source)
+        return source
+
+    def _get_source(self, cid: int, address: str) -> Dict:
+        params = {
+            "chainid": cid,
+            "module": "contract",
+            "action": "getsourcecode",
+            "address": address,
+            "apikey": self.api_key,
+        }
+        for attempt in range(self.max_retries):
+            self.bucket.acquire()
+            self.requests += 1
+            resp = self.session.get(self.api_url, params=params, timeout=self.timeout)
+            resp.raise_for_status()
+            body = resp.json()
+            if body.get("status") == "1" and body.get("result"):
+                return body["result"][0]
+            message = str(body.get("result") or body.get("message") or "")
+            # 超出限速（多进程共享同一 API key 时可能发生）：退避后重试
+            if "rate limit" in message.lower() and attempt < self.max_retries - 1:
+                time.sleep(2 ** attempt)
+                continue
+            raise RuntimeError(f"Etherscan 获取源码失败: {message or body}")
+        raise RuntimeError("Etherscan 获取源码失败: 超出限速")
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.cache.stats(), "requests": self.requests}
+
@@ -0,0 +1,86 @@
+"""请求路径上的有界线程池
+======================
+
+supabase-py 与 `google.generativeai` 都是同步 SDK。`async def` 端点里直接调用会占住事件循环，
+同一 worker 上的其他请求（包括 `/health`）只能排队；`asyncio.to_thread` 虽不阻塞循环，
+但所有调用共用默认线程池，慢请求堆积时既无上限也无从观察。
+
+`BoundedExecutor` 给一类调用一个独立的线程池：
+
+- `workers` 个线程同时执行，其余排队；
+- 在途（执行中 + 排队）超过 `max_pending` 时立即抛 `ExecutorBusy`，端点映射为 503，
+  而不是让请求无限排队直到超时（0 不限）；
+- `await pool.run(fn, *args)` 不占事件循环；协程被取消时尚未开始的调用随之取消；
+- `stats()` 供 `/cache/stats` 展示在途与拒绝数。
+
+```
+data_pool = BoundedExecutor("data", workers=16, max_pending=256)
+rows = await data_pool.run(vector_store.search, q_emb, 5)
+```
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class ExecutorBusy(RuntimeError):
+    """在途调用已达上限"""
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, workers: int, max_pending: int = 0):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_pending = max(0, max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(self, fn: Callable[..., T], *args: Any) -> "Future[T]":
+        """提交到线程池（沿用调用方的 contextvars）；在途已满时抛 ExecutorBusy"""
+        with self._lock:
+            if self.max_pending and self._pending >= self.max_pending:
+                self.rejected += 1
+                raise ExecutorBusy(f"{self.name} 线程池繁忙（在途 {self._pending}）")
+            self._pending += 1
+        ctx = contextvars.copy_context()
+        try:
+            fut = self._pool.submit(ctx.run, fn, *args)
+        except BaseException:  # 线程池已关闭
+            with self._lock:
+                self._pending -= 1
+            raise
+        fut.add_done_callback(self._done)
+        return fut
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+    def _done(self, _fut) -> None:
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
@@ -0,0 +1,236 @@
+"""发现去重（入库前）
+================
+
+同一检测器（如 `naming-convention`、`solc-version`）在整个代码库中会产生成百上千条
+只有元素名不同的描述。`FindingDeduper` 在扁平化之后、向量化之前把它们分组：
+
+- 先把文本中的元素名、`file.sol#12-14` 位置、十六进制与数字替换为占位符；
+- 归一化文本完全相同 → 精确重复（sha1）；
+- 否则对词级 shingle 计算 MinHash，经 LSH 分桶找候选，估计 Jaccard >= `threshold` → 近似重复；
+- 只在同一 `scope`（如 `slither:<check>:<impact>`）内分组。
+
+每组只入库一个代表块，附带出现次数与涉及的元素列表（最多 `max_elements` 个）。
+
+每组的 `key`（代表发现的 scope + 归一化文本的 sha1）作为入库行的 `fingerprint`：
+重新分析同一文档时 `diff_findings()` 与已存行比较，只有新出现的发现需要向量化，
+文本有变化（次数/元素列表）的只更新元数据，消失的发现从库中删除。
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_MERSENNE = (1 << 31) - 1
+_LOCATION = re.compile(r"[\w./-]+\.sol#\d+(?:-\d+)?")
+_HEX = re.compile(r"0x[0-9a-fA-F]+")
+_NUMBER = re.compile(r"\d+")
+_WORD = re.compile(r"<\w+>|[^\W\d_]+|[^\w\s]", re.U)
+
+
+@dataclass
+class FindingGroup:
+    scope: str
+    text: str  # 代表（首次出现）的文本块
+    count: int = 1
+    elements: List[str] = field(default_factory=list)
+    more_elements: int = 0  # 超出 max_elements 未列出的元素数
+    meta: Dict = field(default_factory=dict)  # 代表发现的结构化字段（tool / detector / impact ...）
+    key: str = ""  # 指纹：不随行号、元素名与重复次数变化
+
+    def chunk(self) -> str:
+        """入库文本：单次出现保持原样，重复出现时追加次数与元素列表"""
+        if self.count == 1:
+            return self.text
+        els = ", ".join(self.elements)
+        if self.more_elements:
+            els += f" 等另 {self.more_elements} 个"
+        return f"{self.text} | 相似发现:{self.count} 处 | 涉及元素:{els}"
+
+    def add_elements(self, elements: Sequence[str], max_elements: int) -> None:
+        for e in elements:
+            if not e or e in self.elements:
+                continue
+            if len(self.elements) < max_elements:
+                self.elements.append(e)
+            else:
+                self.more_elements += 1
+
+    def absorb(self, other: "FindingGroup", max_elements: int) -> None:
+        """并入同一指纹的另一组（分批去重时同一发现可能出现在多个批次中）"""
+        self.count += other.count
+        self.add_elements(other.elements, max_elements)
+        self.more_elements += other.more_elements
+
+
+def normalize(text: str, elements: Sequence[str] = ()) -> str:
+    """去掉只因位置/元素不同而变化的部分"""
+    names = sorted({e for e in elements if e}, key=len, reverse=True)
+    if names:
+        pattern = r"(?<![\w$])(?:" + "|".join(re.escape(n) for n in names) + r")(?![\w$])"
+        text = re.sub(pattern, "<E>", text)
+    text = _LOCATION.sub("<LOC>", text)
+    text = _HEX.sub("<HEX>", text)
+    text = _NUMBER.sub("<N>", text)
+    return " ".join(text.lower().split())
+
+
+class MinHasher:
+    """`(a*h + b) mod p` 置换族上的 MinHash 签名"""
+
+    def __init__(self, num_perm: int = 64, shingle: int = 3, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle = shingle
+        self._a = rng.integers(1, _MERSENNE, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE, num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        words = _WORD.findall(text)
+        k = self.shingle
+        grams = {" ".join(words[i:i + k]) for i in range(max(1, len(words) - k + 1))}
+        h = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest(), "little") % _MERSENNE
+             for g in grams),
+            dtype=np.uint64,
+            count=len(grams),
+        )
+        return ((self._a[:, None] * h[None, :] + self._b[:, None]) % _MERSENNE).min(axis=1)
+
+
+class FindingDeduper:
+    """增量分组：`add()` 逐条加入，`drain()` 取出当前全部分组并清空"""
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 64,
+        bands: int = 16,
+        max_elements: int = 50,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须是 bands 的整数倍")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_elements = max_elements
+        self._hasher = MinHasher(num_perm)
+        self._reset()
+        self._occurrences: Dict[str, int] = {}  # 跨 drain() 保留：同一份报告分批去重时序号连续
+        self.seen = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def add(self, scope: str, text: str, elements: Sequence[str] = (), meta: Optional[Dict] = None) -> FindingGroup:
+        self.seen += 1
+        norm = normalize(text, elements)
+        exact = hashlib.sha1(f"{scope}\x00{norm}".encode("utf-8")).hexdigest()
+
+        gid = self._exact.get(exact)
+        if gid is not None:
+            self.exact_duplicates += 1
+            return self._merge(gid, elements)
+
+        sig = self._hasher.signature(norm)
+        keys = [(scope, b, sig[b * self.rows:(b + 1) * self.rows].tobytes()) for b in range(self.bands)]
+        gid = self._near_match(sig, keys)
+        if gid is not None:
+            self.near_duplicates += 1
+            self._exact[exact] = gid
+            return self._merge(gid, elements)
+
+        gid = len(self._groups)
+        group = FindingGroup(scope=scope, text=text, meta=dict(meta or {}), key=exact)
+        self._groups.append(group)
+        self._signatures.append(sig)
+        self._exact[exact] = gid
+        for key in keys:
+            self._buckets.setdefault(key, []).append(gid)
+        group.add_elements(elements, self.max_elements)
+        return group
+
+    def unique_scope(self, scope: str, text: str) -> str:
+        """不参与去重的发现使用的 scope：由原文决定，与在报告中的位置无关（指纹不随前面发现的增删而变）；
+        原文完全相同的发现按第几次出现区分"""
+        digest = hashlib.sha1(f"{scope}\x00{text}".encode("utf-8")).hexdigest()[:16]
+        n = self._occurrences.get(digest, 0)
+        self._occurrences[digest] = n + 1
+        return f"{scope}:{digest}:{n}"
+
+    def drain(self) -> List[FindingGroup]:
+        groups = self._groups
+        self._reset()
+        return groups
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "seen": self.seen,
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+            "pending_groups": len(self._groups),
+        }
+
+    # ------------------------------------------------------------------ 内部
+    def _reset(self) -> None:
+        self._groups: List[FindingGroup] = []
+        self._signatures: List[np.ndarray] = []
+        self._exact: Dict[str, int] = {}
+        self._buckets: Dict[Tuple[str, int, bytes], List[int]] = {}
+
+    def _near_match(self, sig: np.ndarray, keys) -> Optional[int]:
+        if self.threshold > 1:
+            return None
+        seen = set()
+        for key in keys:
+            for gid in self._buckets.get(key, ()):
+                if gid in seen:
+                    continue
+                seen.add(gid)
+                if float(np.mean(self._signatures[gid] == sig)) >= self.threshold:
+                    return gid
+        return None
+
+    def _merge(self, gid: int, elements: Sequence[str]) -> FindingGroup:
+        group = self._groups[gid]
+        group.count += 1
+        group.add_elements(elements, self.max_elements)
+        return group
+
+
+@dataclass
+class FindingDiff:
+    new: List[FindingGroup] = field(default_factory=list)  # 需要向量化入库
+    changed: List[FindingGroup] = field(default_factory=list)  # 已存在但入库文本变化，只更新元数据
+    unchanged: int = 0
+    stale: List[Optional[str]] = field(default_factory=list)  # 需删除的已存指纹（None 为无指纹的旧行）
+
+
+def diff_findings(stored: Sequence[Dict], groups: Sequence[FindingGroup]) -> FindingDiff:
+    """已存行（`fingerprint` + `content`）与本次分组对比
+
+    同一指纹存了多行（如并发入库）时全部删除并重新入库。
+    """
+    current: Dict[str, FindingGroup] = {}
+    for g in groups:
+        current.setdefault(g.key, g)
+    stored_content: Dict[Optional[str], List[str]] = {}
+    for row in stored:
+        stored_content.setdefault(row.get("fingerprint"), []).append(row.get("content", ""))
+
+    diff = FindingDiff()
+    diff.stale = [fp for fp, rows in stored_content.items() if fp not in current or len(rows) > 1]
+    for key, g in current.items():
+        rows = stored_content.get(key)
+        if not rows or len(rows) > 1:
+            diff.new.append(g)
+        elif rows[0] != g.chunk():
+            diff.changed.append(g)
+        else:
+            diff.unchanged += 1
+    return diff
@@ -0,0 +1,368 @@
+"""Gemini 调用层（向量化与生成共用）
+================================
+
+- `AdaptiveLimiter`：AIMD 并发上限。每次成功上调 `1/limit`（约每轮 +1），遇到 429 /
+  `ResourceExhausted` 减半（`cooldown` 秒内只减一次）；线程用 `slot()`、协程用 `async_slot()` 等待名额，
+  协程等待时不占线程也不阻塞事件循环；
+- 退避为完全抖动的指数退避 `uniform(0, min(max_delay, base_delay * 2**attempt))`，限流时基数加倍；
+- `CircuitBreaker`：连续 `failure_threshold` 次服务端错误（5xx / 超时 / 连接失败）后打开，
+  `reset_timeout` 秒内直接抛 `CircuitOpenError`，之后放行一个探测请求，成功即关闭。服务的 4xx 应答
+  视为服务可用（清零失败计数），本地的程序错误（`TypeError` / `KeyError` 等）不影响熔断状态；
+- `RetryQueue`：最终仍失败的待向量化文本块暂存于此，由调用方稍后重试，不再以零向量入库。
+
+`GeminiClient.call(op, fn)` 在当前线程执行并阻塞等待（供向量化线程池等工作线程使用）；
+`call_async(op, fn)` 把 SDK 调用放进客户端自己的线程池（大小为并发上限的最大值，持有名额的调用
+总有线程可用，不会与在共享线程池里阻塞等待名额的同步调用互相死锁），限流等待与退避都是 `await`。
+`fn` 是对 SDK 的零参调用，本模块不依赖 `google.generativeai`：
+
+```
+client = GeminiClient()
+resp = client.call("batch", lambda: genai.embed_content(model=..., content=texts))
+answer = await client.call_async("generate", lambda: model.generate_content(prompt))
+```
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+RATE_LIMITED = "rate_limit"
+TRANSIENT = "transient"
+FATAL = "fatal"
+
+_RATE_LIMIT = re.compile(r"\b429\b|resource.?exhausted|rate.?limit|quota|too many requests", re.I)
+_TRANSIENT = re.compile(
+    r"\b50[0234]\b|deadline.?exceeded|service.?unavailable|internal.?server|unavailable|timed? ?out|connection",
+    re.I,
+)
+# 服务对请求本身的拒绝（4xx：参数无效、鉴权失败、模型不存在等）
+_ANSWERED = re.compile(
+    r"\b4\d\d\b|invalid.?argument|permission.?denied|unauthenticated|not.?found|failed.?precondition|api.?key",
+    re.I,
+)
+
+
+def classify_error(exc: BaseException) -> str:
+    """SDK 异常 → `rate_limit` | `transient`（可重试）| `fatal`（参数 / 权限等，不重试）"""
+    text = f"{type(exc).__name__} {exc}"
+    if _RATE_LIMIT.search(text):
+        return RATE_LIMITED
+    if isinstance(exc, (TimeoutError, ConnectionError)) or _TRANSIENT.search(text):
+        return TRANSIENT
+    return FATAL
+
+
+def service_answered(exc: BaseException) -> bool:
+    """FATAL 错误是否是服务的应答（4xx / 参数无效等），而不是本地的程序错误（TypeError、KeyError…）"""
+    if isinstance(exc, (TypeError, LookupError, AttributeError, NameError, AssertionError)):
+        return False
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return 400 <= code < 500
+    return bool(_ANSWERED.search(f"{type(exc).__name__} {exc}"))
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断打开期间的快速失败"""
+
+
+class AdaptiveLimiter:
+    """线程 / 协程共用的自适应并发上限（AIMD），名额释放时按先来后到交给等待者"""
+
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 16, cooldown: float = 1.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.cooldown = cooldown
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._inflight = 0
+        self._waiters: deque = deque()  # threading.Event 或 (loop, future)
+        self._lock = threading.Lock()
+        self._last_decrease = float("-inf")
+        self.rate_limited = 0
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def acquire(self) -> None:
+        with self._lock:
+            if not self._waiters and self._inflight < self.limit:
+                self._inflight += 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        event.wait()
+
+    async def acquire_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters and self._inflight < self.limit:
+                self._inflight += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        fut = waiter[1]
+        try:
+            await fut
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:  # 尚未分到名额
+                    self._waiters.remove(waiter)
+                    raise
+            if fut.done() and not fut.cancelled():  # 已分到名额但随即被取消
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            self._inflight -= 1
+            self._wake_locked()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def async_slot(self):
+        await self.acquire_async()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            self._wake_locked()
+
+    def on_rate_limit(self) -> None:
+        with self._lock:
+            self.rate_limited += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self._limit = max(float(self.min_limit), self._limit / 2)
+                self._last_decrease = now
+
+    def _wake_locked(self) -> None:
+        while self._waiters and self._inflight < self.limit:
+            waiter = self._waiters.popleft()
+            self._inflight += 1
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+                continue
+            loop, fut = waiter
+            try:
+                loop.call_soon_threadsafe(self._grant, fut)
+            except RuntimeError:  # 事件循环已关闭
+                self._inflight -= 1
+
+    def _grant(self, fut: asyncio.Future) -> None:
+        if fut.done():  # 等待者已取消：名额交还
+            self.release()
+        else:
+            fut.set_result(None)
+
+
+class CircuitBreaker:
+    """closed → (连续失败) → open → (reset_timeout 后) half_open → 探测成功 closed / 失败 open"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, clock=time.monotonic):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self) -> None:
+        """熔断打开（或半开且已有探测请求在途）时抛 CircuitOpenError"""
+        with self._lock:
+            if self._state == self.OPEN:
+                remaining = self.reset_timeout - (self._clock() - self._opened_at)
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(f"Gemini 熔断中，{remaining:.0f}s 后重试")
+                self._state = self.HALF_OPEN
+            if self._state == self.HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    raise CircuitOpenError("Gemini 熔断半开，等待探测请求结果")
+                self._probing = True
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def on_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+    def on_neutral(self) -> None:
+        """服务可达但被限流：不计失败，半开时允许下一个探测"""
+        with self._lock:
+            self._probing = False
+
+
+class GeminiClient:
+    """重试 + 自适应限流 + 熔断；`on_error(op, kind, will_retry)` 供调用方计数"""
+
+    def __init__(
+        self,
+        limiter: AdaptiveLimiter | None = None,
+        breaker: CircuitBreaker | None = None,
+        max_retries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        on_error: Callable[[str, str, bool], None] | None = None,
+    ):
+        self.limiter = limiter or AdaptiveLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max(1, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.on_error = on_error
+        self._rng = random.Random()
+        self._executor = ThreadPoolExecutor(max_workers=self.limiter.max_limit, thread_name_prefix="gemini")
+
+    def call(self, op: str, fn: Callable[[], T]) -> T:
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                with self.limiter.slot():
+                    result = fn()
+            except Exception as e:
+                delay = self._failed(op, e, attempt)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._succeeded()
+            return result
+
+    async def call_async(self, op: str, fn: Callable[[], T]) -> T:
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                async with self.limiter.async_slot():
+                    ctx = contextvars.copy_context()  # 沿用调用方的 contextvars
+                    result = await asyncio.get_running_loop().run_in_executor(self._executor, ctx.run, fn)
+            except asyncio.CancelledError:
+                self.breaker.on_neutral()
+                raise
+            except Exception as e:
+                delay = self._failed(op, e, attempt)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self._succeeded()
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency_limit": self.limiter.limit,
+            "inflight": self.limiter.inflight,
+            "rate_limited": self.limiter.rate_limited,
+            "circuit": self.breaker.state,
+            "rejected": self.breaker.rejected,
+        }
+
+    # ------------------------------------------------------------------ 内部
+    def _succeeded(self) -> None:
+        self.limiter.on_success()
+        self.breaker.on_success()
+
+    def _failed(self, op: str, exc: Exception, attempt: int) -> float:
+        """记录一次失败；可重试时返回退避秒数，否则重新抛出"""
+        kind = classify_error(exc)
+        if kind == RATE_LIMITED:
+            self.limiter.on_rate_limit()
+            self.breaker.on_neutral()
+        elif kind == TRANSIENT:
+            self.breaker.on_failure()
+        elif service_answered(exc):
+            self.breaker.on_success()  # 服务有响应（如 400），不算故障
+        else:
+            self.breaker.on_neutral()  # 与服务状态无关：不改变熔断计数，只释放半开探测名额
+        will_retry = kind != FATAL and attempt + 1 < self.max_retries
+        if self.on_error is not None:
+            self.on_error(op, kind, will_retry)
+        if not will_retry:
+            raise exc
+        base = self.base_delay * (2 if kind == RATE_LIMITED else 1)
+        return self._rng.uniform(0, min(self.max_delay, base * 2 ** attempt))
+
+
+class RetryQueue:
+    """按 key 去重的待重试项（先进先出），超过 max_items 时丢弃最旧的"""
+
+    def __init__(self, max_items: int = 10000):
+        self.max_items = max_items
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, key: Hashable, item: Any) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = item
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self.dropped += 1
+
+    def take(self, limit: int) -> List[Any]:
+        with self._lock:
+            return [self._items.popitem(last=False)[1] for _ in range(min(limit, len(self._items)))]
+
+    def discard(self, keys: Iterable[Hashable]) -> int:
+        with self._lock:
+            return sum(self._items.pop(k, None) is not None for k in keys)
+
+    def discard_where(self, pred: Callable[[Any], bool]) -> int:
+        with self._lock:
+            stale = [k for k, item in self._items.items() if pred(item)]
+            for k in stale:
+                del self._items[k]
+            return len(stale)
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": len(self._items), "dropped": self.dropped}
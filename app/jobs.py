@@ -0,0 +1,291 @@
+"""后台分析任务
+============
+
+`/analyze` 不再在请求内跑完 Slither/Echidna，而是提交一个 Job 后立即返回：
+
+- JobManager 在独立线程里维护一个事件循环，最多 `workers` 个 Job 同时执行，
+  与 uvicorn 的请求事件循环互不阻塞；
+- Job 记录每个阶段（stage）的状态、起止时间与耗时，`progress` 按已完成阶段计算；
+- 同 id 的 Job 未结束时 `submit()` 抛 `JobRunning`，新提交的输入不会被悄悄丢弃；
+- `cancel()` 取消协程，正在等待的子进程由各阶段自行清理：清理期间 Job 为 `cancelling`（仍拒绝同 id 的
+  新提交），协程真正结束后才是 `cancelled`；
+- Job 在提交方的 contextvars 中执行（如请求所属应用绑定的客户端）；
+- 批量任务的每一项是一个子 Job（`items`），父 Job 的 `progress` 按已结束的子项计算；
+- 已结束的 Job 只保留最近 `max_finished` 个。
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLING = "cancelling"
+CANCELLED = "cancelled"
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+
+class JobRunning(Exception):
+    """同 id 的 Job 尚未结束，不能再提交"""
+
+    def __init__(self, job: "Job"):
+        super().__init__(f"任务 {job.job_id} 尚未结束: {job.status}")
+        self.job = job
+
+
+@dataclass
+class Stage:
+    name: str
+    status: str = PENDING
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    detail: Optional[str] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        end = self.finished_at if self.finished_at is not None else time.time()
+        return round(end - self.started_at, 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "status": self.status,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration": self.duration,
+            "detail": self.detail,
+        }
+
+
+@dataclass
+class Job:
+    job_id: str
+    stages: "OrderedDict[str, Stage]"
+    status: str = PENDING
+    message: Optional[str] = None
+    result: Any = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    items: List["Job"] = field(default_factory=list)  # 批量任务的子项
+    _future: Any = None
+    _task: Any = None  # 任务事件循环中执行 _run 的 Task
+
+    @classmethod
+    def create(cls, job_id: str, stages: List[str]) -> "Job":
+        return cls(job_id, OrderedDict((s, Stage(s)) for s in stages))
+
+    @property
+    def progress(self) -> int:
+        if self.status == COMPLETED:
+            return 100
+        if self.items:
+            return int(sum(1 for j in self.items if j.status in FINISHED) * 100 / len(self.items))
+        if not self.stages:
+            return 0
+        done = sum(1 for s in self.stages.values() if s.status in (COMPLETED, "skipped"))
+        return int(done * 100 / len(self.stages))
+
+    @contextmanager
+    def stage(self, name: str):
+        """标记阶段开始/结束并记录耗时"""
+        st = self.stages.setdefault(name, Stage(name))
+        st.status = RUNNING
+        st.started_at = time.time()
+        self.message = f"{name} 进行中"
+        try:
+            yield st
+        except asyncio.CancelledError:
+            st.status = CANCELLED
+            raise
+        except BaseException:
+            st.status = FAILED
+            raise
+        else:
+            st.status = COMPLETED
+        finally:
+            st.finished_at = time.time()
+
+    def skip(self, name: str, detail: str | None = None) -> None:
+        st = self.stages.setdefault(name, Stage(name))
+        st.status = "skipped"
+        st.detail = detail
+
+    def to_status(self) -> Dict[str, Any]:
+        return {
+            "doc_id": self.job_id,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "stages": [s.to_dict() for s in self.stages.values()],
+        }
+
+
+JobFn = Callable[[Job], Awaitable[Any]]
+
+
+async def track(job: Job, fn: JobFn, done_message: str = "分析完成") -> Any:
+    """执行 fn(job) 并维护状态与起止时间；失败只记录在 Job 上，取消向上抛出"""
+    try:
+        if job.status != CANCELLING:
+            job.status = RUNNING
+        job.started_at = time.time()
+        job.result = await fn(job)
+        job.status = COMPLETED
+        job.message = done_message
+        return job.result
+    except asyncio.CancelledError:
+        job.status = CANCELLED
+        job.message = "已取消"
+        raise
+    except Exception as e:
+        job.status = FAILED
+        job.message = str(e)
+        print(f"❌ 任务 {job.job_id} 失败: {e}")
+    finally:
+        job.finished_at = time.time()
+
+
+class JobManager:
+    """有界并发的后台 Job 执行器"""
+
+    def __init__(self, workers: int = 2, max_finished: int = 1000):
+        self.workers = workers
+        self.max_finished = max_finished
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    # ------------------------------------------------------------------ 生命周期
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                ready = threading.Event()
+
+                def _run():
+                    loop = asyncio.new_event_loop()
+                    asyncio.set_event_loop(loop)
+                    self._loop = loop
+                    self._sem = asyncio.Semaphore(self.workers)
+                    ready.set()
+                    loop.run_forever()
+
+                threading.Thread(target=_run, name="analyze-jobs", daemon=True).start()
+                ready.wait()
+            return self._loop
+
+    # ------------------------------------------------------------------ 接口
+    def submit(self, job_id: str, stages: List[str], fn: JobFn) -> Job:
+        """提交 Job；同 id 的 Job 未结束时抛 JobRunning"""
+        loop = self._ensure_loop()
+        with self._lock:
+            existing = self._jobs.get(job_id)
+            if existing is not None and existing.status not in FINISHED:
+                raise JobRunning(existing)
+            job = Job.create(job_id, stages)
+            self._jobs[job_id] = job
+            self._jobs.move_to_end(job_id)
+            self._trim()
+        ctx = contextvars.copy_context()
+        job._future = asyncio.run_coroutine_threadsafe(self._run(job, fn, ctx), loop)
+        return job
+
+    def record(self, job_id: str, result: Any, message: str = "命中缓存") -> Job:
+        """登记一个无需执行、已完成的 Job（如命中分析缓存），供状态/结果接口查询"""
+        with self._lock:
+            existing = self._jobs.get(job_id)
+            if existing is not None and existing.status not in FINISHED:
+                return existing
+            now = time.time()
+            job = Job(job_id, OrderedDict(), status=COMPLETED, message=message, result=result,
+                      started_at=now, finished_at=now)
+            self._jobs[job_id] = job
+            self._jobs.move_to_end(job_id)
+            self._trim()
+            return job
+
+    def adopt(self, job: Job) -> Job:
+        """登记一个由其他任务执行的 Job（如批量任务的子项），使状态/结果接口可查询"""
+        with self._lock:
+            existing = self._jobs.get(job.job_id)
+            if existing is not None and existing.status not in FINISHED:
+                return existing
+            self._jobs[job.job_id] = job
+            self._jobs.move_to_end(job.job_id)
+            self._trim()
+            return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """请求取消：Job 先进入 CANCELLING，协程清理完毕后由 track / _run 标记为 CANCELLED"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED or job._future is None:  # 批量子项随批量任务取消
+                return False
+            job.status = CANCELLING
+            job.message = "正在取消"
+        self._loop.call_soon_threadsafe(self._cancel_task, job)
+        return True
+
+    def run_coroutine(self, coro, timeout: float | None = None) -> Any:
+        """在任务事件循环中执行协程并同步等待结果（如关闭时清理资源）"""
+        if self._loop is None:
+            coro.close()
+            return None
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    async def wait(self, job_id: str) -> Job:
+        """在调用方事件循环中等待 Job 结束"""
+        job = self.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        try:
+            await asyncio.wrap_future(job._future)
+        except (asyncio.CancelledError, Exception):
+            if job.status not in FINISHED:
+                raise
+        return job
+
+    # ------------------------------------------------------------------ 内部
+    async def _run(self, job: Job, fn: JobFn, ctx: contextvars.Context) -> Any:
+        job._task = asyncio.current_task()
+        try:
+            if job.status == CANCELLING:  # 取消请求先于本协程开始执行
+                raise asyncio.CancelledError
+            async with self._sem:
+                # 取消外层任务时被等待的内层任务随之取消
+                return await asyncio.get_running_loop().create_task(track(job, fn), context=ctx)
+        except asyncio.CancelledError:
+            # 排队期间被取消时 track 尚未执行
+            job.status = CANCELLED
+            job.message = "已取消"
+            job.finished_at = time.time()
+            raise
+
+    @staticmethod
+    def _cancel_task(job: Job) -> None:
+        # 在任务事件循环中执行；_run 尚未开始时由它自己检查 CANCELLING
+        if job._task is not None:
+            job._task.cancel()
+
+    def _trim(self) -> None:
+        finished = [k for k, j in self._jobs.items() if j.status in FINISHED]
+        for k in finished[: max(0, len(finished) - self.max_finished)]:
+            del self._jobs[k]
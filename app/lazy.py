@@ -0,0 +1,96 @@
+"""延迟创建的客户端
+================
+
+`Lazy(factory)` 在首次 `get()` 时调用 factory 并缓存结果（线程安全，只创建一次；创建失败不缓存，
+下次调用重试）。`LazyProxy` 把属性访问转发给 `get()`，模块级名字（如 `rag_audit_api.vector_store`）
+因此可以在导入时就存在，而 SDK 导入与连接推迟到第一次真正使用：
+
+```
+_store = Lazy(lambda: LocalVectorStore(768, path=".cache/vectors"), name="vector_store")
+vector_store = LazyProxy(_store)
+vector_store.search(q, 5)  # 此时才加载
+```
+
+`LazyProxy` 也可以接收一个返回 `Lazy` 的函数，每次访问时解析，用于按当前应用选择客户端
+（见 `rag_audit_api.current_clients()`）。
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+_UNSET = object()
+
+
+class Lazy(Generic[T]):
+    def __init__(self, factory: Callable[[], T], name: str = ""):
+        self.name = name
+        self._factory = factory
+        self._value: Any = _UNSET
+        self._lock = threading.Lock()
+        self.error: Optional[BaseException] = None
+        self.init_seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._value is not _UNSET
+
+    def get(self) -> T:
+        value = self._value
+        if value is not _UNSET:
+            return value
+        with self._lock:
+            if self._value is _UNSET:
+                start = time.perf_counter()
+                try:
+                    self._value = self._factory()
+                except BaseException as e:
+                    self.error = e
+                    raise
+                self.error = None
+                self.init_seconds = time.perf_counter() - start
+            return self._value
+
+    def reset(self, factory: Callable[[], T] | None = None) -> None:
+        """丢弃已创建的实例（可换新的 factory），下次 get() 重新创建"""
+        with self._lock:
+            if factory is not None:
+                self._factory = factory
+            self._value = _UNSET
+            self.error = None
+            self.init_seconds = None
+
+    def status(self) -> Dict[str, Any]:
+        if self.ready:
+            return {"ready": True, "init_seconds": round(self.init_seconds or 0.0, 4)}
+        return {"ready": False, "error": str(self.error) if self.error else None}
+
+
+class LazyProxy:
+    """转发属性访问与 len() 到 Lazy 创建的对象；传入函数时每次访问都重新解析出 Lazy"""
+
+    __slots__ = ("_lazy",)
+
+    def __init__(self, lazy: Lazy | Callable[[], Lazy]):
+        object.__setattr__(self, "_lazy", lazy)
+
+    def _target(self) -> Lazy:
+        lazy = self._lazy
+        return lazy if isinstance(lazy, Lazy) else lazy()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._target().get(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._target().get(), name, value)
+
+    def __len__(self) -> int:
+        return len(self._target().get())
+
+    def __repr__(self) -> str:
+        lazy = self._target()
+        state = repr(lazy.get()) if lazy.ready else "未创建"
+        return f"<LazyProxy {lazy.name}: {state}>"
@@ -0,0 +1,163 @@
+"""BM25 词法索引 + 倒数排名融合
+============================
+
+向量检索对检测器名、函数名这类精确词并不敏感。`BM25Index` 是进程内倒排索引，
+与向量检索结果通过 `reciprocal_rank_fusion` 融合：
+
+- 分词同时处理中文与 Solidity 标识符：中文按字二元组切分；
+  `withdraw()` → `withdraw`，`onlyOwner` → `onlyowner` + `only` + `owner`，
+  `naming-convention` / `_balance_of` 同时保留整体与各部分；
+- `add()` 增量加入行（入库路径调用），`remove()` 按 (doc_id, fingerprint) 移除行（增量重新分析），
+  `sync()` 在来源向量库版本变化时整体重建（共享向量库的其他 worker 写入后），
+  `search()` 返回带 `bm25` 分数的行，`filters` 语义与 `VectorStore.search` 相同。
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from vector_store import Filters, matches_filters, normalize_filters
+
+Row = Dict[str, Any]
+
+_TOKEN = re.compile(r"[A-Za-z_$][A-Za-z0-9_$]*(?:-[A-Za-z0-9_$]+)*|\d+|[\u3400-\u9fff]+")
+_CJK = re.compile(r"[\u3400-\u9fff]")
+_CAMEL = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for m in _TOKEN.finditer(text):
+        tok = m.group()
+        if _CJK.match(tok):
+            tokens.extend(tok[i:i + 2] for i in range(max(1, len(tok) - 1)))
+            continue
+        tokens.append(tok.lower())
+        parts = [p.lower() for seg in re.split(r"[-_$]+", tok) for p in _CAMEL.findall(seg)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """线程安全、可增量添加的 BM25 倒排索引"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.version: Any = None  # sync() 时来源向量库的版本
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._lengths: List[int] = []
+        self._rows: List[Optional[Row]] = []  # 已移除的行为 None
+        self._keys: Dict[Tuple[Any, Any], List[int]] = {}  # (doc_id, fingerprint) → 行号，remove 不必遍历全部行
+        self._total_length = 0
+        self._live = 0
+
+    def __len__(self) -> int:
+        return self._live
+
+    def add(self, rows: Iterable[Row]) -> int:
+        n = 0
+        with self._lock:
+            for row in rows:
+                doc = len(self._rows)
+                tf = Counter(tokenize(row["content"]))
+                for term, count in tf.items():
+                    self._postings.setdefault(term, {})[doc] = count
+                length = sum(tf.values())
+                self._lengths.append(length)
+                self._total_length += length
+                self._rows.append({k: v for k, v in row.items() if k != "embedding"})
+                self._keys.setdefault((row.get("doc_id"), row.get("fingerprint")), []).append(doc)
+                self._live += 1
+                n += 1
+        return n
+
+    def remove(self, doc_id: str, fingerprints: Sequence[Optional[str]]) -> int:
+        """移除该文档中指纹在 fingerprints 内的行（None 匹配无指纹的行）"""
+        n = 0
+        with self._lock:
+            for doc in [d for fp in set(fingerprints) for d in self._keys.pop((doc_id, fp), ())]:
+                row = self._rows[doc]
+                for term in set(tokenize(row["content"])):
+                    postings = self._postings.get(term)
+                    if postings is not None:
+                        postings.pop(doc, None)
+                        if not postings:
+                            del self._postings[term]
+                self._total_length -= self._lengths[doc]
+                self._lengths[doc] = 0
+                self._rows[doc] = None
+                self._live -= 1
+                n += 1
+        return n
+
+    def sync(self, version: Any, load: Callable[[], Iterable[Row]]) -> bool:
+        """来源版本变化时用 load() 的行重建（新索引建好后再替换，检索不被阻塞），返回是否重建"""
+        if version == self.version:
+            return False
+        with self._sync_lock:
+            if version == self.version:
+                return False
+            fresh = BM25Index(self.k1, self.b)
+            fresh.add(load())
+            with self._lock:
+                self._postings, self._lengths, self._rows = fresh._postings, fresh._lengths, fresh._rows
+                self._keys, self._total_length, self._live = fresh._keys, fresh._total_length, fresh._live
+            self.version = version
+        return True
+
+    def search(self, query: str, top_k: int, filters: Optional[Filters] = None) -> List[Row]:
+        terms = set(tokenize(query))
+        filters = normalize_filters(filters)
+        with self._lock:
+            n_docs = self._live
+            if not n_docs or not terms or top_k <= 0:
+                return []
+            avg_len = self._total_length / n_docs or 1.0
+            scores: Dict[int, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc] / avg_len)
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            items = scores.items()
+            if filters:
+                items = [(d, sc) for d, sc in items if matches_filters(self._rows[d], filters)]
+            best = heapq.nlargest(top_k, items, key=lambda kv: kv[1])
+            return [{**self._rows[doc], "bm25": score} for doc, score in best]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._lengths.clear()
+            self._rows.clear()
+            self._keys.clear()
+            self._total_length = 0
+            self._live = 0
+            self.version = None
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Row]], top_k: int, k: int = 60) -> List[Row]:
+    """按 (doc_id, 指纹) 合并多路排序结果（无指纹时按内容），得分为 Σ 1/(k + rank)，附带 `rrf` 字段
+
+    不同文档中文本相同的发现是不同的结果，不合并。
+    """
+    fused: Dict[Tuple[Any, Any], Row] = {}
+    scores: Dict[Tuple[Any, Any], float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            key = (row.get("doc_id"), row.get("fingerprint") or row["content"])
+            fused[key] = {**row, **fused.get(key, {})}  # 保留先出现（向量）结果的字段
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    order = sorted(scores, key=lambda c: -scores[c])[:top_k]
+    return [{**fused[c], "rrf": scores[c]} for c in order]
@@ -0,0 +1,221 @@
+"""进程内指标（Prometheus 文本格式）
+==============================
+
+不引入 prometheus_client，只实现本服务用到的三种类型：
+
+- `Counter`：单调递增计数；
+- `Gauge`：可增减的当前值（如在途请求数）；
+- `Histogram`：累计分桶 + `_sum` / `_count`。
+
+每个指标带固定的标签名，`labels(...)` 取得子序列；更新只是一次加锁的加法。
+`timed()` / `inflight()` 是围绕代码块计时与计数的上下文管理器，`render()` 输出 `/metrics` 文本。
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), registry: "Registry | None" = None):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values, **kw):
+        if kw:
+            values = tuple(str(kw[n]) for n in self.labelnames)
+        else:
+            values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_str(self, values: Tuple[str, ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ""
+        inner = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+        return "{" + inner + "}"
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+    def collect(self) -> List[str]:
+        return [f"{self.name}{self._label_str(k)} {_num(c.value)}" for k, c in sorted(self._children.items())]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default().dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: "Registry | None" = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, doc, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def collect(self) -> List[str]:
+        lines = []
+        for key, c in sorted(self._children.items()):
+            with c._lock:
+                counts, total, count = list(c.counts), c.sum, c.count
+            cumulative = 0
+            for bound, n in zip([*self.buckets, float("inf")], counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else _num(bound)
+                lines.append(f"{self.name}_bucket{self._label_str(key, (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_str(key)} {_num(total)}")
+            lines.append(f"{self.name}_count{self._label_str(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> None:
+        with self._lock:
+            for m in self._metrics:
+                if m.name == metric.name:
+                    if type(m) is not type(metric) or m.labelnames != metric.labelnames:
+                        raise ValueError(f"指标重复注册: {metric.name}")
+                    # 模块被重复导入（如 reload / 不同包名）时共享同一组序列
+                    metric._children = m._children
+                    metric._lock = m._lock
+                    return
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        out: List[str] = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for m in metrics:
+            out.append(f"# HELP {m.name} {m.doc}")
+            out.append(f"# TYPE {m.name} {m.type_name}")
+            out.extend(m.collect())
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+@contextmanager
+def timed(histogram, errors: "Counter | None" = None) -> Iterator[None]:
+    """记录代码块耗时；抛出异常时另计入 errors（若提供）"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:  # 取消（CancelledError）不计为失败
+        if errors is not None:
+            errors.inc()
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+@contextmanager
+def inflight(gauge) -> Iterator[None]:
+    gauge.inc()
+    try:
+        yield
+    finally:
+        gauge.dec()
+
+
+def _num(v: float) -> str:
+    if v == int(v) and abs(v) < 1e15:
+        return str(int(v))
+    return repr(float(v))
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
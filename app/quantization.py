@@ -0,0 +1,99 @@
+"""向量量化（LocalVectorStore 的紧凑存储）
+====================================
+
+- `float32`：不量化；
+- `float16`：半精度，内存减半；
+- `int8`：每个向量一个 float32 缩放系数 `scale = max|x| / 127`，`x ≈ code * scale`，内存约为 float32 的 1/4。
+
+`scores()` 在紧凑形式上分块计算 `codes @ q`（每块反量化到可复用的小缓冲区再走 BLAS，不展开整个矩阵），
+用于选出候选：int8 扫描与 float32 矩阵乘相当，float16 受半精度转换速度限制明显更慢；
+最终排序由调用方用全精度向量重新打分。`recall_at_k()` 用于衡量量化检索相对 float32 的召回率。
+"""
+from __future__ import annotations
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+FLOAT32 = "float32"
+FLOAT16 = "float16"
+INT8 = "int8"
+QUANTIZATIONS = (FLOAT32, FLOAT16, INT8)
+
+_DTYPES = {FLOAT32: np.float32, FLOAT16: np.float16, INT8: np.int8}
+_BLOCK = 256  # scores() 每块行数：反量化缓冲区留在 CPU 缓存内
+
+
+def check_quantization(mode: str) -> str:
+    mode = (mode or FLOAT32).lower()
+    if mode not in QUANTIZATIONS:
+        raise ValueError(f"不支持的向量量化方式: {mode}（可选 {', '.join(QUANTIZATIONS)}）")
+    return mode
+
+
+def code_dtype(mode: str) -> np.dtype:
+    return np.dtype(_DTYPES[mode])
+
+
+def quantize(vecs: np.ndarray, mode: str) -> Tuple[np.ndarray, np.ndarray]:
+    """float32 向量 (n, dim) → (codes, scales)；非 int8 时 scales 全为 1"""
+    vecs = np.asarray(vecs, dtype=np.float32)
+    scales = np.ones(len(vecs), dtype=np.float32)
+    if mode == INT8:
+        peak = np.abs(vecs).max(axis=1) if vecs.size else scales
+        scales = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+        codes = np.clip(np.rint(vecs / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales
+    return vecs.astype(_DTYPES[mode], copy=False), scales
+
+
+def dequantize(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    out = np.asarray(codes).astype(np.float32)
+    if out.size and np.asarray(codes).dtype == np.int8:
+        s = np.asarray(scales, dtype=np.float32)
+        out *= s[..., None] if s.ndim else s
+    return out
+
+
+def scores(codes: np.ndarray, scales: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """紧凑向量与 float32 查询向量的内积（近似余弦相似度）"""
+    if codes.dtype == np.float32:
+        return codes @ q
+    out = np.empty(len(codes), dtype=np.float32)
+    buf = np.empty((min(_BLOCK, len(codes)), codes.shape[1]), dtype=np.float32)
+    for start in range(0, len(codes), _BLOCK):
+        end = min(len(codes), start + _BLOCK)
+        block = buf[: end - start]
+        block[...] = codes[start:end]
+        out[start:end] = block @ q
+    if codes.dtype == np.int8:
+        out *= scales
+    return out
+
+
+class CodeView:
+    """按行下标读取时才反量化的只读视图（供 HNSW 建图 / 检索逐行访问）"""
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray):
+        self.codes = codes
+        self.scales = scales
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, idx) -> np.ndarray:
+        return dequantize(self.codes[idx], self.scales[idx])
+
+
+def recall_at_k(expected: Sequence[Sequence[int]], actual: Sequence[Sequence[int]], k: Optional[int] = None) -> float:
+    """每个查询的 |expected[:k] ∩ actual[:k]| / k 的平均值"""
+    if not expected:
+        return 1.0
+    total = 0.0
+    for exp, act in zip(expected, actual):
+        n = k or len(exp)
+        if n:
+            total += len(set(list(exp)[:n]) & set(list(act)[:n])) / min(n, len(exp))
+        else:
+            total += 1.0
+    return total / len(expected)
@@ -3,325 +3,1598 @@
 
 功能概览
 --------
-- **/analyze** 端点：用户仅需上传 Solidity 源代码文件（或提供 Etherscan 地址），系统即：
+- **/analyze** 端点：用户仅需上传 Solidity 源代码文件（或提供 Etherscan 地址），系统提交后台任务并立即返回 doc_id
+  （上传文件为文件名，地址为带链的完整小写地址 `eip155:<chainid>:<address>`）：
   1. 运行 Slither 静态分析（JSON 输出）
   2. 运行 Echidna 动态模糊测试（Docker 容器，JSON 输出）
-  3. 解析两份报告并自动入库 Supabase 向量表
-  4. 返回分析统计与 doc_id，方便后续提问
-- **/ingest** 端点：仍支持批量上传现成报告
-- **/ask** 端点：检索 + Gemini 回答
+  3. 解析两份报告并自动入库 Supabase 向量表；同一 doc_id 重新分析时按发现指纹增量同步：
+     只向量化新发现，文本变化的只更新元数据，已消失的发现从库中删除
+  4. `/analyze/{doc_id}/status` 查询进度，`/analyze/{doc_id}` 获取统计，`DELETE /analyze/{doc_id}` 取消
+- **/analyze/batch** 端点：zip 压缩包或地址列表批量分析，按 CPU 核数并发，各合约的发现共享向量化与入库；
+  `/analyze/batch/{batch_id}` 查询每个合约的状态
+- **/ingest** 端点：仍支持批量上传现成报告（流式解析，内存占用与报告大小无关）
+- **/ask** 端点：混合检索（向量 + BM25，RRF 融合）+ Gemini 回答
+- **/ask/stream** 端点：SSE 流式问答，先返回检索来源，再逐段推送 Gemini 输出
+- **/metrics** 端点：Prometheus 文本格式的各阶段耗时直方图、计数与在途数
+- **/health** 存活检查（不依赖任何外部客户端）；**/ready** 就绪检查：各客户端是否已创建
 
 依赖
 ----
 ```
-pip install fastapi uvicorn[standard] supabase google python-multipart slither-analyzer
+pip install fastapi uvicorn[standard] supabase google python-multipart slither-analyzer numpy
 # 运行 Echidna 需本地安装 Docker 或 Podman
 ```
 
 环境变量
 ---------
-- `SUPABASE_URL` / `SUPABASE_KEY`
+- `SUPABASE_URL` / `SUPABASE_KEY`（`VECTOR_STORE=supabase` 时必需）
+- `VECTOR_STORE`（可选，`supabase`（默认）、`local`：进程内 NumPy 向量库，无需 Supabase，
+  或 `shared`：多个 worker 共享同一份内存映射向量库）
+- `SHARED_VECTOR_STORE_PATH` / `VECTOR_STORE_READ_ONLY`（可选，共享向量库目录，默认 `.cache/shared-vectors`；
+  只读打开时该 worker 不接受入库，写入方通过文件锁串行，新段对其他 worker 在下次请求时可见；
+  共享库只做精确检索，不使用 HNSW 与量化）
+- `LOCAL_VECTOR_STORE_PATH` / `LOCAL_VECTOR_ANN_MIN_ROWS`（可选，本地向量库目录，默认 `.cache/vectors`；
+  行数达到该值后启用 HNSW 近似索引，默认 0 表示始终精确检索）
+- `VECTOR_QUANTIZATION` / `VECTOR_RESCORE_FACTOR`（可选，向量存储精度 `float32`（默认）| `float16` | `int8`；
+  本地向量库量化后按紧凑向量取 top_k × 该倍数个候选，再用磁盘上的全精度向量重新打分，默认 4；
+  Supabase 仅支持 `float16`，列类型改为 `HALFVEC(768)`，见 README）
 - `GOOGLE_API_KEY`
 - `ETHERSCAN_API_KEY`（可选，若允许用户仅提供地址）
+- `ETHERSCAN_CHAIN` / `ETHERSCAN_RATE_LIMIT` / `ETHERSCAN_CACHE_PATH`（可选，默认链、每秒请求数、源码缓存 SQLite 文件，
+  默认 `ethereum` / 5 / `.cache/etherscan.sqlite3`，置空仅用内存）
+- `EMBED_BATCH_SIZE` / `EMBED_CONCURRENCY`（可选，批量向量化的批大小与并发批次数，默认 64 / 4）
+- `EMBED_CACHE_PATH`（可选，向量缓存 SQLite 文件，默认 `.cache/embeddings.sqlite3`，置空仅用内存）
+- `EMBED_CACHE_MEMORY_ITEMS` / `EMBED_CACHE_DISK_ITEMS`（可选，缓存条目上限）
+- `GEMINI_CONCURRENCY` / `GEMINI_MAX_CONCURRENCY` / `GEMINI_MAX_RETRIES`（可选，Gemini 初始 / 最大并发与每次调用的
+  尝试次数，默认 4 / 16 / 3；遇到 429 并发减半，成功后逐步回升）
+- `GEMINI_BREAKER_THRESHOLD` / `GEMINI_BREAKER_RESET`（可选，连续服务端错误多少次后熔断、熔断秒数，默认 5 / 30）
+- `EMBED_RETRY_INTERVAL` / `EMBED_RETRY_QUEUE_SIZE`（可选，向量化失败的文本块进入重试队列，
+  后台每隔多少秒重试、队列上限，默认 60 / 10000）
+- `DATA_WORKERS` / `DATA_MAX_PENDING`（可选，请求路径上检索、解析、入库等同步调用的线程数与在途上限，
+  默认 16 / 256，超过上限返回 503）
+- `STREAM_WORKERS` / `STREAM_MAX_PENDING`（可选，/ask/stream 生成线程数与在途上限，默认 16 / 64）
+- `INGEST_READ_SIZE` / `INGEST_BATCH_SIZE`（可选，/ingest 读块字节数与入库批大小，默认 1MiB / 256）
+- `ANALYZE_WORKERS`（可选，同时执行的分析任务数，默认 2）
+- `BATCH_WORKERS` / `BATCH_MAX_ITEMS` / `BATCH_MAX_ARCHIVE_BYTES` / `BATCH_INSERT_SIZE`（可选，/analyze/batch 中
+  同时分析的合约数（默认 CPU 核数）、单批合约数上限（500）、压缩包解压上限（200MiB）、共享入库的块数（256））
+- `SLITHER_TIMEOUT` / `ECHIDNA_TIMEOUT`（可选，工具超时秒数，默认 300 / 600）
+- `ECHIDNA_IMAGE`（可选，Echidna 镜像，默认 `trailofbits/eth-security-toolbox`）
+- `ECHIDNA_POOL_SIZE`（可选，Echidna 常驻容器数，默认 2，0 表示每次 `docker run --rm`）
+- `ECHIDNA_POOL_MAX_JOBS` / `ECHIDNA_POOL_BACKEND` / `ECHIDNA_POOL_DIR`（可选，容器回收阈值、`docker`|`local`、任务目录根）
+- `ANALYSIS_CACHE_PATH`（可选，分析结果缓存 SQLite 文件，默认 `.cache/analysis.sqlite3`）
+- `ANSWER_CACHE_SIMILARITY` / `ANSWER_CACHE_TTL` / `ANSWER_CACHE_SIZE`（可选，语义答案缓存，默认 0.95 / 3600 / 1000）
+- `HYBRID_SEARCH` / `HYBRID_RRF_K`（可选，BM25 词法检索与向量检索的倒数排名融合，默认开启 / 60；
+  BM25 索引是每个 worker 的进程内副本：`WEB_CONCURRENCY` > 1（多 worker）或 `VECTOR_STORE=shared` 时默认关闭，
+  多 worker 下只有共享库能在其他 worker 写入后（清单版本变化）重建索引。开关读入 `Settings.hybrid_search`）
+- `CONTEXT_OVERFETCH` / `CONTEXT_TOKEN_BUDGET` / `CONTEXT_MMR_LAMBDA`（可选，问答上下文：检索 top_k 的倍数、
+  上下文 token 预算、MMR 相关度权重，默认 4 / 3000 / 0.7）
+- `DEDUP_FINDINGS` / `DEDUP_SIMILARITY` / `DEDUP_MAX_ELEMENTS`（可选，入库前近似重复发现合并，默认开启 / 0.8 / 50；
+  相似度 > 1 时只合并精确重复）
+- `CODE_INDEX` / `CODE_TOP_K` / `CODE_MATCH_THRESHOLD` / `CODE_CONTEXT_TOKEN_BUDGET`（可选，Solidity 源码代码索引：
+  分析时按合约 / 函数 / 修饰器分块入库并关联引用它们的发现，问答时另取至多 CODE_TOP_K 个代码块，
+  默认开启 / 3 / 0.5 / 1500 tokens；向量库为 Supabase 时需建 `audit_code` 表，见 README）
+- `CODE_INDEX_MAX_CHUNKS` / `CODE_CHUNK_MAX_CHARS`（可选，每次分析最多入库的代码块数、单块最多字符数，默认 2000 / 8000）
+- `WARMUP_CLIENTS`（可选，启动后在后台预先创建向量库、缓存与 Gemini SDK，完成后 `/ready` 返回 200，默认开启；
+  关闭时在首次使用时创建）
 
 启动
 ----
 ```
 uvicorn rag_audit_api:app --reload
+uvicorn rag_audit_api:create_app --factory   # 或在代码中 create_app(Settings(...))
 ```
+
+导入本模块不会导入 `google.generativeai` / `supabase` / `requests`，也不连接任何服务：
+客户端在首次使用（或启动预热）时按 `settings.Settings` 创建，配置缺失时在那时报错。
 """
 from __future__ import annotations
 
-import io
+import asyncio
+import hashlib
 import json
 import os
 import shutil
-import subprocess
 import tempfile
 import textwrap
-import requests
+import threading
+import time
+import uuid
+import sys
+from contextvars import ContextVar
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import AsyncIterator, Callable, List, Dict, Optional, TypeVar
 
-# --- Gemini 初始化（统一与 llm_parser.py 的用法） ---
-import google.generativeai as genai
+# 同目录模块在 `uvicorn rag_audit_api:app` 与 `uvicorn app.rag_audit_api:app` 下都可导入
+sys.path.insert(0, str(Path(__file__).resolve().parent))
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
+from analysis_cache import AnalysisCache, analysis_key
+from lazy import Lazy, LazyProxy
+from settings import Settings
+from batch import (
+    InsertBatcher,
+    doc_ids_for,
+    extract_sol_archive,
+    list_sol_members,
+    parse_addresses,
+)
+from embed_cache import EmbeddingCache
+from echidna_pool import DockerWorker, EchidnaPool, LocalWorker
+from etherscan import ContractSource, EtherscanClient, SourceCache, address_doc_id
+from embed_pipeline import embed_in_batches
+from executors import BoundedExecutor, ExecutorBusy
+from gemini_client import AdaptiveLimiter, CircuitBreaker, CircuitOpenError, GeminiClient, RetryQueue
+from code_index import CODE_FIELDS, CodeChunk, element_key, identifiers, is_code_row, link_findings, parse_files
+from context_builder import build_context
+from finding_dedup import FindingDeduper, FindingGroup, diff_findings
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from report_stream import ReportStreamParser
+from semantic_cache import SemanticCache
+from vector_store import FILTER_FIELDS, LocalVectorStore, SharedVectorStore, SupabaseVectorStore, VectorStore
+import jobs
+import metrics
+from subproc import run_command
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import APIRouter, Depends, FastAPI, File, UploadFile, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from supabase import create_client
 
 # --------------------------- 环境配置 ---------------------------------------------
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
-GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
-ETHERSCAN_API_KEY = os.environ.get("ETHERSCAN_API_KEY")  # 可选
+# 默认应用的客户端配置（凭据、向量库后端、缓存路径）；create_app(Settings(...)) 的应用各用各的
+settings = Settings.from_env()
+ETHERSCAN_CHAIN = os.environ.get("ETHERSCAN_CHAIN", "ethereum")
+MATCH_THRESHOLD = 0.7
+
+# 混合检索（BM25 词法结果与向量结果按 RRF 融合）的开关在 Settings.hybrid_search：默认按后端与进程数决定
+HYBRID_RRF_K = int(os.environ.get("HYBRID_RRF_K", "60"))
+
+# 上下文组装：多取 top_k × CONTEXT_OVERFETCH 个候选，重排 + MMR 后装入 token 预算（0 不限）
+CONTEXT_OVERFETCH = int(os.environ.get("CONTEXT_OVERFETCH", "4"))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_MMR_LAMBDA = float(os.environ.get("CONTEXT_MMR_LAMBDA", "0.7"))
+GENERATION_MODEL = "gemini-2.0-flash"
+
+# 语义答案缓存：相似度阈值 / 过期秒数 / 条目上限（0 关闭）
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "1000"))
+
+# 向量化参数：单次 embed_content 的文本数 / 同时在途的批次数
+EMBED_MODEL = "models/embedding-001"
+EMBED_DIM = 768
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "4"))
+
+# Gemini 调用：自适应并发（AIMD）+ 抖动退避 + 熔断；向量化最终失败的文本块进入重试队列
+GEMINI_CONCURRENCY = int(os.environ.get("GEMINI_CONCURRENCY", "4"))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BREAKER_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_RESET = float(os.environ.get("GEMINI_BREAKER_RESET", "30"))
+EMBED_RETRY_INTERVAL = float(os.environ.get("EMBED_RETRY_INTERVAL", "60"))
+EMBED_RETRY_QUEUE_SIZE = int(os.environ.get("EMBED_RETRY_QUEUE_SIZE", "10000"))
+
+# 请求路径上的同步 SDK 调用（检索 / 解析 / 入库、流式生成）各用独立的有界线程池，不占事件循环
+DATA_WORKERS = int(os.environ.get("DATA_WORKERS", "16"))
+DATA_MAX_PENDING = int(os.environ.get("DATA_MAX_PENDING", "256"))
+STREAM_WORKERS = int(os.environ.get("STREAM_WORKERS", "16"))
+STREAM_MAX_PENDING = int(os.environ.get("STREAM_MAX_PENDING", "64"))
+
+# /ingest 流式读取块大小（字节）与入库批大小（文本块数）
+INGEST_READ_SIZE = int(os.environ.get("INGEST_READ_SIZE", str(1 << 20)))
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "256"))
+
+# 入库前合并近似重复的发现（MinHash 估计 Jaccard >= DEDUP_SIMILARITY）
+DEDUP_FINDINGS = os.environ.get("DEDUP_FINDINGS", "1").lower() not in ("0", "false", "no")
+DEDUP_SIMILARITY = float(os.environ.get("DEDUP_SIMILARITY", "0.8"))
+DEDUP_MAX_ELEMENTS = int(os.environ.get("DEDUP_MAX_ELEMENTS", "50"))
+
+# Solidity 源码代码索引：分析时分块入库（独立于发现的向量库），问答时按 token 预算附上相关代码
+CODE_INDEX = os.environ.get("CODE_INDEX", "1").lower() not in ("0", "false", "no")
+CODE_TOP_K = int(os.environ.get("CODE_TOP_K", "3"))
+CODE_MATCH_THRESHOLD = float(os.environ.get("CODE_MATCH_THRESHOLD", "0.5"))
+CODE_CONTEXT_TOKEN_BUDGET = int(os.environ.get("CODE_CONTEXT_TOKEN_BUDGET", "1500"))
+CODE_INDEX_MAX_CHUNKS = int(os.environ.get("CODE_INDEX_MAX_CHUNKS", "2000"))
+CODE_CHUNK_MAX_CHARS = int(os.environ.get("CODE_CHUNK_MAX_CHARS", "8000"))
+
+# 同时执行的后台分析任务数；分析工具超时（秒）
+ANALYZE_WORKERS = int(os.environ.get("ANALYZE_WORKERS", "2"))
+SLITHER_TIMEOUT = float(os.environ.get("SLITHER_TIMEOUT", "300"))
+ECHIDNA_TIMEOUT = float(os.environ.get("ECHIDNA_TIMEOUT", "600"))
+
+# /analyze/batch：同时分析的合约数、单批上限、压缩包解压上限（字节）、共享入库的文本块数
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS") or os.cpu_count() or 2)
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "500"))
+BATCH_MAX_ARCHIVE_BYTES = int(os.environ.get("BATCH_MAX_ARCHIVE_BYTES", str(200 << 20)))
+BATCH_INSERT_SIZE = int(os.environ.get("BATCH_INSERT_SIZE", "256"))
+
+# 分析工具参数（同时作为分析缓存指纹的一部分）
+SLITHER_ARGS = ["--json", "-"]
+ECHIDNA_IMAGE = os.environ.get("ECHIDNA_IMAGE", "trailofbits/eth-security-toolbox")
+ECHIDNA_ARGS = ["--format", "json"]
+
+# Echidna 常驻容器池：ECHIDNA_POOL_SIZE=0 时退回每次 `docker run --rm`
+ECHIDNA_POOL_SIZE = int(os.environ.get("ECHIDNA_POOL_SIZE", "2"))
+ECHIDNA_POOL_MAX_JOBS = int(os.environ.get("ECHIDNA_POOL_MAX_JOBS", "50"))
+ECHIDNA_POOL_BACKEND = os.environ.get("ECHIDNA_POOL_BACKEND", "docker")  # docker | local
+ECHIDNA_POOL_DIR = Path(os.environ.get("ECHIDNA_POOL_DIR") or Path(tempfile.gettempdir()) / "echidna-pool")
+
+# --------------------------- 客户端（首次使用时创建） ------------------------------
+
+def _import_genai(cfg: Settings):
+    # google.generativeai 导入约 1s，只在第一次向量化 / 生成（或启动预热）时付出
+    import google.generativeai as module
+
+    module.configure(api_key=cfg.google_api_key)
+    return module
+
+
+def _build_vector_store(cfg: Settings, code: bool = False) -> VectorStore:
+    # code=True 为代码索引：Supabase 的 `audit_code` 表，本地 / 共享向量库目录下的 `code/` 子目录
+    cfg.validate()
+    if cfg.vector_store == "supabase":
+        from supabase import create_client
+
+        client = create_client(cfg.supabase_url, cfg.supabase_key)
+        if code:
+            return SupabaseVectorStore(
+                client,
+                table="audit_code",
+                rpc="match_code",
+                filtered_rpc="match_code_filtered",
+                quantization=cfg.vector_quantization,
+            )
+        return SupabaseVectorStore(client, quantization=cfg.vector_quantization)
+    if cfg.vector_store == "shared":
+        path = Path(cfg.shared_vector_store_path)
+        return SharedVectorStore(
+            EMBED_DIM, path / "code" if code else path, read_only=cfg.vector_store_read_only
+        )
+    path = cfg.local_vector_store_path
+    return LocalVectorStore(
+        EMBED_DIM,
+        path=Path(path) / "code" if code and path else path,
+        ann_min_rows=cfg.local_vector_ann_min_rows,
+        quantization=cfg.vector_quantization,
+        rescore_factor=cfg.vector_rescore_factor,
+    )
+
+
+def _build_embed_cache(cfg: Settings) -> EmbeddingCache:
+    # EMBED_CACHE_PATH 置空则只用进程内 LRU
+    cache = EmbeddingCache(
+        EMBED_MODEL,
+        path=cfg.embed_cache_path,
+        max_memory_items=cfg.embed_cache_memory_items,
+        max_disk_items=cfg.embed_cache_disk_items,
+    )
+    cache.purge_other_models()  # 模型更换后旧向量不再可用
+    return cache
+
+
+def _build_etherscan_client(cfg: Settings) -> EtherscanClient:
+    # 共享连接池 + 限速，已下载的源码按 (chain, address) 缓存
+    return EtherscanClient(
+        cfg.etherscan_api_key,
+        cache=SourceCache(cfg.etherscan_cache_path),
+        rate=cfg.etherscan_rate_limit,
+    )
+
+
+T = TypeVar("T")
+
+
+class Clients(dict):
+    """一个应用的客户端（`app.state.clients`）：名字 → Lazy，按该应用的 Settings 在首次使用时创建"""
+
+    def __init__(self, cfg: Settings):
+        super().__init__(
+            vector_store=Lazy(lambda: _build_vector_store(cfg), "vector_store"),
+            code_store=Lazy(lambda: _build_vector_store(cfg, code=True), "code_store"),
+            embed_cache=Lazy(lambda: _build_embed_cache(cfg), "embed_cache"),
+            analysis_cache=Lazy(lambda: AnalysisCache(cfg.analysis_cache_path), "analysis_cache"),
+            etherscan_client=Lazy(lambda: _build_etherscan_client(cfg), "etherscan_client"),
+            genai=Lazy(lambda: _import_genai(cfg), "genai"),
+        )
+        self.settings = cfg
+        # 进程内状态同样每个应用一份：另一个应用的检索、答案缓存、重试队列与后台任务互不可见
+        self.state: Dict[str, Lazy] = {
+            "lexical_index": Lazy(BM25Index, "lexical_index"),
+            "answer_cache": Lazy(lambda: _build_answer_cache(), "answer_cache"),
+            "embed_retry": Lazy(lambda: RetryQueue(EMBED_RETRY_QUEUE_SIZE), "embed_retry"),
+            "job_manager": Lazy(lambda: jobs.JobManager(workers=ANALYZE_WORKERS), "job_manager"),
+            "gemini": Lazy(lambda: _build_gemini(), "gemini"),
+            "echidna_pool": Lazy(lambda: _build_echidna_pool(), "echidna_pool"),
+            "data_executor": Lazy(lambda: BoundedExecutor("data", DATA_WORKERS, DATA_MAX_PENDING), "data_executor"),
+            "stream_executor": Lazy(
+                lambda: BoundedExecutor("stream", STREAM_WORKERS, STREAM_MAX_PENDING), "stream_executor"
+            ),
+        }
+
+    def bind(self, fn: Callable[..., T]) -> Callable[..., T]:
+        """包装 fn：执行期间模块级客户端名解析到本应用的客户端（用于后台线程）"""
+        def run(*args, **kwargs) -> T:
+            token = _bound_clients.set(self)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _bound_clients.reset(token)
+        return run
+
+
+# 默认应用（模块级 `app`）的客户端；请求处理期间由 bind_clients 绑定为所属应用的客户端，
+# 在其中提交的线程池任务与后台 Job 沿用调用方的 contextvars
+clients = Clients(settings)
+_bound_clients: ContextVar[Optional[Clients]] = ContextVar("bound_clients", default=None)
+
+
+def current_clients() -> Clients:
+    return _bound_clients.get() or clients
+
+
+def _client(name: str) -> LazyProxy:
+    return LazyProxy(lambda: current_clients()[name])
 
-if not (SUPABASE_URL and SUPABASE_KEY and GOOGLE_API_KEY):
-    raise RuntimeError("❗ 请设置 SUPABASE_URL / SUPABASE_KEY / GOOGLE_API_KEY 环境变量！")
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+def _state(name: str) -> LazyProxy:
+    return LazyProxy(lambda: current_clients().state[name])
+
+
+def hybrid_search() -> bool:
+    return current_clients().settings.hybrid_search
+
+
+genai = _client("genai")
+vector_store: VectorStore = _client("vector_store")
+code_store: VectorStore = _client("code_store")
+embed_cache: EmbeddingCache = _client("embed_cache")
+analysis_cache: AnalysisCache = _client("analysis_cache")
+etherscan_client: EtherscanClient = _client("etherscan_client")
+
+# 词法索引随入库增量更新，启动时从向量库重建
+lexical_index: BM25Index = _state("lexical_index")
+embed_retry: RetryQueue = _state("embed_retry")  # (doc_id, content) → 待向量化的行
+answer_cache: SemanticCache = _state("answer_cache")
+echidna_pool: EchidnaPool = _state("echidna_pool")  # ECHIDNA_POOL_SIZE=0 时不使用
+data_executor: BoundedExecutor = _state("data_executor")
+stream_executor: BoundedExecutor = _state("stream_executor")
+
+
+def _build_answer_cache() -> SemanticCache:
+    return SemanticCache(threshold=ANSWER_CACHE_SIMILARITY, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_SIZE)
+
+
+def _make_echidna_worker():
+    if ECHIDNA_POOL_BACKEND == "local":
+        return LocalWorker(ECHIDNA_POOL_DIR)
+    return DockerWorker(ECHIDNA_IMAGE, ECHIDNA_POOL_DIR)
+
+
+def _build_echidna_pool() -> Optional[EchidnaPool]:
+    if ECHIDNA_POOL_SIZE <= 0:
+        return None
+    return EchidnaPool(
+        _make_echidna_worker,
+        ECHIDNA_POOL_DIR,
+        max_size=ECHIDNA_POOL_SIZE,
+        max_jobs_per_worker=ECHIDNA_POOL_MAX_JOBS,
+    )
+
+# --------------------------- 指标 ------------------------------------------------
+EMBED_SECONDS = metrics.Histogram("rag_embed_seconds", "Gemini 向量化耗时（含重试）", ["op"])
+EMBED_TEXTS = metrics.Counter("rag_embed_texts_total", "发送到 Gemini 向量化的文本数", ["op"])
+EMBED_RETRIES = metrics.Counter("rag_embed_retries_total", "向量化重试次数", ["op"])
+EMBED_DEFERRED = metrics.Counter("rag_embed_deferred_total", "向量化失败转入重试队列的文本块数")
+GEMINI_ERRORS = metrics.Counter("rag_gemini_errors_total", "Gemini 调用失败次数", ["op", "kind"])
+INSERT_SECONDS = metrics.Histogram("rag_insert_seconds", "insert_chunks 耗时（向量化 + 写入）")
+CHUNKS_INSERTED = metrics.Counter("rag_chunks_inserted_total", "写入向量库的文本块数")
+CODE_CHUNKS_INDEXED = metrics.Counter("rag_code_chunks_indexed_total", "写入代码索引的源码块数")
+FINDINGS_SYNCED = metrics.Counter("rag_findings_synced_total", "重新分析时与已存行对比的发现数", ["result"])
+SEARCH_SECONDS = metrics.Histogram("rag_search_seconds", "检索耗时", ["backend"])
+SEARCH_ERRORS = metrics.Counter("rag_search_errors_total", "检索失败次数", ["backend"])
+RETRIEVAL_FALLBACKS = metrics.Counter("rag_retrieval_fallbacks_total", "检索降级次数", ["kind"])
+GENERATION_SECONDS = metrics.Histogram("rag_generation_seconds", "Gemini 生成耗时", ["mode"])
+GENERATION_FIRST_CHUNK = metrics.Histogram("rag_generation_first_chunk_seconds", "流式生成首段延迟")
+GENERATION_ERRORS = metrics.Counter("rag_generation_errors_total", "Gemini 生成失败次数", ["mode"])
+TOOL_SECONDS = metrics.Histogram("rag_tool_seconds", "Slither / Echidna 执行耗时", ["tool"])
+TOOL_FAILURES = metrics.Counter("rag_tool_failures_total", "Slither / Echidna 失败次数（含超时、无 Docker）", ["tool"])
+ETHERSCAN_SECONDS = metrics.Histogram("rag_etherscan_seconds", "Etherscan 源码下载耗时")
+ETHERSCAN_ERRORS = metrics.Counter("rag_etherscan_errors_total", "Etherscan 源码下载失败次数")
+INFLIGHT = metrics.Gauge("rag_inflight", "进行中的操作数", ["stage"])
+
+
+def _gemini_error(op: str, kind: str, will_retry: bool) -> None:
+    GEMINI_ERRORS.labels(op, kind).inc()
+    if will_retry and op in ("query", "batch"):
+        EMBED_RETRIES.labels(op).inc()
+
+
+def _build_gemini() -> GeminiClient:
+    return GeminiClient(
+        AdaptiveLimiter(GEMINI_CONCURRENCY, max_limit=GEMINI_MAX_CONCURRENCY),
+        CircuitBreaker(GEMINI_BREAKER_THRESHOLD, GEMINI_BREAKER_RESET),
+        max_retries=GEMINI_MAX_RETRIES,
+        on_error=_gemini_error,
+    )
+
+
+# 向量化与生成共用（每个应用一份，对应该应用的 API key）：遇到 429 自动收缩并发，连续服务端错误后熔断快速失败
+gemini: GeminiClient = _state("gemini")
 
 # --------------------------- 向量化 & 数据库 --------------------------------------
 
 def embed_text(text: str) -> List[float]:
-    """使用 Gemini embedding-001 生成向量"""
-    import time
+    """使用 Gemini embedding-001 生成向量（先查向量缓存）；失败时抛异常，由调用方降级"""
+    cached = embed_cache.get(text, "retrieval_document")
+    if cached is not None:
+        return cached
+    EMBED_TEXTS.labels("query").inc()
+    with metrics.inflight(INFLIGHT.labels("embed")), metrics.timed(EMBED_SECONDS.labels("query")):
+        return _embed_text_remote(text)
 
-    # 重试配置
-    max_retries = 3
-    retry_delay = 1
 
-    for attempt in range(max_retries):
-        try:
-            print(f"🔄 尝试向量化 (第{attempt+1}次)...")
-            response = genai.embed_content(
-                model="models/embedding-001",
-                content=text,
-                task_type="retrieval_document",
-            )
-            print(f"✅ 向量化成功")
-            return response["embedding"]
+def _embed_text_remote(text: str) -> List[float]:
+    response = gemini.call("query", lambda: genai.embed_content(
+        model=EMBED_MODEL,
+        content=text,
+        task_type="retrieval_document",
+    ))
+    embed_cache.put(text, response["embedding"], "retrieval_document")
+    return response["embedding"]
 
-        except Exception as e:
-            error_msg = str(e)
-            print(f"❌ 向量化失败 (第{attempt+1}次): {error_msg}")
-
-            # 如果是超时错误且还有重试次数，则等待后重试
-            if "504" in error_msg or "Deadline Exceeded" in error_msg:
-                if attempt < max_retries - 1:
-                    print(f"⏳ 等待 {retry_delay} 秒后重试...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # 指数退避
-                    continue
-
-            # 如果是最后一次尝试或其他错误，抛出异常
-            if attempt == max_retries - 1:
-                # 返回一个默认向量而不是抛出异常
-                print("⚠️  使用默认向量替代")
-                return [0.0] * 768  # 返回768维的零向量作为备用
-
-    # 这行代码理论上不会执行到
-    return [0.0] * 768
-
-
-def insert_chunks(doc_id: str, chunks: List[str]) -> int:
-    rows = []
-    for i, c in enumerate(chunks):
+
+def embed_texts(texts: List[str]) -> List[Optional[List[float]]]:
+    """批量生成向量（顺序与输入一致）：缓存命中的直接返回，其余一次多内容请求
+
+    重试后仍失败（或熔断中）的文本对应 None，由入库方转入重试队列。
+    """
+    cached = embed_cache.get_many(texts, "retrieval_document")
+    miss_idx = [i for i, v in enumerate(cached) if v is None]
+    if miss_idx:
         try:
-            print(f"🔄 处理第 {i+1}/{len(chunks)} 个文本块...")
-            embedding = embed_text(c)
-            rows.append({"doc_id": doc_id, "content": c, "embedding": embedding})
+            fresh = _embed_texts_remote([texts[i] for i in miss_idx])
         except Exception as e:
-            print(f"❌ 处理第 {i+1} 个文本块失败: {e}")
-            raise
+            print(f"⚠️  批量向量化失败 ({len(miss_idx)} 条)，稍后重试: {e}")
+            return cached
+        for i, vec in zip(miss_idx, fresh):
+            cached[i] = vec
+        embed_cache.put_many([texts[i] for i in miss_idx], fresh, "retrieval_document")
+    return cached
+
+
+def _embed_texts_remote(texts: List[str]) -> List[List[float]]:
+    """一次多内容 embed_content 请求"""
+    EMBED_TEXTS.labels("batch").inc(len(texts))
+    with metrics.inflight(INFLIGHT.labels("embed")), metrics.timed(EMBED_SECONDS.labels("batch")):
+        response = gemini.call("batch", lambda: genai.embed_content(
+            model=EMBED_MODEL,
+            content=texts,
+            task_type="retrieval_document",
+        ))
+    return response["embedding"]
+
+
+def insert_chunks(doc_id: str, chunks: List[str], metadata: Optional[List[Dict]] = None) -> int:
+    """向量化并入库；metadata 与 chunks 一一对应，作为结构化字段写入每行"""
+    return insert_rows([doc_id] * len(chunks), chunks, metadata)
+
+
+def insert_rows(doc_ids: List[str], chunks: List[str], metadata: Optional[List[Dict]] = None) -> int:
+    """同 insert_chunks，但每块可属于不同文档（批量分析共享一次向量化 + 写入）"""
+    with metrics.inflight(INFLIGHT.labels("insert")), metrics.timed(INSERT_SECONDS):
+        n = _insert_chunks(doc_ids, chunks, metadata)
+    CHUNKS_INSERTED.inc(n)
+    return n
+
+
+def _insert_chunks(doc_ids: List[str], chunks: List[str], metadata: Optional[List[Dict]]) -> int:
+    print(f"🔄 批量向量化 {len(chunks)} 个文本块 "
+          f"(batch={EMBED_BATCH_SIZE}, 并发={EMBED_CONCURRENCY})...")
+    embeddings = embed_in_batches(
+        chunks,
+        embed_texts,
+        batch_size=EMBED_BATCH_SIZE,
+        max_concurrency=EMBED_CONCURRENCY,
+    )
+    metadata = metadata or [{} for _ in chunks]
+    rows = [{**m, "doc_id": d, "content": c} for d, c, m in zip(doc_ids, chunks, metadata)]
+    return _store_rows(rows, embeddings)
+
+
+def invalidate_doc(doc_id: str) -> None:
+    """文档的已存行有变化：问答缓存与分析缓存中该文档的条目都已过期"""
+    answer_cache.invalidate_doc(doc_id)
+    analysis_cache.invalidate_doc(doc_id)
+
+
+def _store_rows(rows: List[Dict], embeddings: List[Optional[List[float]]]) -> int:
+    """写入已向量化的行；向量化失败的行转入重试队列（不以零向量入库）"""
+    ready = [{**r, "embedding": e} for r, e in zip(rows, embeddings) if e is not None]
+    failed = [r for r, e in zip(rows, embeddings) if e is None]
+    for r in failed:
+        embed_retry.put((r["doc_id"], r["content"]), r)
+    if failed:
+        EMBED_DEFERRED.inc(len(failed))
+        print(f"⏳ {len(failed)} 个文本块向量化失败，已加入重试队列（共 {len(embed_retry)} 个待重试）")
+
+    if ready:
+        print(f"💾 插入 {len(ready)} 条记录到数据库...")
+        vector_store.add(ready)
+        if hybrid_search():
+            lexical_index.add(ready)
+        embed_retry.discard((r["doc_id"], r["content"]) for r in ready)
+        print(f"✅ 成功插入 {len(ready)} 条记录")
+        for doc_id in dict.fromkeys(r["doc_id"] for r in ready):
+            invalidate_doc(doc_id)
+    return len(ready)
 
-    if rows:
-        print(f"💾 插入 {len(rows)} 条记录到数据库...")
-        supabase.table("audit_vectors").insert(rows).execute()
-        print(f"✅ 成功插入 {len(rows)} 条记录")
-    return len(rows)
+
+def retry_pending_embeddings(limit: int | None = None) -> int:
+    """重试队列中的文本块重新向量化入库，返回成功写入的条数（仍失败的重新入队）"""
+    rows = embed_retry.take(limit or EMBED_BATCH_SIZE * EMBED_CONCURRENCY)
+    if not rows:
+        return 0
+    embeddings = embed_in_batches(
+        [r["content"] for r in rows],
+        embed_texts,
+        batch_size=EMBED_BATCH_SIZE,
+        max_concurrency=EMBED_CONCURRENCY,
+    )
+    n = _store_rows(rows, embeddings)
+    CHUNKS_INSERTED.inc(n)
+    return n
 
 # --------------------------- 报告解析 --------------------------------------------
 
-def flatten_slither(payload: Dict) -> List[str]:
-    res = []
-    for det in payload.get("results", {}).get("detectors", []):
-        msg = det.get("description", "")
-        impact = det.get("impact", "")
-        els = ", ".join(e.get("name", "") for e in det.get("elements", []))
-        res.append(f"[Slither] 严重程度:{impact} | {msg} | 元素:{els}")
-    return res
+def flatten_slither_detector(det: Dict) -> str:
+    msg = det.get("description", "")
+    impact = det.get("impact", "")
+    els = ", ".join(e.get("name", "") for e in det.get("elements", []))
+    return f"[Slither] 严重程度:{impact} | {msg} | 元素:{els}"
 
 
-def flatten_echidna(payload: Dict) -> List[str]:
-    res = []
+def flatten_echidna_fail(fail: Dict) -> Optional[str]:
+    # 旧格式
+    if "property" in fail:
+        prop = fail.get("property", "")
+        trace = " -> ".join(fail.get("trace", []))
+        return f"[Echidna] 断言失败:{prop} | 调用路径:{trace}"
+    # 新格式
+    if "test" in fail:
+        contract = fail.get("contract", "")
+        test = fail.get("test", "")
+        status = fail.get("status", "")
+        error = fail.get("error", "")
+        return f"[Echidna] 合约:{contract} | 测试:{test} | 状态:{status} | 错误:{error}"
+    return None
+
+
+def flatten_item(kind: str, item: Dict) -> Optional[str]:
+    """流式解析出的单个元素 → 文本块"""
+    if kind == "slither":
+        return flatten_slither_detector(item)
+    return flatten_echidna_fail(item)
+
+
+def slither_items(payload: Dict) -> List[tuple[str, Dict]]:
+    return [("slither", det) for det in payload.get("results", {}).get("detectors", [])]
+
+
+def echidna_items(payload: Dict) -> List[tuple[str, Dict]]:
     # 支持两种格式：旧格式使用"fails"，新格式使用"results"
     fails = payload.get("fails", []) or payload.get("results", [])
+    return [("echidna", f) for f in fails if flatten_echidna_fail(f)]
+
+
+def flatten_slither(payload: Dict) -> List[str]:
+    return [flatten_item(k, det) for k, det in slither_items(payload)]
+
+
+def flatten_echidna(payload: Dict) -> List[str]:
+    return [flatten_item(k, f) for k, f in echidna_items(payload)]
+
+
+def finding_metadata(kind: str, item: Dict) -> Dict:
+    """单个发现的结构化字段（写入向量库，供检索过滤）"""
+    if kind == "slither":
+        return {
+            "tool": "slither",
+            "detector": item.get("check"),
+            "impact": item.get("impact"),
+            "confidence": item.get("confidence"),
+            "elements": [e.get("name", "") for e in item.get("elements", []) if e.get("name")],
+        }
+    name = item.get("property") or item.get("test")
+    return {
+        "tool": "echidna",
+        "detector": name,
+        "impact": None,
+        "confidence": None,
+        "elements": [n for n in (item.get("contract"), name) if n],
+    }
+
+
+def new_deduper() -> FindingDeduper:
+    return FindingDeduper(threshold=DEDUP_SIMILARITY, max_elements=DEDUP_MAX_ELEMENTS)
+
+
+def add_finding(deduper: FindingDeduper, kind: str, item: Dict) -> bool:
+    """扁平化并加入去重器，返回是否产生了文本块"""
+    chunk = flatten_item(kind, item)
+    if not chunk:
+        return False
+    meta = finding_metadata(kind, item)
+    scope = f"{meta['tool']}:{meta['detector'] or ''}:{meta['impact'] or ''}"
+    if not DEDUP_FINDINGS:
+        scope = deduper.unique_scope(scope, chunk)  # 关闭去重：每条发现独立 scope，各自成组
+    deduper.add(scope, chunk, meta["elements"], meta)
+    return True
+
+
+def dedup_findings(items: List[tuple[str, Dict]]) -> List[FindingGroup]:
+    """发现列表 → 去重后的分组"""
+    deduper = new_deduper()
+    for kind, item in items:
+        add_finding(deduper, kind, item)
+    groups = deduper.drain()
+    if len(groups) < deduper.seen:
+        print(f"🧹 去重: {deduper.seen} 条发现合并为 {len(groups)} 个文本块")
+    return groups
+
+
+def group_rows(groups: List[FindingGroup]) -> tuple[List[str], List[Dict]]:
+    """每组一个代表块，元素列表为组内全部元素。返回 (文本块, 元数据)"""
+    chunks = [g.chunk() for g in groups]
+    metadata = [
+        {**g.meta, "elements": g.elements, "occurrences": g.count, "fingerprint": g.key}
+        for g in groups
+    ]
+    return chunks, metadata
 
-    for fail in fails:
-        # 旧格式
-        if "property" in fail:
-            prop = fail.get("property", "")
-            trace = " -> ".join(fail.get("trace", []))
-            res.append(f"[Echidna] 断言失败:{prop} | 调用路径:{trace}")
-        # 新格式
-        elif "test" in fail:
-            contract = fail.get("contract", "")
-            test = fail.get("test", "")
-            status = fail.get("status", "")
-            error = fail.get("error", "")
-            res.append(f"[Echidna] 合约:{contract} | 测试:{test} | 状态:{status} | 错误:{error}")
-    return res
+
+def insert_groups(doc_id: str, groups: List[FindingGroup]) -> int:
+    return insert_chunks(doc_id, *group_rows(groups))
+
+
+def delete_findings(doc_id: str, fingerprints: List[Optional[str]]) -> int:
+    """从向量库与词法索引删除该文档中指定指纹的行"""
+    if not fingerprints:
+        return 0
+    wanted = set(fingerprints)
+    embed_retry.discard_where(lambda r: r["doc_id"] == doc_id and r.get("fingerprint") in wanted)
+    n = vector_store.delete(doc_id, fingerprints)
+    if hybrid_search():
+        lexical_index.remove(doc_id, fingerprints)
+    invalidate_doc(doc_id)
+    return n
+
+
+def update_groups(doc_id: str, groups: List[FindingGroup]) -> None:
+    """已入库的发现只更新入库文本与元数据（次数 / 元素列表），保留原向量"""
+    if not groups:
+        return
+    chunks, metadata = group_rows(groups)
+    rows = [{**m, "doc_id": doc_id, "content": c} for c, m in zip(chunks, metadata)]
+    vector_store.update(doc_id, rows)
+    if hybrid_search():
+        lexical_index.remove(doc_id, [g.key for g in groups])
+        lexical_index.add(rows)
+    invalidate_doc(doc_id)
+
+
+def sync_groups(
+    doc_id: str,
+    groups: List[FindingGroup],
+    stored: List[Dict],
+    prune: bool = True,
+) -> List[FindingGroup]:
+    """与已存行（`vector_store.fingerprints(doc_id)`）按指纹对比，返回需要向量化入库的新发现
+
+    入库文本有变化（次数 / 元素列表）的发现只更新文本与元数据，保留原向量；
+    prune 时删除本次未出现的发现。分批入库（/ingest）时 prune=False，最后由 `_ingest_finish()` 统一删除。
+    """
+    diff = diff_findings(stored, groups)
+    update_groups(doc_id, diff.changed)
+    keys = {g.key for g in groups}
+    stale = diff.stale if prune else [fp for fp in diff.stale if fp in keys]  # 非 prune 时只删本批的重复行
+    delete_findings(doc_id, stale)
+
+    FINDINGS_SYNCED.labels("new").inc(len(diff.new))
+    FINDINGS_SYNCED.labels("changed").inc(len(diff.changed))
+    FINDINGS_SYNCED.labels("unchanged").inc(diff.unchanged)
+    FINDINGS_SYNCED.labels("deleted").inc(len(stale))
+    if stored:
+        print(f"🔁 增量同步 {doc_id}: 新增 {len(diff.new)}，更新 {len(diff.changed)}，"
+              f"未变 {diff.unchanged}，删除 {len(stale)}")
+    return diff.new
+
+
+def upsert_groups(doc_id: str, groups: List[FindingGroup]) -> int:
+    """按 doc_id 增量入库：只向量化新发现。返回新写入的块数"""
+    new = sync_groups(doc_id, groups, vector_store.fingerprints(doc_id))
+    return insert_groups(doc_id, new) if new else 0
+
+
+def insert_group_batches(docs: List[tuple[str, List[FindingGroup]]]) -> int:
+    """多个文档的发现组合并为一次向量化 + 写入"""
+    doc_ids = [doc_id for doc_id, groups in docs for _ in groups]
+    chunks, metadata = group_rows([g for _, groups in docs for g in groups])
+    return insert_rows(doc_ids, chunks, metadata)
+
+# --------------------------- 代码索引 --------------------------------------------
+
+def parse_source_code(sol_path: Path, src_root: Path, whole_tree: bool = True) -> List[CodeChunk]:
+    """源码分块：主文件在前；whole_tree 时包含同一源码树中的其他 .sol（地址下载的多文件源码）"""
+    if not CODE_INDEX:
+        return []
+    files = [sol_path]
+    if whole_tree:
+        files += sorted(p for p in src_root.rglob("*.sol") if p != sol_path)
+    try:
+        return parse_files(files, src_root, CODE_INDEX_MAX_CHUNKS, CODE_CHUNK_MAX_CHARS)
+    except Exception as e:
+        print(f"⚠️  源码分块失败，跳过代码索引: {e}")
+        return []
+
+
+def index_code(doc_id: str, chunks: List[CodeChunk], groups: List[FindingGroup]) -> int:
+    """代码块关联引用其元素的发现后按指纹增量写入代码索引：只向量化新块，删除本次不再出现的块
+
+    返回新写入的块数。代码索引是问答的补充，失败只打印警告，不影响分析结果；
+    向量化失败的块不进入重试队列，下次重新分析时再写入。
+    """
+    if not chunks:
+        return 0
+    try:
+        link_findings(chunks, ((g.key, g.elements) for g in groups))
+        rows = {r["fingerprint"]: r for r in (c.row(doc_id) for c in chunks)}
+        stored = {r.get("fingerprint") for r in code_store.fingerprints(doc_id)}
+        stale = [fp for fp in stored if fp not in rows]
+        if stale:
+            code_store.delete(doc_id, stale)
+        new = [r for fp, r in rows.items() if fp not in stored]
+        embeddings = embed_in_batches(
+            [r["content"] for r in new],
+            embed_texts,
+            batch_size=EMBED_BATCH_SIZE,
+            max_concurrency=EMBED_CONCURRENCY,
+        ) if new else []
+        ready = [{**r, "embedding": e} for r, e in zip(new, embeddings) if e is not None]
+        if ready:
+            code_store.add(ready)
+    except Exception as e:
+        print(f"⚠️  代码索引写入失败 {doc_id}: {e}")
+        return 0
+    CODE_CHUNKS_INDEXED.inc(len(ready))
+    if ready or stale:
+        invalidate_doc(doc_id)
+    print(f"🧱 代码索引 {doc_id}: {len(rows)} 块，新增 {len(ready)}，删除 {len(stale)}，"
+          f"未变 {len(rows) - len(new)}，向量化失败 {len(new) - len(ready)}")
+    return len(ready)
+
+
+def retrieve_code(
+    q_emb: Optional[List[float]],
+    question: str,
+    matches: List[Dict],
+    filters: Optional[Dict[str, List[str]]] = None,
+) -> List[Dict]:
+    """代码索引候选：与问题相近的代码块、问题中点名的符号，以及命中发现的元素所对应的代码块
+
+    filters 中只有 doc_id 作用于代码检索；按元素取出的代码块不要求与问题相似。
+    """
+    if not CODE_INDEX or not q_emb:
+        return []
+    scope = {"doc_id": filters["doc_id"]} if filters and filters.get("doc_id") else {}
+    searches = [(scope, CODE_MATCH_THRESHOLD)]
+    names = identifiers(question)
+    if names:
+        searches.append(({**scope, "elements": names}, 0.0))
+    for m in matches[:CODE_TOP_K]:
+        elements = list(dict.fromkeys(element_key(e) for e in m.get("elements") or [] if e))
+        if elements and m.get("doc_id"):
+            searches.append(({"doc_id": [m["doc_id"]], "elements": elements}, 0.0))
+    found: Dict[tuple, Dict] = {}
+    try:
+        with metrics.timed(SEARCH_SECONDS.labels("code"), SEARCH_ERRORS.labels("code")):
+            for f, threshold in searches:
+                for r in code_store.search(q_emb, CODE_TOP_K * max(CONTEXT_OVERFETCH, 1), threshold, f or None):
+                    key = (r.get("doc_id"), r.get("fingerprint") or r["content"])
+                    if key not in found or r.get("similarity", 0.0) > found[key].get("similarity", 0.0):
+                        found[key] = r
+    except Exception as e:
+        print(f"⚠️  代码检索失败: {e}")
+    print(f"📊 代码检索结果: {len(found)} 条")
+    return list(found.values())
 
 # --------------------------- 外部工具调用 ----------------------------------------
 
-def run_slither(sol_path: Path) -> Dict:
-    """运行 Slither 并返回 JSON 结果"""
+async def run_slither(sol_path: Path, root: Path | None = None, remappings: List[str] | None = None) -> Dict:
+    """运行 Slither 并返回 JSON 结果
+
+    多文件源码时在源码树根目录 root 下运行，import 按相对路径与 remappings 解析。
+    """
+    with metrics.inflight(INFLIGHT.labels("slither")), \
+            metrics.timed(TOOL_SECONDS.labels("slither"), TOOL_FAILURES.labels("slither")):
+        return await _run_slither(sol_path, root, remappings)
+
+
+async def _run_slither(sol_path: Path, root: Path | None, remappings: List[str] | None) -> Dict:
+    target = sol_path.relative_to(root).as_posix() if root is not None else str(sol_path)
+    remaps = ["--solc-remaps", " ".join(remappings)] if remappings else []
     try:
-        result = subprocess.run(
-            ["slither", str(sol_path), "--json", "-"],
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=300,
+        code, stdout, stderr = await run_command(
+            ["slither", target, *remaps, *SLITHER_ARGS], timeout=SLITHER_TIMEOUT, cwd=root
         )
-        return json.loads(result.stdout or "{}")
-    except subprocess.CalledProcessError as e:
+    except asyncio.TimeoutError:
+        raise RuntimeError(f"Slither 执行超时 ({SLITHER_TIMEOUT}s)")
+    if code != 0 and not stdout.strip():
         print("❌ Slither 执行失败")
-        print("stdout:", e.stdout[:500])
-        print("stderr:", e.stderr[:500])
-        raise RuntimeError(f"Slither 执行失败: {e.stderr[:300]}")
+        print("stderr:", stderr[:500])
+        raise RuntimeError(f"Slither 执行失败: {stderr[:300]}")
+    return json.loads(stdout or "{}")
+
+
+async def run_echidna(sol_path: Path, contract_name: str, root: Path | None = None) -> Dict:
+    """调用 Echidna，输出 JSON（优先使用常驻容器池）；root 为多文件源码树根目录，为 None 时只使用 sol_path"""
+    with metrics.inflight(INFLIGHT.labels("echidna")), metrics.timed(TOOL_SECONDS.labels("echidna")):
+        result = await _run_echidna(sol_path, contract_name, root)
+    if result.get("error"):  # 失败时返回带 error 的空报告而不抛异常
+        TOOL_FAILURES.labels("echidna").inc()
+    return result
+
 
+async def _run_echidna(sol_path: Path, contract_name: str, root: Path | None) -> Dict:
+    if ECHIDNA_POOL_SIZE > 0:
+        return await _run_echidna_pooled(sol_path, contract_name, root)
 
-def run_echidna(sol_path: Path, contract_name: str) -> Dict:
-    """使用 Docker 调用 Echidna，输出 JSON"""
+    root = root or sol_path.parent
+    container = f"echidna-{uuid.uuid4().hex[:12]}"
     cmd = [
         "docker",
         "run",
         "--rm",
+        "--name",
+        container,
         "-v",
-        f"{sol_path.parent}:/src",
-        "trailofbits/eth-security-toolbox",
+        f"{root}:/src",
+        ECHIDNA_IMAGE,
         "echidna-test",
-        f"/src/{sol_path.name}",
+        f"/src/{sol_path.relative_to(root).as_posix()}",
         "--contract",
         contract_name,
-        "--format",
-        "json",
+        *ECHIDNA_ARGS,
     ]
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
-        return json.loads(result.stdout or "{}")
+        _, stdout, _ = await run_command(
+            cmd, timeout=ECHIDNA_TIMEOUT, on_kill=["docker", "rm", "-f", container]
+        )
+        return json.loads(stdout or "{}")
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        # 如果环境没有 Docker 或测试失败，返回空报告
-        return {"fails": [], "error": str(e)}
+        # 如果环境没有 Docker、超时或测试失败，返回空报告
+        return {"fails": [], "error": str(e) or type(e).__name__}
 
-# --------------------------- Etherscan 获取源码 -----------------------------------
+async def _run_echidna_pooled(sol_path: Path, contract_name: str, root: Path | None) -> Dict:
+    """在池成员中执行 Echidna：源码（或整个源码树）复制到独立任务目录后 exec"""
+    job_dir, job_path = echidna_pool.job_dir()
+    try:
+        if root is None:
+            shutil.copy2(sol_path, job_path / sol_path.name)
+            target = sol_path.name
+        else:
+            shutil.copytree(root, job_path, dirs_exist_ok=True)
+            target = sol_path.relative_to(root).as_posix()
+        _, stdout, _ = await echidna_pool.run(
+            ["echidna-test", target, "--contract", contract_name, *ECHIDNA_ARGS],
+            job_dir,
+            ECHIDNA_TIMEOUT,
+        )
+        return json.loads(stdout or "{}")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # 容器池不可用（如无 Docker）、超时或测试失败，返回空报告
+        return {"fails": [], "error": str(e) or type(e).__name__}
+    finally:
+        shutil.rmtree(job_path, ignore_errors=True)
 
-def fetch_source_from_etherscan(address: str) -> str:
-    if not ETHERSCAN_API_KEY:
-        raise RuntimeError("需要设置 ETHERSCAN_API_KEY 才能通过地址下载源码")
 
-    url = (
-        f"https://api.etherscan.io/api?module=contract&action=getsourcecode&address={address}"
-        f"&apikey={ETHERSCAN_API_KEY}"
-    )
-    resp = requests.get(url, timeout=15).json()
-    if resp.get("status") != "1":
-        raise RuntimeError("Etherscan 获取源码失败")
-    # 取第一个结果
-    return resp["result"][0]["SourceCode"]
+_tool_versions: Dict[str, str] | None = None
+
+
+async def get_tool_versions() -> Dict[str, str]:
+    """Slither 版本与 Echidna 镜像 ID（每个进程只探测一次）"""
+    global _tool_versions
+    if _tool_versions is None:
+        probes = {
+            "slither": ["slither", "--version"],
+            "echidna": ["docker", "image", "inspect", "--format", "{{.Id}}", ECHIDNA_IMAGE],
+        }
+        if ECHIDNA_POOL_SIZE > 0 and ECHIDNA_POOL_BACKEND == "local":
+            probes["echidna"] = ["echidna-test", "--version"]
+        versions = {}
+        for name, cmd in probes.items():
+            try:
+                code, out, _ = await run_command(cmd, timeout=30)
+                versions[name] = out.strip() if code == 0 else "unknown"
+            except Exception:
+                versions[name] = "unknown"
+        _tool_versions = versions
+    return _tool_versions
+
+
+async def compute_analysis_key(source: bytes, contract_name: str) -> str:
+    """源码哈希 + 合约名 + 工具版本 + 检测配置"""
+    config = {"slither_args": SLITHER_ARGS, "echidna_image": ECHIDNA_IMAGE, "echidna_args": ECHIDNA_ARGS}
+    return analysis_key(source, contract_name, await get_tool_versions(), config)
+
+# --------------------------- Etherscan 获取源码 -----------------------------------
+
+def fetch_source_from_etherscan(address: str, chain: str | None = None) -> ContractSource:
+    """已验证源码（单文件或展开后的 standard-JSON 文件树）；缓存命中时不访问网络"""
+    with metrics.inflight(INFLIGHT.labels("etherscan")), metrics.timed(ETHERSCAN_SECONDS, ETHERSCAN_ERRORS):
+        return etherscan_client.fetch(address, chain or ETHERSCAN_CHAIN)
 
 # --------------------------- FastAPI ------------------------------------------------
-app = FastAPI(title="RAG Audit Assistant API", version="2.0.0")
-
-# 添加CORS中间件
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",  # Next.js开发服务器
-        "http://127.0.0.1:3000",
-        "http://localhost:3001",  # 备用端口
-        "https://your-domain.com",  # 生产环境域名
-    ],
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
-)
+async def get_clients(request: Request) -> AsyncIterator[Clients]:
+    """所属应用的客户端；请求处理期间模块级客户端名（vector_store 等）都解析到它们"""
+    app_clients: Clients = request.app.state.clients
+    token = _bound_clients.set(app_clients)
+    try:
+        yield app_clients
+    finally:
+        _bound_clients.reset(token)
+
+
+router = APIRouter(dependencies=[Depends(get_clients)])
+
+job_manager: jobs.JobManager = _state("job_manager")
+
+
+def refresh_lexical_index() -> None:
+    """共享向量库：其他 worker 的写入只体现为清单版本变化，版本变化时从库重建本应用的词法索引
+
+    其他向量库没有 `version`，不做任何事（本进程的写入已增量更新索引）。
+    """
+    version = getattr(vector_store, "version", None)
+    if version is None:
+        return
+    # 扫描期间的新写入使版本再次变化，下次检索时重建
+    if lexical_index.sync(version, vector_store.scan):
+        print(f"📚 词法索引已按共享向量库版本 {version} 重建: {len(lexical_index)} 条记录")
+
+
+def _build_lexical_index():
+    try:
+        if getattr(vector_store, "version", None) is not None:
+            refresh_lexical_index()
+            return
+        n = lexical_index.add(vector_store.scan())
+        print(f"📚 词法索引已加载 {n} 条记录")
+    except Exception as e:
+        print(f"⚠️  词法索引加载失败，仅使用向量检索: {e}")
+
+
+def _warm_lexical_index():
+    # 后台加载，不阻塞启动；加载期间新入库的行同样会被索引
+    if hybrid_search():
+        threading.Thread(target=current_clients().bind(_build_lexical_index), name="lexical-index",
+                         daemon=True).start()
+
+
+def _retry_embeddings_forever():
+    while True:
+        time.sleep(EMBED_RETRY_INTERVAL)
+        if not len(embed_retry) or gemini.breaker.state == CircuitBreaker.OPEN:
+            continue
+        try:
+            n = retry_pending_embeddings()
+            if n:
+                print(f"🔁 重试队列: 补充入库 {n} 条，剩余 {len(embed_retry)} 条")
+        except Exception as e:
+            print(f"⚠️  重试队列入库失败: {e}")
+
+
+def _start_embed_retry():
+    if EMBED_RETRY_INTERVAL > 0:
+        threading.Thread(target=current_clients().bind(_retry_embeddings_forever), name="embed-retry",
+                         daemon=True).start()
+
+
+def _shutdown_echidna_pool():
+    # 池成员由分析任务线程的事件循环创建，需在同一循环中销毁
+    if ECHIDNA_POOL_SIZE > 0 and current_clients().state["echidna_pool"].ready:
+        job_manager.run_coroutine(echidna_pool.close(), timeout=60)
+
+
+def _warm_clients_now(app_clients: Clients) -> None:
+    for name, lazy in app_clients.items():
+        try:
+            lazy.get()
+        except Exception as e:
+            print(f"⚠️  客户端 {name} 创建失败: {e}")
+    ready = sum(lazy.ready for lazy in app_clients.values())
+    print(f"🔥 客户端预热完成: {ready}/{len(app_clients)}")
+
+
+def _warm_clients():
+    # 后台创建，不阻塞启动：/health 立即可用，/ready 在全部客户端就绪后返回 200
+    app_clients = current_clients()
+    if app_clients.settings.warmup:
+        threading.Thread(target=_warm_clients_now, args=(app_clients,), name="warm-clients", daemon=True).start()
+
+
+# --------------------------- 依赖注入 ------------------------------------------------
+def get_settings(request: Request) -> Settings:
+    return request.app.state.settings
+
+
+def get_embed_cache(app_clients: Clients = Depends(get_clients)) -> EmbeddingCache:
+    return app_clients["embed_cache"].get()
+
+
+def get_analysis_cache(app_clients: Clients = Depends(get_clients)) -> AnalysisCache:
+    return app_clients["analysis_cache"].get()
+
+
+def get_etherscan_client(app_clients: Clients = Depends(get_clients)) -> EtherscanClient:
+    return app_clients["etherscan_client"].get()
+
+
+class AskFilters(BaseModel):
+    """检索过滤条件：同一字段内任一值匹配，字段之间取交集（不区分大小写）"""
+    doc_id: List[str] | None = None
+    tool: List[str] | None = None        # slither / echidna
+    detector: List[str] | None = None    # Slither check 或 Echidna 属性/测试名
+    impact: List[str] | None = None      # High / Medium / Low / Informational / Optimization
+    confidence: List[str] | None = None
+    elements: List[str] | None = None    # 合约 / 函数 / 变量名
+
+    def to_filters(self) -> Dict[str, List[str]]:
+        return {k: v for k, v in self.model_dump().items() if v}
 
 class AskSchema(BaseModel):
     question: str
     top_k: int | None = 5
+    filters: AskFilters | None = None
 
 class AskResp(BaseModel):
     answer: str
+    context: Dict | None = None  # 上下文组装统计：candidates / kept / tokens / budget
 
 class AnalyzeResp(BaseModel):
     doc_id: str
     slither_findings: int
     echidna_fails: int
+    status: str = jobs.COMPLETED  # 任务未结束时为 pending/running/cancelling，计数为 0
 
-@app.get("/health")
+class AnalyzeStatusResp(BaseModel):
+    doc_id: str
+    status: str
+    progress: int
+    message: str | None = None
+    created_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+    stages: List[Dict]
+
+class BatchItemResp(BaseModel):
+    doc_id: str
+    source: str  # 压缩包内路径或合约地址
+    status: str
+    message: str | None = None
+    slither_findings: int = 0
+    echidna_fails: int = 0
+
+class BatchResp(BaseModel):
+    batch_id: str
+    status: str
+    progress: int
+    message: str | None = None
+    items: List[BatchItemResp]
+
+ANALYZE_STAGES = ["source", "slither", "echidna", "insert"]
+
+@router.get("/health")
 async def health():
     return {"status": "ok"}
 
-@app.post("/analyze", response_model=AnalyzeResp)
+@router.get("/ready")
+async def ready(cfg: Settings = Depends(get_settings), app_clients: Clients = Depends(get_clients)):
+    """就绪检查：预热开启时全部客户端创建完毕才返回 200，任一创建失败返回 503 并附错误"""
+    status = {name: lazy.status() for name, lazy in app_clients.items()}
+    ok = not cfg.warmup or all(s["ready"] for s in status.values())
+    body = {"status": "ready" if ok else "starting", "warmup": cfg.warmup, "clients": status}
+    return JSONResponse(body, status_code=200 if ok else 503)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@router.get("/cache/stats")
+async def cache_stats(
+    embeddings: EmbeddingCache = Depends(get_embed_cache),
+    analyses: AnalysisCache = Depends(get_analysis_cache),
+    sources: EtherscanClient = Depends(get_etherscan_client),
+):
+    return {
+        "embeddings": embeddings.stats(),
+        "analyses": analyses.stats(),
+        "sources": sources.stats(),
+        "answers": answer_cache.stats(),
+        "embed_retry": embed_retry.stats(),
+        "gemini": gemini.stats(),
+        "executors": {"data": data_executor.stats(), "stream": stream_executor.stats()},
+    }
+
+
+def cached_analysis(job: jobs.Job, key: str, force: bool) -> Optional[AnalyzeResp]:
+    """相同源码 + 合约名 + 工具版本已分析过：返回已有结果，并把剩余阶段标为跳过"""
+    cached = None if force else analysis_cache.get(key)
+    if cached is None:
+        return None
+    print(f"♻️  命中分析缓存: {cached['doc_id']}")
+    for name in ("slither", "echidna", "insert"):
+        job.skip(name, "命中分析缓存")
+    return AnalyzeResp(**cached)
+
+
+def load_address_source(address: str, chain: str | None, dest: Path) -> tuple[Path, ContractSource]:
+    """下载地址的已验证源码并写入 dest 下的文件树，返回 (主文件, 源码)"""
+    source = fetch_source_from_etherscan(address, chain)
+    return source.write_tree(dest), source
+
+
+async def run_tools(
+    job: jobs.Job,
+    sol_path: Path,
+    src_root: Path,
+    contract_name: str,
+    remappings: List[str],
+) -> tuple[List[tuple[str, Dict]], List[tuple[str, Dict]], Optional[str]]:
+    """Slither 与 Echidna 并行运行，各自报告就绪后立即解析。返回 (Slither 发现, Echidna 失败, Echidna 错误)"""
+    echidna_error = None
+
+    async def slither_stage() -> List[tuple[str, Dict]]:
+        with job.stage("slither"):
+            return slither_items(await run_slither(sol_path, src_root, remappings))
+
+    async def echidna_stage() -> List[tuple[str, Dict]]:
+        nonlocal echidna_error
+        with job.stage("echidna"):
+            ech_json = await run_echidna(sol_path, contract_name, src_root)
+            echidna_error = ech_json.get("error")
+            return echidna_items(ech_json)
+
+    tasks = [asyncio.create_task(slither_stage()), asyncio.create_task(echidna_stage())]
+    try:
+        sl_items, ech_items = await asyncio.gather(*tasks)
+    except BaseException:
+        # 任一失败或任务被取消：取消另一个工具（子进程随之被杀掉）
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return sl_items, ech_items, echidna_error
+
+
+def finish_analysis(
+    key: str,
+    doc_id: str,
+    sl_items: List[tuple[str, Dict]],
+    ech_items: List[tuple[str, Dict]],
+    echidna_error: Optional[str],
+) -> AnalyzeResp:
+    result = AnalyzeResp(
+        doc_id=doc_id,
+        slither_findings=len(sl_items),
+        echidna_fails=len(ech_items),
+    )
+    # Echidna 未能运行（如无 Docker）时不缓存，环境恢复后可得到完整结果
+    if not echidna_error:
+        analysis_cache.put(key, result.model_dump())
+    return result
+
+
+async def run_analysis(
+    job: jobs.Job,
+    src_bytes: bytes | None,
+    filename: str | None,
+    address: str | None,
+    contract_name: str | None,
+    force: bool = False,
+    chain: str | None = None,
+) -> AnalyzeResp:
+    """后台执行一次完整分析：取源码 → (查分析缓存) → Slither ‖ Echidna → 入库"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmp_path = Path(tmpdir)
+        remappings: List[str] = []
+        # 写入源码；地址下载的多文件源码展开为文件树
+        with job.stage("source"):
+            if src_bytes is not None:
+                src_root = tmp_path
+                sol_path = tmp_path / filename
+                sol_path.write_bytes(src_bytes)
+                digest = src_bytes
+                doc_id = sol_path.stem
+            else:
+                src_root = tmp_path / "src"
+                sol_path, source = await asyncio.to_thread(load_address_source, address, chain, src_root)
+                remappings = source.remappings
+                digest = source.digest()
+                doc_id = address_doc_id(address, chain or ETHERSCAN_CHAIN)
+                if contract_name is None:
+                    contract_name = source.contract_name
+
+        # 确定合约名
+        if contract_name is None:
+            contract_name = sol_path.stem
+
+        key = await compute_analysis_key(digest, contract_name)
+        cached = cached_analysis(job, key, force)
+        if cached is not None:
+            return cached
+
+        sl_items, ech_items, echidna_error = await run_tools(job, sol_path, src_root, contract_name, remappings)
+        code = await asyncio.to_thread(parse_source_code, sol_path, src_root)
+
+    # 入库
+    with job.stage("insert"):
+        groups = dedup_findings(sl_items + ech_items)
+        await asyncio.to_thread(upsert_groups, doc_id, groups)
+        await asyncio.to_thread(index_code, doc_id, code, groups)
+
+    return finish_analysis(key, doc_id, sl_items, ech_items, echidna_error)
+
+
+async def run_batch(
+    batch: jobs.Job,
+    targets: List[str],
+    archive: bytes | None,
+    chain: str | None,
+    force: bool,
+) -> Dict:
+    """批量分析：最多 BATCH_WORKERS 个合约同时跑工具，发现汇总后共享向量化与入库
+
+    targets 与 batch.items 一一对应：压缩包内的相对路径，或合约地址。
+    """
+    sem = asyncio.Semaphore(max(1, BATCH_WORKERS))
+    batcher = InsertBatcher(insert_group_batches, len(batch.items), BATCH_INSERT_SIZE)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmp_path = Path(tmpdir)
+        archive_root = tmp_path / "archive"
+        archive_digest = b""
+        if archive is not None:
+            await asyncio.to_thread(extract_sol_archive, archive, archive_root)
+            archive_digest = hashlib.sha256(archive).digest()
+
+        async def analyze_item(item: jobs.Job, target: str) -> AnalyzeResp:
+            delivered = False
+            item.status = jobs.PENDING  # 等待并发名额
+            try:
+                # 只有取源码与跑工具占用并发名额；等待共享入库时让出给其他合约
+                async with sem:
+                    item.status = jobs.RUNNING
+                    item.started_at = time.time()
+                    remappings: List[str] = []
+                    with item.stage("source"):
+                        if archive is not None:
+                            src_root = archive_root
+                            sol_path = archive_root / target
+                            # 压缩包内的文件可互相 import：指纹包含整个压缩包
+                            digest = archive_digest + target.encode("utf-8")
+                            contract_name = sol_path.stem
+                        else:
+                            src_root = tmp_path / item.job_id
+                            sol_path, source = await asyncio.to_thread(load_address_source, target, chain, src_root)
+                            remappings = source.remappings
+                            digest = source.digest()
+                            contract_name = source.contract_name or sol_path.stem
+
+                    key = await compute_analysis_key(digest, contract_name)
+                    cached = cached_analysis(item, key, force)
+                    if cached is not None:
+                        return cached
+                    sl_items, ech_items, echidna_error = await run_tools(
+                        item, sol_path, src_root, contract_name, remappings
+                    )
+                    # 压缩包的解压目录为各合约共享：只对本合约的文件分块
+                    code = await asyncio.to_thread(parse_source_code, sol_path, src_root, archive is None)
+
+                with item.stage("insert"):
+                    groups = await asyncio.to_thread(dedup_findings, sl_items + ech_items)
+                    stored = await asyncio.to_thread(vector_store.fingerprints, item.job_id)
+                    # 已存在的发现在此同步，只有新发现进入共享向量化
+                    new = await asyncio.to_thread(sync_groups, item.job_id, groups, stored)
+                    delivered = True
+                    if new:
+                        await batcher.add(item.job_id, new)
+                    else:
+                        await batcher.skip()
+                    await asyncio.to_thread(index_code, item.job_id, code, groups)
+                return finish_analysis(key, item.job_id, sl_items, ech_items, echidna_error)
+            finally:
+                if not delivered:
+                    await batcher.skip()
+
+        await asyncio.gather(*(
+            jobs.track(item, lambda job, t=target: analyze_item(job, t))
+            for item, target in zip(batch.items, targets)
+        ))
+
+    counts = {status: sum(1 for i in batch.items if i.status == status) for status in jobs.FINISHED}
+    print(f"📦 批量分析 {batch.job_id}: {counts}，共享入库 {batcher.flushes} 次")
+    return {"items": len(batch.items), **counts}
+
+
+@router.post("/analyze", response_model=AnalyzeResp)
 async def analyze(
     file: UploadFile | None = File(None),
     address: str | None = Form(None),
     contract_name: str | None = Form(None),
+    chain: str | None = Form(None),
+    wait: bool = Form(False),
+    force: bool = Form(False),
 ):
-    """接收 Solidity 文件或合约地址，自动运行 Slither + Echidna 并入库"""
+    """接收 Solidity 文件或合约地址（`chain` 为链名或 chainid，默认 `ETHERSCAN_CHAIN`），提交后台分析任务后立即返回
+
+    通过 `/analyze/{doc_id}/status` 轮询进度，完成后 `/analyze/{doc_id}` 获取结果；
+    `wait=true` 时等待任务结束再返回（CI / 脚本使用）。
+    相同源码已分析过时直接返回已有 doc_id 与计数，`force=true` 强制重新分析。
+    同一 doc_id 的任务尚未结束时返回 409（等待结束或取消后重新提交）。
+    """
     if not file and not address:
         raise HTTPException(status_code=400, detail="需要上传源码文件或提供 address")
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        tmp_path = Path(tmpdir)
-        # 写入源码
-        if file:
-            src_bytes = await file.read()
-            sol_path = tmp_path / file.filename
-            sol_path.write_bytes(src_bytes)
-        else:
-            source = fetch_source_from_etherscan(address)  # may raise
-            fname = f"{address[:6]}.sol"
-            sol_path = tmp_path / fname
-            sol_path.write_text(source)
+    if file:
+        src_bytes = await file.read()
+        filename = Path(file.filename).name
+        doc_id = Path(filename).stem
+    else:
+        src_bytes, filename = None, None
+        try:
+            doc_id = address_doc_id(address, chain or ETHERSCAN_CHAIN)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-        # 运行 Slither
-        sl_json = run_slither(sol_path)
-        sl_chunks = flatten_slither(sl_json)
+    # 上传的源码可在请求内直接查缓存；地址需先下载源码，在任务中查
+    if src_bytes is not None and not force:
+        key = await compute_analysis_key(src_bytes, contract_name or doc_id)
+        cached = analysis_cache.get(key)
+        if cached is not None:
+            print(f"♻️  命中分析缓存: {cached['doc_id']}")
+            result = AnalyzeResp(**cached)
+            job_manager.record(result.doc_id, result)
+            return result
 
-        # 确定合约名
-        if contract_name is None:
-            contract_name = sol_path.stem
+    try:
+        job = job_manager.submit(
+            doc_id,
+            ANALYZE_STAGES,
+            lambda job: run_analysis(job, src_bytes, filename, address, contract_name, force, chain),
+        )
+    except jobs.JobRunning:
+        raise HTTPException(status_code=409, detail=f"{doc_id} 正在分析中，请等待结束或取消后重新提交")
+    if wait:
+        job = await job_manager.wait(job.job_id)
+        if job.status != jobs.COMPLETED:
+            raise HTTPException(status_code=500, detail=f"分析失败: {job.message}")
+        return job.result
 
-        # 运行 Echidna（可选）
-        ech_json = run_echidna(sol_path, contract_name)
-        ech_chunks = flatten_echidna(ech_json)
+    return AnalyzeResp(doc_id=doc_id, slither_findings=0, echidna_fails=0, status=job.status)
 
-    # 入库
-    doc_id = sol_path.stem
-    insert_chunks(doc_id, sl_chunks + ech_chunks)
 
-    return AnalyzeResp(
-        doc_id=doc_id,
-        slither_findings=len(sl_chunks),
-        echidna_fails=len(ech_chunks),
+def batch_response(batch: jobs.Job) -> BatchResp:
+    items = []
+    for item in batch.items:
+        result = item.result if item.status == jobs.COMPLETED else None
+        items.append(BatchItemResp(
+            doc_id=item.job_id,
+            source=item.stages["source"].detail or "",
+            status=item.status,
+            message=item.message,
+            slither_findings=result.slither_findings if result else 0,
+            echidna_fails=result.echidna_fails if result else 0,
+        ))
+    return BatchResp(
+        batch_id=batch.job_id,
+        status=batch.status,
+        progress=batch.progress,
+        message=batch.message,
+        items=items,
     )
 
-# 旧端点：批量上传报告 JSON
-@app.post("/ingest")
+
+@router.post("/analyze/batch", response_model=BatchResp)
+async def analyze_batch(
+    archive: UploadFile | None = File(None),
+    addresses: str | None = Form(None),
+    chain: str | None = Form(None),
+    wait: bool = Form(False),
+    force: bool = Form(False),
+):
+    """批量分析：zip 压缩包中的全部 .sol 文件，或地址列表（JSON 数组或逗号/换行分隔）
+
+    每个合约一个子任务（doc_id 为文件名，或 `eip155:<chainid>:<小写地址>`），可单独通过 `/analyze/{doc_id}` 查询；
+    整批进度通过 `/analyze/batch/{batch_id}` 查询，`DELETE /analyze/batch/{batch_id}` 取消。
+    """
+    if (archive is None) == (not addresses):
+        raise HTTPException(status_code=400, detail="需要上传 zip 压缩包或提供 addresses（二选一）")
+
+    try:
+        if archive is not None:
+            data = await archive.read()
+            targets = list_sol_members(data, BATCH_MAX_ITEMS, BATCH_MAX_ARCHIVE_BYTES)
+            doc_ids = doc_ids_for(targets)
+        else:
+            data = None
+            targets = parse_addresses(addresses)
+            if len(targets) > BATCH_MAX_ITEMS:
+                raise ValueError(f"地址数 {len(targets)} 超过上限 {BATCH_MAX_ITEMS}")
+            doc_ids = [address_doc_id(a, chain or ETHERSCAN_CHAIN) for a in targets]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not targets:
+        raise HTTPException(status_code=400, detail="没有可分析的合约")
+
+    busy = [d for d in doc_ids if (j := job_manager.get(d)) is not None and j.status not in jobs.FINISHED]
+    if busy:
+        raise HTTPException(status_code=409, detail=f"以下合约正在分析中: {', '.join(busy[:10])}")
+
+    batch_id = f"batch-{uuid.uuid4().hex[:12]}"
+    items = []
+    for doc_id, target in zip(doc_ids, targets):
+        item = jobs.Job.create(doc_id, ANALYZE_STAGES)
+        item.stages["source"].detail = target
+        items.append(job_manager.adopt(item))
+
+    def start(batch: jobs.Job):
+        batch.items = items
+        return run_batch(batch, targets, data, chain, force)
+
+    batch = job_manager.submit(batch_id, [], start)
+    batch.items = items
+    if wait:
+        batch = await job_manager.wait(batch_id)
+    return batch_response(batch)
+
+
+@router.get("/analyze/batch/{batch_id}", response_model=BatchResp)
+async def analyze_batch_status(batch_id: str):
+    batch = job_manager.get(batch_id)
+    if batch is None or not batch_id.startswith("batch-"):
+        raise HTTPException(status_code=404, detail=f"未找到批量任务: {batch_id}")
+    return batch_response(batch)
+
+
+@router.delete("/analyze/batch/{batch_id}")
+async def cancel_batch(batch_id: str):
+    batch = job_manager.get(batch_id)
+    if batch is None or not batch_id.startswith("batch-"):
+        raise HTTPException(status_code=404, detail=f"未找到批量任务: {batch_id}")
+    if not job_manager.cancel(batch_id):
+        raise HTTPException(status_code=409, detail=f"任务已结束: {batch.status}")
+    # 批量任务仍在排队时子项不会再执行
+    for item in batch.items:
+        if item.status == jobs.PENDING:
+            item.status = jobs.CANCELLED
+            item.message = "已取消"
+    return {"batch_id": batch_id, "status": batch.status}
+
+
+@router.get("/analyze/{doc_id}/status", response_model=AnalyzeStatusResp)
+async def analyze_status(doc_id: str):
+    job = job_manager.get(doc_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"未找到分析任务: {doc_id}")
+    return job.to_status()
+
+
+@router.get("/analyze/{doc_id}", response_model=AnalyzeResp)
+async def analyze_result(doc_id: str):
+    job = job_manager.get(doc_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"未找到分析任务: {doc_id}")
+    if job.status == jobs.COMPLETED:
+        return job.result
+    if job.status in (jobs.FAILED, jobs.CANCELLED):
+        raise HTTPException(status_code=409, detail=f"分析{job.status}: {job.message}")
+    return AnalyzeResp(doc_id=doc_id, slither_findings=0, echidna_fails=0, status=job.status)
+
+
+@router.delete("/analyze/{doc_id}")
+async def cancel_analysis(doc_id: str):
+    job = job_manager.get(doc_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"未找到分析任务: {doc_id}")
+    if not job_manager.cancel(doc_id):
+        raise HTTPException(status_code=409, detail=f"任务已结束: {job.status}")
+    return {"doc_id": doc_id, "status": job.status}
+
+
+def _ingest_feed(parser: ReportStreamParser, deduper: FindingDeduper, data: bytes) -> List[FindingGroup]:
+    """解析一块上传内容（空块表示结束）；待入库的组数达到批大小或已到结尾时取出这些组"""
+    items = parser.feed(data) if data else parser.close()
+    for kind, item in items:
+        add_finding(deduper, kind, item)
+    if len(deduper) >= INGEST_BATCH_SIZE or (not data and len(deduper)):
+        return deduper.drain()
+    return []
+
+
+def _ingest_sync(
+    doc_id: str,
+    groups: List[FindingGroup],
+    stored: List[Dict],
+    written: Dict[str, tuple[FindingGroup, str]],
+) -> int:
+    """一批发现与已存行同步并入库；written 记录本次请求已写入的 指纹 → (组, 写入时的文本)
+
+    去重按批进行，同一指纹可能出现在多个批次中：已写入过的并入先前的组，最后由 `_ingest_finish()`
+    统一更新文本。若逐批与开始时的已存行对比，后续批次会把它当作重复行删除并重新向量化。
+    """
+    fresh = []
+    for g in groups:
+        if g.key in written:
+            written[g.key][0].absorb(g, DEDUP_MAX_ELEMENTS)
+        else:
+            written[g.key] = (g, g.chunk())
+            fresh.append(g)
+    new = sync_groups(doc_id, fresh, stored, prune=False)
+    return insert_groups(doc_id, new) if new else 0
+
+
+def _ingest_finish(doc_id: str, stored: List[Dict], written: Dict[str, tuple[FindingGroup, str]]) -> None:
+    """跨批次合并过的发现更新为合并后的文本；删除本次未出现的已存行"""
+    update_groups(doc_id, [g for g, text in written.values() if g.chunk() != text])
+    delete_findings(doc_id, list(dict.fromkeys(
+        r.get("fingerprint") for r in stored if r.get("fingerprint") not in written
+    )))
+
+
+# 旧端点：批量上传报告 JSON（流式解析，按批入库）
+@router.post("/ingest")
 async def ingest(files: List[UploadFile] = File(...)):
     total = 0
     try:
         for f in files:
             print(f"📄 处理文件: {f.filename}")
-            file_content = await f.read()
-            data = json.load(io.BytesIO(file_content))
-
-            if "slitherVersion" in data or ("results" in data and "detectors" in data.get("results", {})):
-                print(f"🔍 检测到Slither报告")
-                chunks = flatten_slither(data)
-            elif "fails" in data or "echidnaVersion" in data or ("results" in data and isinstance(data["results"], list)):
-                print(f"🧪 检测到Echidna报告")
-                chunks = flatten_echidna(data)
-            else:
+            doc_id = Path(f.filename).stem
+            parser = ReportStreamParser()
+            # 近似重复的发现合并为一组；待入库的组数达到批大小即向量化入库
+            deduper = new_deduper()
+            inserted = 0
+            # 同一 doc_id 重新上传：只向量化新发现，最后删除本次未出现的
+            stored = await data_executor.run(vector_store.fingerprints, doc_id)
+            written: Dict[str, tuple[FindingGroup, str]] = {}
+
+            while True:
+                data = await f.read(INGEST_READ_SIZE)
+                # 解析、去重与入库都在数据线程池中执行，事件循环只负责读上传内容
+                groups = await data_executor.run(_ingest_feed, parser, deduper, data)
+                if groups:
+                    inserted += await data_executor.run(_ingest_sync, doc_id, groups, stored, written)
+                if not data:
+                    break
+
+            if parser.kind is None:
                 print(f"❌ 不支持的格式: {f.filename}")
-                print(f"数据结构: {list(data.keys())}")
                 raise HTTPException(status_code=400, detail=f"不支持的格式: {f.filename}")
-
-            print(f"📝 生成了 {len(chunks)} 个文本块")
-            inserted = insert_chunks(Path(f.filename).stem, chunks)
+            await data_executor.run(_ingest_finish, doc_id, stored, written)
+            print(f"{'🔍 Slither' if parser.kind == 'slither' else '🧪 Echidna'}报告: "
+                  f"解析 {parser.items} 项，去重后插入了 {inserted} 个块到数据库")
             total += inserted
-            print(f"✅ 插入了 {inserted} 个块到数据库")
 
         return {"files": len(files), "chunks_inserted": total}
-    except json.JSONDecodeError as e:
+    except HTTPException:
+        raise
+    except ExecutorBusy as e:
+        print(f"⛔ {e}")
+        raise HTTPException(status_code=503, detail=f"服务繁忙，请稍后重试: {e}")
+    except ValueError as e:  # 含 json.JSONDecodeError
         print(f"❌ JSON解析错误: {e}")
         raise HTTPException(status_code=400, detail=f"JSON格式错误: {str(e)}")
     except Exception as e:
@@ -329,88 +1602,316 @@ async def ingest(files: List[UploadFile] = File(...)):
         raise HTTPException(status_code=500, detail=f"处理文件时出错: {str(e)}")
 
 # 问答
-@app.post("/ask", response_model=AskResp)
-async def ask(body: AskSchema):
+def retrieve(
+    question: str,
+    top_k: int,
+    filters: Optional[Dict[str, List[str]]] = None,
+) -> tuple[Optional[List[float]], List[Dict]]:
+    """问题向量化 + 向量检索，与 BM25 词法检索按 RRF 融合。返回 (问题向量, 检索结果)
+
+    filters 在两路检索内部先于相似度排序生效（见 `vector_store.FILTER_FIELDS`）。
+    """
+    # 尝试生成问题的向量
+    print("🔄 生成问题向量...")
     try:
-        print(f"🤔 收到问题: {body.question}")
+        q_emb = embed_text(question)
+        print(f"✅ 向量生成成功，维度: {len(q_emb)}")
+    except Exception as embed_error:
+        print(f"⚠️  向量生成失败，仅使用词法检索: {embed_error}")
+        q_emb = None
 
-        # 尝试生成问题的向量
-        print("🔄 生成问题向量...")
+    # 搜索相关文档
+    print("🔍 搜索相关文档...")
+    vector_hits: List[Dict] = []
+    if q_emb:
         try:
-            q_emb = embed_text(body.question)
-            print(f"✅ 向量生成成功，维度: {len(q_emb)}")
-            use_vector_search = True
-        except Exception as embed_error:
-            print(f"⚠️  向量生成失败，将使用简单文本搜索: {embed_error}")
-            q_emb = None
-            use_vector_search = False
-
-        # 搜索相关文档
-        print("🔍 搜索相关文档...")
-        res = None
-
-        if use_vector_search and q_emb:
-            try:
-                res = supabase.rpc(
-                    "match_documents",
-                    {
-                        "query_embedding": q_emb,
-                        "match_threshold": 0.7,
-                        "match_count": body.top_k or 5
-                    }
-                ).execute()
-                print(f"📊 向量搜索结果: {len(res.data) if res.data else 0} 条")
-            except Exception as rpc_error:
-                print(f"⚠️  向量搜索失败: {rpc_error}")
-                res = None
-
-        # 如果向量搜索失败，使用简单查询
-        if not res or not res.data:
-            print("🔄 使用简单查询...")
-            try:
-                res = (
-                    supabase.table("audit_vectors")
-                    .select("content")
-                    .limit(body.top_k or 5)
-                    .execute()
-                )
-                print(f"📊 简单查询结果: {len(res.data) if res.data else 0} 条")
-            except Exception as db_error:
-                print(f"⚠️  数据库查询失败: {db_error}")
-                res = None
-
-        # 构建上下文
-        if res and res.data:
-            context = "\n\n".join(r["content"] for r in res.data)
-            print(f"📝 上下文长度: {len(context)} 字符")
-        else:
-            context = "暂无相关审计数据。请先上传一些审计报告。"
-            print("⚠️  没有找到相关数据")
-
-        # 构建提示词
-        prompt = textwrap.dedent(
-            f"""
-            你是一名区块链安全审计专家。请根据以下上下文回答用户问题，并提供修复建议。
-            ### 上下文
-            {context}
-            ### 问题
-            {body.question}
-            ### 回答
-            """
+            with metrics.inflight(INFLIGHT.labels("search")), \
+                    metrics.timed(SEARCH_SECONDS.labels("vector"), SEARCH_ERRORS.labels("vector")):
+                vector_hits = vector_store.search(q_emb, top_k, threshold=MATCH_THRESHOLD, filters=filters)
+            print(f"📊 向量搜索结果: {len(vector_hits)} 条")
+        except Exception as rpc_error:
+            print(f"⚠️  向量搜索失败: {rpc_error}")
+    else:
+        RETRIEVAL_FALLBACKS.labels("no_query_vector").inc()
+
+    if not hybrid_search():
+        return q_emb, vector_hits
+
+    with metrics.timed(SEARCH_SECONDS.labels("lexical")):
+        try:
+            refresh_lexical_index()
+        except Exception as e:
+            print(f"⚠️  词法索引重建失败，沿用旧索引: {e}")
+        lexical_hits = lexical_index.search(question, top_k, filters=filters)
+    print(f"📊 词法搜索结果: {len(lexical_hits)} 条")
+    if lexical_hits and not vector_hits:
+        RETRIEVAL_FALLBACKS.labels("lexical_only").inc()
+    matches = reciprocal_rank_fusion([vector_hits, lexical_hits], top_k, k=HYBRID_RRF_K)
+    if not matches:
+        RETRIEVAL_FALLBACKS.labels("no_context").inc()
+    return q_emb, matches
+
+
+def gather_context(
+    question: str,
+    top_k: int,
+    filters: Optional[Dict[str, List[str]]] = None,
+) -> tuple[Optional[List[float]], List[Dict], Dict]:
+    """多取候选后按 token 预算组装上下文。返回 (问题向量, 选中的块, 统计)"""
+    q_emb, candidates = retrieve(question, top_k * max(CONTEXT_OVERFETCH, 1), filters)
+    matches, stats = build_context(
+        question,
+        candidates,
+        max_chunks=top_k,
+        token_budget=CONTEXT_TOKEN_BUDGET,
+        lambda_=CONTEXT_MMR_LAMBDA,
+    )
+    print(f"🧩 上下文: 候选 {stats.candidates} 条，保留 {stats.kept} 条，约 {stats.tokens} tokens")
+    stats = stats.to_dict()
+    code = retrieve_code(q_emb, question, matches, filters)
+    if code:
+        # 代码块单独计预算：只附上相关的片段，而不是整份合约
+        code, code_stats = build_context(
+            question,
+            code,
+            max_chunks=CODE_TOP_K,
+            token_budget=CODE_CONTEXT_TOKEN_BUDGET,
+            lambda_=CONTEXT_MMR_LAMBDA,
         )
+        print(f"🧩 代码上下文: 候选 {code_stats.candidates} 条，保留 {code_stats.kept} 条，约 {code_stats.tokens} tokens")
+        matches = matches + code
+        stats["code"] = code_stats.to_dict()
+    return q_emb, matches, stats
+
+
+def build_prompt(question: str, matches: List[Dict]) -> str:
+    # 构建上下文：工具发现在前，相关源码单独成节
+    if matches:
+        parts = [r["content"] for r in matches if not is_code_row(r)]
+        code = [r["content"] for r in matches if is_code_row(r)]
+        if code:
+            parts.append("### 相关代码\n" + "\n\n".join(code))
+        context = "\n\n".join(parts)
+        print(f"📝 上下文长度: {len(context)} 字符")
+    else:
+        context = "暂无相关审计数据。请先上传一些审计报告。"
+        print("⚠️  没有找到相关数据")
+
+    # 构建提示词
+    return textwrap.dedent(
+        f"""
+        你是一名区块链安全审计专家。请根据以下上下文回答用户问题，并提供修复建议。
+        ### 上下文
+        {context}
+        ### 问题
+        {question}
+        ### 回答
+        """
+    )
+
+
+def sources_of(matches: List[Dict]) -> List[Dict]:
+    """检索结果 → 前端 AskResponse.sources 格式"""
+    return [
+        {
+            "title": r.get("doc_id") or "",
+            "content": r["content"],
+            "score": r.get("similarity", 0.0),
+            "metadata": {
+                k: r[k] for k in (CODE_FIELDS if is_code_row(r) else FILTER_FIELDS) if k != "doc_id" and r.get(k)
+            },
+        }
+        for r in matches
+    ]
+
+
+@router.post("/ask", response_model=AskResp)
+async def ask(body: AskSchema):
+    try:
+        print(f"🤔 收到问题: {body.question}")
+        filters = body.filters.to_filters() if body.filters else None
+        # 向量化（含重试退避）与检索在数据线程池中进行，不阻塞事件循环
+        q_emb, matches, stats = await data_executor.run(gather_context, body.question, body.top_k or 5, filters)
+        if q_emb:
+            cached = answer_cache.lookup(q_emb, matches)
+            if cached is not None:
+                print("♻️  命中语义答案缓存")
+                return AskResp(answer=cached, context=stats)
+        prompt = build_prompt(body.question, matches)
 
         # 调用Gemini生成回答
         print("🤖 调用Gemini生成回答...")
-        model = genai.GenerativeModel("gemini-2.0-flash")
-        response = model.generate_content(prompt)
+        model = genai.GenerativeModel(GENERATION_MODEL)
+        with metrics.inflight(INFLIGHT.labels("generation")), \
+                metrics.timed(GENERATION_SECONDS.labels("sync"), GENERATION_ERRORS.labels("sync")):
+            response = await gemini.call_async("generate", lambda: model.generate_content(prompt))
 
         answer = response.text
         print(f"✅ 回答生成成功，长度: {len(answer)} 字符")
+        if q_emb:
+            answer_cache.store(q_emb, matches, answer)
 
-        return AskResp(answer=answer)
+        return AskResp(answer=answer, context=stats)
 
+    except (CircuitOpenError, ExecutorBusy) as e:
+        print(f"⛔ {e}")
+        raise HTTPException(status_code=503, detail=f"问答服务暂不可用: {e}")
     except Exception as e:
         print(f"❌ 问答处理失败: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"问答处理失败: {str(e)}")
+
+
+def _sse(data) -> str:
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    return f"data: {payload}\n\n"
+
+
+def _cancel_stream(response) -> None:
+    """尽力关闭 Gemini 流式响应底层的 gRPC/HTTP 流"""
+    for obj in (getattr(response, "_iterator", None), response):
+        for name in ("cancel", "close"):
+            fn = getattr(obj, name, None)
+            if callable(fn):
+                try:
+                    fn()
+                except Exception:
+                    pass
+                return
+
+
+async def stream_generation(prompt: str):
+    """在 `stream_executor` 线程中迭代 `generate_content(stream=True)`，逐段产出 ("chunk"|"error", text)
+
+    调用方停止迭代（如客户端断开）时通知生产线程退出并关闭上游流；线程池已满时抛 ExecutorBusy。
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def emit(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:  # 事件循环已关闭
+            stop.set()
+
+    def produce():
+        response = None
+        start = time.perf_counter()
+        first = True
+        INFLIGHT.labels("generation").inc()
+        try:
+            model = genai.GenerativeModel(GENERATION_MODEL)
+            # 只有建立流的请求可重试；已开始推送后出错直接报告
+            response = gemini.call("stream", lambda: model.generate_content(prompt, stream=True))
+            for part in response:
+                if stop.is_set():
+                    print("🛑 客户端已断开，停止生成")
+                    break
+                text = getattr(part, "text", "")
+                if text:
+                    if first:
+                        GENERATION_FIRST_CHUNK.observe(time.perf_counter() - start)
+                        first = False
+                    emit(("chunk", text))
+        except Exception as e:
+            GENERATION_ERRORS.labels("stream").inc()
+            emit(("error", str(e)))
+        finally:
+            INFLIGHT.labels("generation").dec()
+            GENERATION_SECONDS.labels("stream").observe(time.perf_counter() - start)
+            if stop.is_set() and response is not None:
+                _cancel_stream(response)
+            emit(("done", None))
+
+    stream_executor.submit(produce)
+    try:
+        while True:
+            kind, text = await queue.get()
+            if kind == "done":
+                break
+            yield kind, text
+    finally:
+        stop.set()
+
+
+@router.post("/ask/stream")
+async def ask_stream(body: AskSchema):
+    """SSE 流式问答：先发送检索元数据，再逐段转发 Gemini 输出，最后 `[DONE]`"""
+    print(f"🤔 收到问题(流式): {body.question}")
+    try:
+        filters = body.filters.to_filters() if body.filters else None
+        q_emb, matches, stats = await data_executor.run(gather_context, body.question, body.top_k or 5, filters)
+    except ExecutorBusy as e:
+        raise HTTPException(status_code=503, detail=f"问答服务暂不可用: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"问答处理失败: {str(e)}")
+    cached = answer_cache.lookup(q_emb, matches) if q_emb else None
+    prompt = build_prompt(body.question, matches)
+
+    async def events():
+        yield _sse({"type": "metadata", "sources": sources_of(matches), "count": len(matches),
+                    "cached": cached is not None, "context": stats})
+        if cached is not None:
+            print("♻️  命中语义答案缓存")
+            yield _sse({"chunk": cached})
+            yield _sse("[DONE]")
+            return
+        parts: List[str] = []
+        try:
+            async for kind, text in stream_generation(prompt):
+                if kind == "error":
+                    print(f"❌ 流式生成失败: {text}")
+                    yield _sse({"type": "error", "error": text})
+                    break
+                parts.append(text)
+                yield _sse({"chunk": text})
+            else:
+                if q_emb:
+                    answer_cache.store(q_emb, matches, "".join(parts))
+        except ExecutorBusy as e:  # 元数据已发出，只能以错误事件告知
+            print(f"⛔ {e}")
+            yield _sse({"type": "error", "error": str(e)})
+        yield _sse("[DONE]")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def create_app(app_settings: Settings | None = None) -> FastAPI:
+    """应用工厂：只注册路由与启动钩子，不创建任何客户端
+
+    配置与客户端放在 `app.state.settings` / `app.state.clients`，客户端按 `app_settings`
+    （默认读取环境变量）在首次使用时创建；同一进程内的多个应用各用各的配置与客户端。
+    """
+    app_settings = app_settings or Settings.from_env()
+    app_clients = clients if app_settings is settings else Clients(app_settings)
+    app = FastAPI(title="RAG Audit Assistant API", version="2.0.0")
+    app.state.settings = app_settings
+    app.state.clients = app_clients
+    app.include_router(router)
+    app.router.add_event_handler("startup", app_clients.bind(_warm_clients))
+    app.router.add_event_handler("startup", app_clients.bind(_warm_lexical_index))
+    app.router.add_event_handler("startup", app_clients.bind(_start_embed_retry))
+    app.router.add_event_handler("shutdown", app_clients.bind(_shutdown_echidna_pool))
+    # 添加CORS中间件
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost:3000",  # Next.js开发服务器
+            "http://127.0.0.1:3000",
+            "http://localhost:3001",  # 备用端口
+            "https://your-domain.com",  # 生产环境域名
+        ],
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        allow_headers=["*"],
+    )
+    return app
+
+
+app = create_app(settings)
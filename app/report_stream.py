@@ -0,0 +1,129 @@
+"""Slither / Echidna 报告的流式解析
+==============================
+
+大型 monorepo 的 Slither JSON 可达数百 MB。`ReportStreamParser` 按块喂入字节，
+只在目标数组内用 `JSONDecoder.raw_decode` 逐个解析元素，不构建整份文档：
+
+- `results.detectors[*]` → ("slither", detector)
+- `fails[*]` / 顶层 `results[*]` → ("echidna", fail)
+
+内存占用为 O(读块大小 + 单个元素)，与报告大小无关。
+"""
+from __future__ import annotations
+
+import codecs
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+_TOKEN = re.compile(r'[{}\[\]",:]')
+_STRING_REST = re.compile(r'(?:[^"\\]|\\.)*"', re.S)
+
+# 目标数组路径 → 报告类型
+TARGETS = {
+    ("results", "detectors"): "slither",
+    ("fails",): "echidna",
+    ("results",): "echidna",
+}
+VERSION_KEYS = {"slitherVersion": "slither", "echidnaVersion": "echidna"}
+
+
+class ReportStreamParser:
+    """推模式的增量解析器：`feed(bytes)` 返回本次新解析出的 (kind, item) 列表"""
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._stack: List[list] = []  # [类型 'obj'|'arr', 当前键, 目标类型]
+        self._expect_key = False
+        self._started = False
+        self._final = False
+        self.kinds: set = set()
+        self.items = 0
+
+    @property
+    def kind(self) -> Optional[str]:
+        """识别出的报告类型；未识别时为 None"""
+        if "slither" in self.kinds:
+            return "slither"
+        if "echidna" in self.kinds:
+            return "echidna"
+        return None
+
+    def feed(self, data: bytes) -> List[Tuple[str, Any]]:
+        self._buf += self._decoder.decode(data)
+        return self._scan()
+
+    def close(self) -> List[Tuple[str, Any]]:
+        self._buf += self._decoder.decode(b"", final=True)
+        self._final = True
+        out = self._scan()
+        if self._stack or not self._started:
+            raise ValueError("JSON 不完整")
+        return out
+
+    # ------------------------------------------------------------------ 内部
+    def _path(self) -> Tuple[str, ...]:
+        return tuple(f[1] if f[0] == "obj" else "*" for f in self._stack)
+
+    def _scan(self) -> List[Tuple[str, Any]]:
+        out: List[Tuple[str, Any]] = []
+        buf, pos, stack = self._buf, self._pos, self._stack
+        while True:
+            m = _TOKEN.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                break
+            ch, i = m.group(), m.start()
+            if ch == '"':
+                sm = _STRING_REST.match(buf, i + 1)
+                if sm is None:  # 字符串跨块，等待更多数据
+                    if self._final:
+                        raise ValueError("JSON 不完整: 字符串未结束")
+                    pos = i
+                    break
+                if self._expect_key and stack and stack[-1][0] == "obj":
+                    key = json.loads(buf[i:sm.end()])
+                    stack[-1][1] = key
+                    if len(stack) == 1 and key in VERSION_KEYS:
+                        self.kinds.add(VERSION_KEYS[key])
+                    self._expect_key = False
+                pos = sm.end()
+                continue
+
+            if ch in "{[" and stack and stack[-1][2]:
+                # 目标数组的元素：交给 C 实现的 raw_decode 一次解析完整个元素
+                try:
+                    item, end = self._json.raw_decode(buf, i)
+                except ValueError:
+                    if self._final:
+                        raise
+                    pos = i  # 元素跨块，保留其起点等待更多数据
+                    break
+                out.append((stack[-1][2], item))
+                self.items += 1
+                pos = end
+                continue
+
+            pos = i + 1
+            if ch in "{[":
+                self._started = True
+                target = TARGETS.get(self._path()) if ch == "[" else None
+                if target:
+                    self.kinds.add(target)
+                stack.append(["obj" if ch == "{" else "arr", None, target])
+                self._expect_key = ch == "{"
+            elif ch in "}]":
+                if not stack:
+                    raise ValueError(f"JSON 结构错误: 多余的 {ch!r}")
+                stack.pop()
+            elif ch == ",":
+                if stack and stack[-1][0] == "obj":
+                    self._expect_key = True
+
+        # 丢弃已处理的前缀，只保留未完成的元素 / 字符串
+        self._buf = buf[pos:]
+        self._pos = 0
+        return out
@@ -0,0 +1,119 @@
+"""语义答案缓存
+============
+
+近似问题（"有没有重入漏洞?" / "reentrancy issues?"）复用已生成的回答：
+
+- 条目保存 (问题向量, 检索到的 chunk 指纹, 涉及的 doc_id, 回答)；
+- 新问题向量与某条目余弦相似度 >= `threshold`，且本次检索到的上下文指纹相同，才命中；
+- TTL 过期 + LRU 淘汰；某个 doc_id 有新数据入库时，涉及它的条目全部失效。
+"""
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+def chunk_id(row: Dict) -> str:
+    """检索结果行的稳定标识：优先使用库内 id，否则取 doc_id + content 的哈希"""
+    if row.get("id") is not None:
+        return str(row["id"])
+    h = hashlib.sha1(f"{row.get('doc_id', '')}\x00{row['content']}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def context_fingerprint(matches: Sequence[Dict]) -> str:
+    return hashlib.sha1("\x00".join(sorted(chunk_id(r) for r in matches)).encode()).hexdigest()
+
+
+@dataclass
+class _Entry:
+    vector: np.ndarray
+    context: str
+    doc_ids: frozenset
+    answer: str
+    created_at: float
+
+
+class SemanticCache:
+    """线程安全的语义答案缓存"""
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600.0, max_entries: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, query_embedding: Sequence[float], matches: Sequence[Dict]) -> Optional[str]:
+        q = _unit(query_embedding)
+        ctx = context_fingerprint(matches)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            best_id, best_sim = None, self.threshold
+            for eid, e in self._entries.items():
+                if e.context != ctx:
+                    continue
+                sim = float(e.vector @ q)
+                if sim >= best_sim:
+                    best_id, best_sim = eid, sim
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id].answer
+
+    def store(self, query_embedding: Sequence[float], matches: Sequence[Dict], answer: str) -> None:
+        if self.max_entries <= 0:
+            return
+        entry = _Entry(
+            vector=_unit(query_embedding),
+            context=context_fingerprint(matches),
+            doc_ids=frozenset(r.get("doc_id") for r in matches if r.get("doc_id")),
+            answer=answer,
+            created_at=time.time(),
+        )
+        with self._lock:
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_doc(self, doc_id: str) -> int:
+        """删除涉及 doc_id 的条目，返回删除条数"""
+        with self._lock:
+            stale = [eid for eid, e in self._entries.items() if doc_id in e.doc_ids]
+            for eid in stale:
+                del self._entries[eid]
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _expire(self, now: float) -> None:
+        if self.ttl <= 0:
+            return
+        stale: List[int] = [eid for eid, e in self._entries.items() if now - e.created_at > self.ttl]
+        for eid in stale:
+            del self._entries[eid]
+
+
+def _unit(vec: Sequence[float]) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
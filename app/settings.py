@@ -0,0 +1,88 @@
+"""客户端配置（`create_app(settings)` 的参数）
+=======================================
+
+只包含创建外部客户端所需的配置：凭据、向量库后端、各缓存路径，以及取决于后端与进程数的混合检索开关。
+构造 `Settings` 不做校验、不创建任何连接；缺少必需的环境变量时，由 `validate()` 在首次创建客户端时报错（或由 `/ready` 报告），
+而不是在导入模块时让整个进程退出。其余调优参数仍由 `rag_audit_api` 顶部的环境变量读取。
+"""
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import Mapping, Optional
+
+
+def _flag(value: Optional[str], default: Optional[bool]) -> Optional[bool]:
+    if value is None or value == "":
+        return default
+    return value.lower() not in ("0", "false", "no")
+
+
+@dataclass
+class Settings:
+    supabase_url: Optional[str] = None
+    supabase_key: Optional[str] = None
+    google_api_key: Optional[str] = None
+    etherscan_api_key: Optional[str] = None
+    etherscan_rate_limit: float = 5.0
+    etherscan_cache_path: Optional[str] = ".cache/etherscan.sqlite3"
+    vector_store: str = "supabase"  # supabase | local | shared
+    local_vector_store_path: Optional[str] = ".cache/vectors"
+    shared_vector_store_path: Optional[str] = ".cache/shared-vectors"
+    vector_store_read_only: bool = False  # shared：只读打开（不接受入库的 worker）
+    local_vector_ann_min_rows: int = 0
+    vector_quantization: str = "float32"
+    vector_rescore_factor: int = 4
+    embed_cache_path: Optional[str] = ".cache/embeddings.sqlite3"
+    embed_cache_memory_items: int = 10000
+    embed_cache_disk_items: int = 500000
+    analysis_cache_path: Optional[str] = ".cache/analysis.sqlite3"
+    warmup: bool = True  # 启动后在后台线程预先创建客户端，完成后 /ready 返回 200
+    workers: int = 1  # 服务进程数（WEB_CONCURRENCY）
+    # BM25 + 向量混合检索。BM25 是每个进程内的索引，只随本进程的写入更新，None 时按后端与进程数决定：
+    # 多进程（看不到其他 worker 的入库与删除）或共享向量库（每个 worker 一份全部行文本）时关闭
+    hybrid_search: Optional[bool] = None
+
+    def __post_init__(self) -> None:
+        if self.hybrid_search is None:
+            self.hybrid_search = self.vector_store != "shared" and self.workers <= 1
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] | None = None) -> "Settings":
+        env = os.environ if env is None else env
+        d = cls()
+        return cls(
+            supabase_url=env.get("SUPABASE_URL"),
+            supabase_key=env.get("SUPABASE_KEY"),
+            google_api_key=env.get("GEMINI_API_KEY") or env.get("GOOGLE_API_KEY"),
+            etherscan_api_key=env.get("ETHERSCAN_API_KEY"),
+            etherscan_rate_limit=float(env.get("ETHERSCAN_RATE_LIMIT", d.etherscan_rate_limit)),
+            etherscan_cache_path=env.get("ETHERSCAN_CACHE_PATH", d.etherscan_cache_path) or None,
+            vector_store=env.get("VECTOR_STORE", d.vector_store),
+            local_vector_store_path=env.get("LOCAL_VECTOR_STORE_PATH", d.local_vector_store_path) or None,
+            shared_vector_store_path=env.get("SHARED_VECTOR_STORE_PATH", d.shared_vector_store_path) or None,
+            vector_store_read_only=_flag(env.get("VECTOR_STORE_READ_ONLY"), d.vector_store_read_only),
+            local_vector_ann_min_rows=int(env.get("LOCAL_VECTOR_ANN_MIN_ROWS", d.local_vector_ann_min_rows)),
+            vector_quantization=env.get("VECTOR_QUANTIZATION", d.vector_quantization),
+            vector_rescore_factor=int(env.get("VECTOR_RESCORE_FACTOR", d.vector_rescore_factor)),
+            embed_cache_path=env.get("EMBED_CACHE_PATH", d.embed_cache_path) or None,
+            embed_cache_memory_items=int(env.get("EMBED_CACHE_MEMORY_ITEMS", d.embed_cache_memory_items)),
+            embed_cache_disk_items=int(env.get("EMBED_CACHE_DISK_ITEMS", d.embed_cache_disk_items)),
+            analysis_cache_path=env.get("ANALYSIS_CACHE_PATH", d.analysis_cache_path) or None,
+            warmup=_flag(env.get("WARMUP_CLIENTS"), d.warmup),
+            workers=int(env.get("WEB_CONCURRENCY") or d.workers),
+            hybrid_search=_flag(env.get("HYBRID_SEARCH"), None),
+        )
+
+    def validate(self) -> None:
+        """缺少必需配置时抛 RuntimeError"""
+        if self.vector_store == "supabase":
+            if not (self.supabase_url and self.supabase_key and self.google_api_key):
+                raise RuntimeError("❗ 请设置 SUPABASE_URL / SUPABASE_KEY / GOOGLE_API_KEY 环境变量！")
+        elif self.vector_store in ("local", "shared"):
+            if not self.google_api_key:
+                raise RuntimeError("❗ 请设置 GOOGLE_API_KEY 环境变量！")
+            if self.vector_store == "shared" and not self.shared_vector_store_path:
+                raise RuntimeError("❗ VECTOR_STORE=shared 需要设置 SHARED_VECTOR_STORE_PATH！")
+        else:
+            raise RuntimeError(f"❗ 不支持的 VECTOR_STORE: {self.vector_store}")
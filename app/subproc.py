@@ -0,0 +1,44 @@
+"""异步子进程工具
+==============
+
+`run_command` 以 asyncio 子进程运行外部工具（Slither / Echidna / docker），
+不阻塞事件循环；超时或被取消时杀掉子进程并执行可选的清理命令。
+"""
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+from typing import List
+
+
+async def run_command(
+    cmd: List[str],
+    timeout: float,
+    on_kill: List[str] | None = None,
+    cwd: str | Path | None = None,
+) -> tuple[int, str, str]:
+    """以 asyncio 子进程运行命令，返回 (returncode, stdout, stderr)
+
+    超时或被取消时杀掉子进程（并执行 on_kill 清理命令，如 `docker rm -f`）后再抛出。
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=str(cwd) if cwd is not None else None,
+    )
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+    except BaseException:  # TimeoutError / CancelledError
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        if on_kill:
+            cleanup = await asyncio.create_subprocess_exec(
+                *on_kill,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            await cleanup.wait()
+        raise
+    return proc.returncode, out.decode(errors="replace"), err.decode(errors="replace")
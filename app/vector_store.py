@@ -0,0 +1,1041 @@
+"""向量存储抽象
+============
+
+`insert_chunks` 与 `/ask` 只依赖 `VectorStore` 接口：
+
+- `SupabaseVectorStore`：原有的 `audit_vectors` 表 + `match_documents` RPC；
+- `LocalVectorStore`：进程内 NumPy 实现，向量归一化后存放在连续的 float32 矩阵中，
+  余弦 top-k 为一次矩阵乘 + argpartition；行数达到 `ann_min_rows` 后启用 HNSW 近似索引；
+  指定 `path` 时追加写入磁盘（`vectors.f32` + `rows.jsonl`），重启后加载，支持增量添加；
+  删除只追加行号到 `deleted.txt`，删除行超过一半时压缩重写；
+  `quantization="float16" | "int8"` 时内存中只保留量化后的向量（见 `quantization`），候选在紧凑形式上选出，
+  前 `top_k × rescore_factor` 个再用 `vectors.f32`（内存映射，只读取候选行）的全精度向量重新打分；
+  不落盘时没有全精度副本，重新打分使用反量化向量；
+- `SharedVectorStore`：多个 worker 进程共享的只读内存映射（不可变段 + 原子替换的清单），
+  单一写入方（文件锁）追加新段，每台机器的向量只占一份内存。
+
+行格式：`{"doc_id": str, "content": str, "embedding": List[float]}`，另可带结构化字段
+`tool` / `detector` / `impact` / `confidence` / `elements`（见 `FILTER_FIELDS`），
+检索结果附带 `similarity`（余弦相似度）。
+
+增量重新分析按 `(doc_id, fingerprint)` 定位已存的发现：`fingerprints()` 列出某文档的已存行，
+`update()` 只改文本与元数据（保留原向量），`delete()` 删除消失的发现（`None` 匹配无指纹的旧行）。
+
+`search(..., filters={"doc_id": ["Vault"], "impact": ["High"]})` 先按字段过滤再做相似度排序：
+同一字段内任一值匹配即可（不区分大小写），不同字段之间取交集；`elements` 为列表字段，有交集即匹配。
+"""
+from __future__ import annotations
+
+import abc
+import heapq
+import json
+import math
+import os
+import random
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内锁，不支持多进程写入
+    fcntl = None
+
+import numpy as np
+
+from quantization import FLOAT32, CodeView, check_quantization, code_dtype, dequantize, quantize, scores
+
+Row = Dict[str, Any]
+Filters = Dict[str, List[str]]
+
+FILTER_FIELDS = ("doc_id", "tool", "detector", "impact", "confidence", "elements")
+
+_LOAD_BLOCK = 65536  # 启动加载时每次追加的行数
+
+
+def _field_values(row: Row, field: str) -> List[str]:
+    value = row.get(field)
+    if value is None:
+        return []
+    values = value if isinstance(value, (list, tuple)) else [value]
+    return [str(v).lower() for v in values if v is not None and v != ""]
+
+
+def normalize_filters(filters: Optional[Filters]) -> Filters:
+    """去掉空条件并统一小写；未知字段报错"""
+    out: Filters = {}
+    for field, values in (filters or {}).items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"不支持的过滤字段: {field}")
+        if isinstance(values, str):
+            values = [values]
+        values = [str(v).lower() for v in values or [] if v is not None and v != ""]
+        if values:
+            out[field] = values
+    return out
+
+
+def matches_filters(row: Row, filters: Optional[Filters]) -> bool:
+    for field, wanted in normalize_filters(filters).items():
+        if not set(_field_values(row, field)) & set(wanted):
+            return False
+    return True
+
+
+class VectorStore(abc.ABC):
+    """向量存储接口"""
+
+    @abc.abstractmethod
+    def add(self, rows: List[Row]) -> int:
+        """写入行，返回写入条数"""
+
+    @abc.abstractmethod
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        top_k: int,
+        threshold: float = 0.0,
+        filters: Optional[Filters] = None,
+    ) -> List[Row]:
+        """在满足 filters 的行中按余弦相似度返回最相近的 top_k 行（相似度 >= threshold）"""
+
+    @abc.abstractmethod
+    def sample(self, limit: int) -> List[Row]:
+        """任意返回若干行（向量检索不可用时的兜底）"""
+
+    @abc.abstractmethod
+    def scan(self, batch_size: int = 1000) -> Iterator[Row]:
+        """遍历全部行（不含 embedding），用于重建词法索引"""
+
+    @abc.abstractmethod
+    def fingerprints(self, doc_id: str) -> List[Row]:
+        """某文档已存行的 `fingerprint`（无则为 None）与 `content`"""
+
+    @abc.abstractmethod
+    def update(self, doc_id: str, rows: List[Row]) -> int:
+        """按 fingerprint 更新已存行的文本与元数据，保留原向量；rows 不含 embedding"""
+
+    @abc.abstractmethod
+    def delete(self, doc_id: str, fingerprints: Sequence[Optional[str]]) -> int:
+        """删除该文档中指纹在 fingerprints 内的行（None 匹配无指纹的行），返回删除条数"""
+
+
+class SupabaseVectorStore(VectorStore):
+    """Supabase `audit_vectors` 表 + `match_documents` RPC
+
+    带过滤条件的检索调用 `match_documents_filtered`（SQL 见 README），
+    在数据库内先按字段过滤再排序。
+    `quantization="float16"` 时写入与查询的向量按半精度取最短十进制表示（列类型为 `HALFVEC`），
+    JSON 请求体约缩小到 1/3；pgvector 没有 int8 向量类型。
+    """
+
+    def __init__(
+        self,
+        client,
+        table: str = "audit_vectors",
+        rpc: str = "match_documents",
+        filtered_rpc: str = "match_documents_filtered",
+        quantization: str = FLOAT32,
+    ):
+        self.client = client
+        self.table = table
+        self.rpc = rpc
+        self.filtered_rpc = filtered_rpc
+        self.quantization = check_quantization(quantization)
+        if self.quantization not in (FLOAT32, "float16"):
+            raise ValueError(f"Supabase 向量库不支持 {self.quantization} 量化（pgvector 仅有 vector / halfvec）")
+
+    def _wire(self, embedding: Sequence[float]) -> List[float]:
+        if self.quantization == FLOAT32:
+            return list(embedding)
+        return [float(str(x)) for x in np.asarray(embedding, dtype=np.float16)]
+
+    def add(self, rows: List[Row]) -> int:
+        if rows:
+            if self.quantization != FLOAT32:
+                rows = [{**r, "embedding": self._wire(r["embedding"])} if "embedding" in r else r for r in rows]
+            self.client.table(self.table).insert(rows).execute()
+        return len(rows)
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        top_k: int,
+        threshold: float = 0.0,
+        filters: Optional[Filters] = None,
+    ) -> List[Row]:
+        params = {
+            "query_embedding": self._wire(query_embedding),
+            "match_threshold": threshold,
+            "match_count": top_k,
+        }
+        filters = normalize_filters(filters)
+        if filters:
+            params["filter"] = filters
+        res = self.client.rpc(self.filtered_rpc if filters else self.rpc, params).execute()
+        return res.data or []
+
+    def sample(self, limit: int) -> List[Row]:
+        res = self.client.table(self.table).select("content").limit(limit).execute()
+        return res.data or []
+
+    def scan(self, batch_size: int = 1000) -> Iterator[Row]:
+        start = 0
+        while True:
+            res = (
+                self.client.table(self.table)
+                .select(", ".join(("content", "fingerprint") + FILTER_FIELDS))  # 与其他后端一样带指纹与过滤字段
+                .range(start, start + batch_size - 1)
+                .execute()
+            )
+            rows = res.data or []
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            start += batch_size
+
+    def fingerprints(self, doc_id: str, batch_size: int = 1000) -> List[Row]:
+        out: List[Row] = []
+        start = 0
+        while True:
+            res = (
+                self.client.table(self.table)
+                .select("fingerprint, content")
+                .eq("doc_id", doc_id)
+                .range(start, start + batch_size - 1)
+                .execute()
+            )
+            rows = res.data or []
+            out.extend(rows)
+            if len(rows) < batch_size:
+                return out
+            start += batch_size
+
+    def update(self, doc_id: str, rows: List[Row]) -> int:
+        for row in rows:
+            fields = {k: v for k, v in row.items() if k not in ("embedding", "doc_id", "fingerprint")}
+            (
+                self.client.table(self.table)
+                .update(fields)
+                .eq("doc_id", doc_id)
+                .eq("fingerprint", row["fingerprint"])
+                .execute()
+            )
+        return len(rows)
+
+    def delete(self, doc_id: str, fingerprints: Sequence[Optional[str]]) -> int:
+        n = 0
+        keyed = [fp for fp in fingerprints if fp is not None]
+        if keyed:
+            res = self.client.table(self.table).delete().eq("doc_id", doc_id).in_("fingerprint", keyed).execute()
+            n += len(res.data or [])
+        if len(keyed) < len(fingerprints):
+            res = self.client.table(self.table).delete().eq("doc_id", doc_id).is_("fingerprint", "null").execute()
+            n += len(res.data or [])
+        return n
+
+
+class LocalVectorStore(VectorStore):
+    """NumPy 余弦检索（可选 HNSW）+ 追加式磁盘持久化，线程安全
+
+    删除为墓碑标记（检索时跳过），删除行超过一半时 `compact()` 重建矩阵、索引与磁盘文件。
+    量化存储时磁盘上的 `vectors.f32` 仍为全精度，供重新打分与压缩使用。
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        path: str | Path | None = None,
+        ann_min_rows: int = 0,
+        hnsw_m: int = 16,
+        hnsw_ef_construction: int = 100,
+        hnsw_ef_search: int = 64,
+        quantization: str = FLOAT32,
+        rescore_factor: int = 4,
+    ):
+        self.dim = dim
+        self.path = Path(path) if path else None
+        self.ann_min_rows = ann_min_rows
+        self.quantization = check_quantization(quantization)
+        self.rescore_factor = max(1, rescore_factor)
+        self._hnsw_params = dict(m=hnsw_m, ef_construction=hnsw_ef_construction, ef_search=hnsw_ef_search)
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((1024, dim), dtype=code_dtype(self.quantization))  # 按需倍增的连续矩阵
+        self._scales = np.ones(1024, dtype=np.float32)  # int8 每行的缩放系数
+        self._full: Optional[np.ndarray] = None  # vectors.f32 的内存映射（量化时用于重新打分）
+        self._alive = np.ones(1024, dtype=bool)
+        self._size = 0
+        self._deleted = 0
+        self._rows: List[Row] = []  # 不含 embedding；已删除的行为 None
+        self._fields: Dict[str, Dict[str, List[int]]] = {f: {} for f in FILTER_FIELDS}  # 字段 → 值 → 行号
+        self._index: Optional[HNSWIndex] = None
+        if self.path:
+            self._load()
+
+    # ------------------------------------------------------------------ 接口
+    def __len__(self) -> int:
+        return self._size - self._deleted
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """已写入的归一化向量（视图，勿修改；量化存储时为反量化后的副本）"""
+        if self.quantization == FLOAT32:
+            return self._matrix[: self._size]
+        return dequantize(self._matrix[: self._size], self._scales[: self._size])
+
+    @property
+    def nbytes(self) -> int:
+        """内存中向量（含 int8 缩放系数）占用的字节数"""
+        n = self._size * self._matrix.itemsize * self.dim
+        return n + (self._size * 4 if self._matrix.dtype == np.int8 else 0)
+
+    def add(self, rows: List[Row]) -> int:
+        if not rows:
+            return 0
+        vecs = _normalize(np.asarray([r["embedding"] for r in rows], dtype=np.float32))
+        if vecs.shape[1] != self.dim:
+            raise ValueError(f"向量维度不匹配: {vecs.shape[1]} != {self.dim}")
+        meta = [{k: v for k, v in r.items() if k != "embedding"} for r in rows]
+        with self._lock:
+            start = self._append(vecs, meta)
+            if self.path:
+                self._persist(vecs, meta)
+            self._update_index(start)
+        return len(rows)
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        top_k: int,
+        threshold: float = 0.0,
+        filters: Optional[Filters] = None,
+    ) -> List[Row]:
+        q = _normalize(np.asarray(query_embedding, dtype=np.float32)[None, :])[0]
+        filters = normalize_filters(filters)
+        with self._lock:
+            if self._size == 0 or top_k <= 0:
+                return []
+            if filters:
+                # 先用字段索引取候选行，只对这些行计算相似度
+                cand = self._filter_ids(filters)
+                if len(cand) == 0:
+                    return []
+                ids, sims = self._rank(q, top_k, cand)
+            elif self._index is not None:
+                # 图中仍保留已删除节点：多取删除数量的候选再过滤
+                ids, sims = self._index.search(q, top_k + self._deleted)
+                if self.quantization != FLOAT32:
+                    ids, sims = self._rescore(q, np.asarray(ids, dtype=np.int64), len(ids))
+            else:
+                alive = self._alive[: self._size] if self._deleted else None
+                ids, sims = self._rank(q, top_k, None, alive)
+            return [
+                {**self._rows[i], "similarity": float(s)}
+                for i, s in zip(ids, sims)
+                if s >= threshold and self._rows[i] is not None
+            ][:top_k]
+
+    def sample(self, limit: int) -> List[Row]:
+        with self._lock:
+            live = (r for r in self._rows if r is not None)
+            return [dict(r) for _, r in zip(range(limit), live)]
+
+    def scan(self, batch_size: int = 1000) -> Iterator[Row]:
+        with self._lock:
+            rows = [r for r in self._rows if r is not None]
+        for r in rows:
+            yield dict(r)
+
+    def fingerprints(self, doc_id: str) -> List[Row]:
+        with self._lock:
+            return [
+                {"fingerprint": self._rows[i].get("fingerprint"), "content": self._rows[i]["content"]}
+                for i in self._doc_ids(doc_id)
+            ]
+
+    def update(self, doc_id: str, rows: List[Row]) -> int:
+        """实现为：删除旧行 + 以原向量追加新行"""
+        changes = {r["fingerprint"]: {k: v for k, v in r.items() if k != "embedding"} for r in rows}
+        with self._lock:
+            ids = [i for i in self._doc_ids(doc_id) if self._rows[i].get("fingerprint") in changes]
+            if not ids:
+                return 0
+            vecs = self._full_vectors(np.asarray(ids))
+            meta = [{**self._rows[i], **changes[self._rows[i]["fingerprint"]], "doc_id": doc_id} for i in ids]
+            self._tombstone(ids)
+            start = self._append(vecs, meta)
+            if self.path:
+                self._persist(vecs, meta)
+            self._update_index(start)
+            self._maybe_compact()
+        return len(ids)
+
+    def delete(self, doc_id: str, fingerprints: Sequence[Optional[str]]) -> int:
+        wanted = set(fingerprints)
+        with self._lock:
+            ids = [i for i in self._doc_ids(doc_id) if self._rows[i].get("fingerprint") in wanted]
+            self._tombstone(ids)
+            self._maybe_compact()
+        return len(ids)
+
+    def compact(self) -> None:
+        """丢弃已删除的行，重建矩阵、字段索引、HNSW 与磁盘文件"""
+        with self._lock:
+            if not self._deleted:
+                return
+            keep = np.flatnonzero(self._alive[: self._size])
+            vecs = np.array(self._full_vectors(keep), dtype=np.float32)
+            meta = [self._rows[i] for i in keep]
+            self._reset()
+            self._append(vecs, meta)
+            self._update_index(0)
+            if self.path:
+                self._rewrite(vecs, meta)
+
+    # ------------------------------------------------------------------ 内部
+    def _reset(self) -> None:
+        self._matrix = np.zeros((1024, self.dim), dtype=self._matrix.dtype)
+        self._scales = np.ones(1024, dtype=np.float32)
+        self._full = None
+        self._alive = np.ones(1024, dtype=bool)
+        self._size = 0
+        self._deleted = 0
+        self._rows = []
+        self._fields = {f: {} for f in FILTER_FIELDS}
+        self._index = None
+
+    def _append(self, vecs: np.ndarray, meta: List[Row]) -> int:
+        start = self._size
+        need = start + len(vecs)
+        if need > len(self._matrix):
+            cap = max(need, 2 * len(self._matrix))
+            grown = np.zeros((cap, self.dim), dtype=self._matrix.dtype)
+            grown[:start] = self._matrix[:start]
+            self._matrix = grown
+            scales = np.ones(cap, dtype=np.float32)
+            scales[:start] = self._scales[:start]
+            self._scales = scales
+            alive = np.ones(cap, dtype=bool)
+            alive[:start] = self._alive[:start]
+            self._alive = alive
+        self._matrix[start:need], self._scales[start:need] = quantize(vecs, self.quantization)
+        self._rows.extend(meta)
+        for i, row in enumerate(meta, start):
+            for field, index in self._fields.items():
+                for v in set(_field_values(row, field)):
+                    index.setdefault(v, []).append(i)
+        self._size = need
+        return start
+
+    def _rank(
+        self, q: np.ndarray, k: int, cand: Optional[np.ndarray] = None, alive: Optional[np.ndarray] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """在全部行（或 cand 行）中取 top-k；量化时先按紧凑向量取 k × rescore_factor 个候选再重新打分"""
+        codes, scales = self._matrix[: self._size], self._scales[: self._size]
+        if cand is not None:
+            codes, scales = codes[cand], scales[cand]
+        quantized = self.quantization != FLOAT32
+        local, sims = _top_k(scores(codes, scales, q), k * self.rescore_factor if quantized else k, alive)
+        ids = cand[local] if cand is not None else local
+        if quantized:
+            live = np.isfinite(sims)  # 已删除的行不参与重新打分
+            ids, sims = self._rescore(q, ids[live], k)
+        return ids, sims
+
+    def _rescore(self, q: np.ndarray, ids: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        if len(ids) == 0:
+            return ids, np.zeros(0, dtype=np.float32)
+        sims = self._full_vectors(ids) @ q
+        order = np.argsort(-sims, kind="stable")[:k]
+        return ids[order], sims[order]
+
+    def _full_vectors(self, ids: np.ndarray) -> np.ndarray:
+        """指定行的全精度向量：量化且落盘时从 vectors.f32 的内存映射读取，否则来自内存"""
+        if self.quantization == FLOAT32:
+            return self._matrix[ids]
+        if self.path is None:
+            return dequantize(self._matrix[ids], self._scales[ids])
+        if self._full is None or len(self._full) < self._size:
+            self._full = np.memmap(self.path / "vectors.f32", dtype=np.float32, mode="r").reshape(-1, self.dim)
+        return self._full[ids]
+
+    def _view(self):
+        """HNSW 读取向量的入口：量化时逐行反量化，不展开整个矩阵"""
+        if self.quantization == FLOAT32:
+            return self.vectors
+        return CodeView(self._matrix[: self._size], self._scales[: self._size])
+
+    def _filter_ids(self, filters: Filters) -> np.ndarray:
+        ids: Optional[np.ndarray] = None
+        for field, wanted in filters.items():
+            index = self._fields[field]
+            hit = np.unique(np.fromiter(
+                (i for v in wanted for i in index.get(v, ())), dtype=np.int64
+            ))
+            ids = hit if ids is None else np.intersect1d(ids, hit, assume_unique=True)
+            if len(ids) == 0:
+                break
+        return ids[self._alive[ids]] if self._deleted else ids
+
+    def _doc_ids(self, doc_id: str) -> List[int]:
+        """doc_id 完全相同（字段索引不区分大小写）的存活行号"""
+        return [
+            i for i in self._fields["doc_id"].get(doc_id.lower(), ())
+            if self._rows[i] is not None and self._rows[i].get("doc_id") == doc_id
+        ]
+
+    def _tombstone(self, ids: List[int]) -> None:
+        if not ids:
+            return
+        for i in ids:
+            self._rows[i] = None
+            self._alive[i] = False
+        self._deleted += len(ids)
+        if self.path:
+            with open(self.path / "deleted.txt", "a", encoding="utf-8") as f:
+                f.write("".join(f"{i}\n" for i in ids))
+
+    def _maybe_compact(self) -> None:
+        if self._deleted * 2 > self._size:
+            self.compact()
+
+    def _update_index(self, start: int) -> None:
+        if not self.ann_min_rows or self._size < self.ann_min_rows:
+            return
+        if self._index is None:
+            self._index = HNSWIndex(self._view, **self._hnsw_params)
+            start = 0
+        for i in range(start, self._size):
+            self._index.add(i)
+
+    def _persist(self, vecs: np.ndarray, meta: List[Row]) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / "rows.jsonl", "a", encoding="utf-8") as f:
+            for m in meta:
+                f.write(json.dumps(m, ensure_ascii=False) + "\n")
+        with open(self.path / "vectors.f32", "ab") as f:
+            f.write(np.ascontiguousarray(vecs, dtype=np.float32).tobytes())
+
+    def _rewrite(self, vecs: np.ndarray, meta: List[Row]) -> None:
+        """压缩后原子替换磁盘文件"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / "rows.jsonl.tmp", "w", encoding="utf-8") as f:
+            for m in meta:
+                f.write(json.dumps(m, ensure_ascii=False) + "\n")
+        with open(self.path / "vectors.f32.tmp", "wb") as f:
+            f.write(np.ascontiguousarray(vecs, dtype=np.float32).tobytes())
+        self._full = None
+        os.replace(self.path / "vectors.f32.tmp", self.path / "vectors.f32")
+        os.replace(self.path / "rows.jsonl.tmp", self.path / "rows.jsonl")
+        (self.path / "deleted.txt").unlink(missing_ok=True)
+
+    def _load(self) -> None:
+        vec_file = self.path / "vectors.f32"
+        row_file = self.path / "rows.jsonl"
+        if not vec_file.exists() or not row_file.exists():
+            return
+        # 内存映射按块读入：量化存储时不必把整个 float32 文件载入内存
+        vecs = np.memmap(vec_file, dtype=np.float32, mode="r") if vec_file.stat().st_size else np.zeros(0, np.float32)
+        vecs = vecs[: len(vecs) // self.dim * self.dim].reshape(-1, self.dim)
+        with open(row_file, encoding="utf-8") as f:
+            meta = [json.loads(line) for line in f if line.strip()]
+        n = min(len(vecs), len(meta))  # 写入中断时以较短者为准
+        deleted = set()
+        del_file = self.path / "deleted.txt"
+        if del_file.exists():
+            deleted = {int(line) for line in del_file.read_text().split() if int(line) < n}
+        if deleted or len(vecs) != len(meta):
+            # 行号需与 vectors.f32 的行一一对应：去掉删除行与中断写入的残余后重写
+            keep = [i for i in range(n) if i not in deleted]
+            kept = np.array(vecs[keep], dtype=np.float32)
+            del vecs
+            self._append(kept, [meta[i] for i in keep])
+            self._rewrite(kept, [meta[i] for i in keep])
+        else:
+            for start in range(0, n, _LOAD_BLOCK):
+                end = min(n, start + _LOAD_BLOCK)
+                self._append(np.array(vecs[start:end]), meta[start:end])
+        self._update_index(0)
+
+
+_MANIFEST = "MANIFEST.json"
+_EMPTY_IDS = np.zeros(0, dtype=np.int64)
+
+
+class _Segment:
+    """已发布的只读段：向量、行元数据与每行字节偏移都是内存映射，字段索引在打开时读入内存
+
+    合并后的写入方会立即删除不再引用的段文件：已映射的文件删除后仍可读，
+    字段索引因此也必须在打开时读取，仍持有旧快照的检索才不会遇到 FileNotFoundError。
+    """
+
+    def __init__(self, path: Path, name: str, rows: int, dim: int):
+        self.name = name
+        self.rows = rows
+        self.vectors = np.memmap(path / f"{name}.f32", dtype=np.float32, mode="r", shape=(rows, dim))
+        self.offsets = np.memmap(path / f"{name}.off", dtype=np.int64, mode="r", shape=(rows + 1,))
+        self.meta = np.memmap(path / f"{name}.jsonl", dtype=np.uint8, mode="r")
+        with open(path / f"{name}.fields.json", encoding="utf-8") as f:
+            data = json.load(f)
+        self.fields: Dict[str, Dict[str, np.ndarray]] = {
+            field: {v: np.asarray(ids, dtype=np.int64) for v, ids in values.items()}
+            for field, values in data.items()
+        }
+
+    def line(self, i: int) -> bytes:
+        return self.meta[self.offsets[i]: self.offsets[i + 1]].tobytes()
+
+    def row(self, i: int) -> Row:
+        return json.loads(self.line(i))
+
+    def filter_ids(self, filters: Filters) -> np.ndarray:
+        ids: Optional[np.ndarray] = None
+        for field, wanted in filters.items():
+            index = self.fields.get(field, {})
+            hit = np.unique(np.concatenate([index.get(v, _EMPTY_IDS) for v in wanted]))
+            ids = hit if ids is None else np.intersect1d(ids, hit, assume_unique=True)
+            if len(ids) == 0:
+                break
+        return ids
+
+
+class _Snapshot:
+    """某个清单版本的段列表与墓碑位图（不可变，检索时无需加锁）"""
+
+    def __init__(self, version: int, segments: List[_Segment], deleted: np.ndarray):
+        self.version = version
+        self.segments = segments
+        self.bases = np.cumsum([0] + [s.rows for s in segments]).astype(np.int64)
+        self.size = int(self.bases[-1])
+        self.deleted = deleted  # 已删除的全局行号（有序）
+        self.alive = np.ones(self.size, dtype=bool)
+        self.alive[deleted] = False
+
+    def locate(self, ids: np.ndarray) -> np.ndarray:
+        """全局行号 → 所在段的下标"""
+        return np.searchsorted(self.bases, ids, side="right") - 1
+
+
+class SharedVectorStore(VectorStore):
+    """多个 worker 进程共享的内存映射向量库：不可变段 + 原子发布的清单
+
+    `path` 下的文件：
+
+    - `MANIFEST.json`：版本号、维度、段列表与墓碑文件名；写入临时文件并 fsync 后 `os.replace` 原子替换；
+    - `seg-*.f32`：该段归一化后的 float32 向量（连续矩阵）；
+    - `seg-*.jsonl` + `seg-*.off`：行元数据（不含 embedding）与每行的字节偏移（int64）；
+    - `seg-*.fields.json`：过滤字段索引（字段 → 值 → 段内行号）；
+    - `deleted-*.i64`：已删除的全局行号；
+    - `LOCK`：写锁（`fcntl.flock`），同一时刻只有一个进程写入。
+
+    各进程以只读方式映射段文件，向量与元数据页由操作系统页缓存在进程间共享（零拷贝），
+    每个进程只额外持有墓碑位图与字段索引。写入在写锁内把新行写成新段再替换清单，
+    读取方每次操作前 `stat` 清单，变化时只映射新增的段。追加后把末尾不大于其后各段之和的段合并
+    （段大小按几何级数增长，段数为对数级）；删除行超过一半时合并全部段。只做精确检索（无 HNSW / 量化）。
+    """
+
+    def __init__(self, dim: int, path: str | Path, read_only: bool = False):
+        self.dim = dim
+        self.path = Path(path)
+        self.read_only = read_only
+        self._lock = threading.RLock()
+        self._key: Optional[tuple] = None  # 已加载清单的 (inode, mtime, size)
+        self._snap = _Snapshot(0, [], _EMPTY_IDS)
+
+    # ------------------------------------------------------------------ 接口
+    def __len__(self) -> int:
+        snap = self._snapshot()
+        return snap.size - len(snap.deleted)
+
+    @property
+    def version(self) -> int:
+        return self._snapshot().version
+
+    def add(self, rows: List[Row]) -> int:
+        if not rows:
+            return 0
+        vecs = _normalize(np.asarray([r["embedding"] for r in rows], dtype=np.float32))
+        if vecs.shape[1] != self.dim:
+            raise ValueError(f"向量维度不匹配: {vecs.shape[1]} != {self.dim}")
+        meta = [{k: v for k, v in r.items() if k != "embedding"} for r in rows]
+        with self._writing() as snap:
+            version = snap.version + 1
+            seg = self._new_segment(f"seg-{version:08d}", vecs, meta)
+            self._publish(version, snap.segments + [seg], snap.deleted)
+        return len(rows)
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        top_k: int,
+        threshold: float = 0.0,
+        filters: Optional[Filters] = None,
+    ) -> List[Row]:
+        q = _normalize(np.asarray(query_embedding, dtype=np.float32)[None, :])[0]
+        filters = normalize_filters(filters)
+        snap = self._snapshot()
+        if snap.size == 0 or top_k <= 0:
+            return []
+        hits = []  # (相似度, 段下标, 段内行号)
+        for j, seg in enumerate(snap.segments):
+            alive = snap.alive[snap.bases[j]: snap.bases[j + 1]]
+            if filters:
+                local = seg.filter_ids(filters)
+                local = local[alive[local]]
+                if len(local) == 0:
+                    continue
+                idx, sims = _top_k(np.asarray(seg.vectors[local] @ q), top_k)
+                idx = local[idx]
+            else:
+                idx, sims = _top_k(np.asarray(seg.vectors @ q), top_k, None if alive.all() else alive)
+            hits.extend((float(s), j, int(i)) for i, s in zip(idx, sims) if s >= threshold)
+        hits.sort(key=lambda h: -h[0])
+        return [{**snap.segments[j].row(i), "similarity": s} for s, j, i in hits[:top_k]]
+
+    def sample(self, limit: int) -> List[Row]:
+        return [row for _, row in zip(range(limit), self._iter_rows(self._snapshot()))]
+
+    def scan(self, batch_size: int = 1000) -> Iterator[Row]:
+        yield from self._iter_rows(self._snapshot())
+
+    def fingerprints(self, doc_id: str) -> List[Row]:
+        return [
+            {"fingerprint": row.get("fingerprint"), "content": row["content"]}
+            for _, row in self._doc_rows(self._snapshot(), doc_id)
+        ]
+
+    def update(self, doc_id: str, rows: List[Row]) -> int:
+        """实现为：删除旧行 + 以原向量写入新段，一次发布"""
+        changes = {r["fingerprint"]: {k: v for k, v in r.items() if k != "embedding"} for r in rows}
+        with self._writing() as snap:
+            hits = [(g, row) for g, row in self._doc_rows(snap, doc_id) if row.get("fingerprint") in changes]
+            if not hits:
+                return 0
+            ids = np.asarray([g for g, _ in hits], dtype=np.int64)
+            meta = [{**row, **changes[row["fingerprint"]], "doc_id": doc_id} for _, row in hits]
+            version = snap.version + 1
+            seg = self._new_segment(f"seg-{version:08d}", self._gather(snap, ids), meta)
+            self._publish(version, snap.segments + [seg], np.union1d(snap.deleted, ids))
+        return len(hits)
+
+    def delete(self, doc_id: str, fingerprints: Sequence[Optional[str]]) -> int:
+        wanted = set(fingerprints)
+        with self._writing() as snap:
+            ids = [g for g, row in self._doc_rows(snap, doc_id) if row.get("fingerprint") in wanted]
+            if ids:
+                self._publish(snap.version + 1, snap.segments, np.union1d(snap.deleted, ids))
+        return len(ids)
+
+    def compact(self) -> None:
+        """把全部段（去掉已删除的行）合并为一个段"""
+        with self._writing() as snap:
+            if len(snap.segments) > 1 or len(snap.deleted):
+                self._publish(snap.version + 1, snap.segments, snap.deleted, merge_from=0)
+
+    # ------------------------------------------------------------------ 读取
+    def _snapshot(self) -> _Snapshot:
+        manifest = self.path / _MANIFEST
+        for _ in range(5):
+            try:
+                st = os.stat(manifest)
+            except FileNotFoundError:
+                return self._snap
+            key = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if key == self._key:
+                return self._snap
+            with self._lock:
+                if key == self._key:
+                    return self._snap
+                try:
+                    self._snap = self._open(json.loads(manifest.read_bytes()))
+                except FileNotFoundError:
+                    continue  # 写入方刚合并并删除了旧段：重新读取清单
+                self._key = key
+                return self._snap
+        raise RuntimeError(f"共享向量库清单持续变化，无法加载: {self.path}")
+
+    def _open(self, manifest: Dict[str, Any]) -> _Snapshot:
+        if manifest["dim"] != self.dim:
+            raise ValueError(f"向量维度不匹配: {manifest['dim']} != {self.dim}")
+        cached = {s.name: s for s in self._snap.segments}  # 段不可变，已映射的直接复用
+        segments = [
+            cached.get(s["name"]) or _Segment(self.path, s["name"], s["rows"], self.dim)
+            for s in manifest["segments"]
+        ]
+        deleted = _EMPTY_IDS
+        if manifest.get("deleted"):
+            deleted = np.fromfile(self.path / manifest["deleted"], dtype=np.int64)
+        return _Snapshot(manifest["version"], segments, deleted)
+
+    def _iter_rows(self, snap: _Snapshot) -> Iterator[Row]:
+        for j, seg in enumerate(snap.segments):
+            for i in np.flatnonzero(snap.alive[snap.bases[j]: snap.bases[j + 1]]):
+                yield seg.row(int(i))
+
+    def _doc_rows(self, snap: _Snapshot, doc_id: str) -> List[tuple[int, Row]]:
+        """doc_id 完全相同的存活行：(全局行号, 行)"""
+        out = []
+        for j, seg in enumerate(snap.segments):
+            for i in seg.fields.get("doc_id", {}).get(doc_id.lower(), _EMPTY_IDS):
+                g = int(snap.bases[j] + i)
+                if snap.alive[g]:
+                    row = seg.row(int(i))
+                    if row.get("doc_id") == doc_id:
+                        out.append((g, row))
+        return out
+
+    def _gather(self, snap: _Snapshot, ids: np.ndarray) -> np.ndarray:
+        segs = snap.locate(ids)
+        return np.stack([snap.segments[j].vectors[g - snap.bases[j]] for g, j in zip(ids, segs)])
+
+    # ------------------------------------------------------------------ 写入
+    @contextmanager
+    def _writing(self) -> Iterator[_Snapshot]:
+        """进程内加锁 + 跨进程文件锁，产出最新的快照"""
+        if self.read_only:
+            raise PermissionError(f"共享向量库以只读方式打开: {self.path}")
+        with self._lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.path / "LOCK", "a+b") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield self._snapshot()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _new_segment(self, name: str, vecs: np.ndarray, meta: List[Row]) -> _Segment:
+        fields: Dict[str, Dict[str, List[int]]] = {f: {} for f in FILTER_FIELDS}
+        for i, row in enumerate(meta):
+            for field, index in fields.items():
+                for v in set(_field_values(row, field)):
+                    index.setdefault(v, []).append(i)
+        lines = [json.dumps(m, ensure_ascii=False).encode("utf-8") + b"\n" for m in meta]
+        return self._write_segment(name, [(vecs, lines)], fields)
+
+    def _write_segment(
+        self, name: str, blocks: Iterable[tuple[np.ndarray, List[bytes]]], fields: Dict[str, Dict[str, List[int]]]
+    ) -> Optional[_Segment]:
+        """按块写入段文件并 fsync；发布前不被任何清单引用，中断写入只留下待清理的孤儿文件"""
+        rows, offsets = 0, [np.zeros(1, dtype=np.int64)]
+        with open(self.path / f"{name}.f32", "wb") as fv, open(self.path / f"{name}.jsonl", "wb") as fm:
+            for vecs, lines in blocks:
+                if not lines:
+                    continue
+                fv.write(np.ascontiguousarray(vecs, dtype=np.float32).tobytes())
+                fm.write(b"".join(lines))
+                offsets.append(offsets[-1][-1] + np.cumsum([len(line) for line in lines], dtype=np.int64))
+                rows += len(lines)
+            _sync(fv)
+            _sync(fm)
+        if rows == 0:
+            return None
+        _write_file(self.path / f"{name}.off", np.concatenate(offsets).tobytes())
+        _write_file(self.path / f"{name}.fields.json", json.dumps(fields, ensure_ascii=False).encode("utf-8"))
+        return _Segment(self.path, name, rows, self.dim)
+
+    def _merge(self, name: str, snap: _Snapshot, first: int) -> tuple[Optional[_Segment], np.ndarray]:
+        """把 first 起的末尾各段（去掉已删除的行）写成一个段；返回新段与前面各段仍有效的墓碑"""
+        fields: Dict[str, Dict[str, List[int]]] = {f: {} for f in FILTER_FIELDS}
+        start = 0
+
+        def blocks():
+            nonlocal start
+            for j in range(first, len(snap.segments)):
+                seg = snap.segments[j]
+                keep = np.flatnonzero(snap.alive[snap.bases[j]: snap.bases[j + 1]])
+                remap = np.full(seg.rows, -1, dtype=np.int64)
+                remap[keep] = np.arange(start, start + len(keep))
+                for field, values in seg.fields.items():
+                    for v, ids in values.items():
+                        new = remap[ids]
+                        new = new[new >= 0]
+                        if len(new):
+                            fields[field].setdefault(v, []).extend(new.tolist())
+                for b in range(0, len(keep), _LOAD_BLOCK):
+                    part = keep[b: b + _LOAD_BLOCK]
+                    yield np.asarray(seg.vectors[part]), [seg.line(int(i)) for i in part]
+                start += len(keep)
+
+        seg = self._write_segment(name, blocks(), fields)
+        return seg, snap.deleted[snap.deleted < snap.bases[first]]
+
+    def _publish(
+        self, version: int, segments: List[Optional[_Segment]], deleted: np.ndarray, merge_from: Optional[int] = None
+    ) -> None:
+        """（必要时合并末尾的段后）写入墓碑与新清单，原子替换，再清理不再引用的文件"""
+        snap = _Snapshot(version, [s for s in segments if s is not None], np.asarray(deleted, dtype=np.int64))
+        if merge_from is None:
+            merge_from = self._merge_start(snap)
+        if merge_from < len(snap.segments):
+            merged, deleted = self._merge(f"seg-{version:08d}-m", snap, merge_from)
+            snap = _Snapshot(version, snap.segments[:merge_from] + ([merged] if merged else []), deleted)
+        manifest = {
+            "version": version,
+            "dim": self.dim,
+            "segments": [{"name": s.name, "rows": s.rows} for s in snap.segments],
+            "deleted": None,
+        }
+        if len(snap.deleted):
+            manifest["deleted"] = f"deleted-{version:08d}.i64"
+            _write_file(self.path / manifest["deleted"], snap.deleted.tobytes())
+        tmp = self.path / f"{_MANIFEST}.tmp"
+        _write_file(tmp, json.dumps(manifest).encode("utf-8"))
+        os.replace(tmp, self.path / _MANIFEST)
+        _sync_dir(self.path)
+        st = os.stat(self.path / _MANIFEST)
+        self._snap, self._key = snap, (st.st_ino, st.st_mtime_ns, st.st_size)
+        self._collect_garbage(manifest)
+
+    @staticmethod
+    def _merge_start(snap: _Snapshot) -> int:
+        """需要合并的末尾段的起点；不合并时返回段数"""
+        n = len(snap.segments)
+        if len(snap.deleted) * 2 > snap.size:
+            return 0
+        j, tail = n - 1, snap.segments[-1].rows if n else 0
+        while j > 0 and snap.segments[j - 1].rows <= tail:
+            j -= 1
+            tail += snap.segments[j].rows
+        return j if j < n - 1 else n
+
+    def _collect_garbage(self, manifest: Dict[str, Any]) -> None:
+        """删除当前清单未引用的段与墓碑文件（被替换的旧版本或中断写入的残留）"""
+        keep = {manifest["deleted"]}
+        for s in manifest["segments"]:
+            keep.update(f"{s['name']}{ext}" for ext in (".f32", ".jsonl", ".off", ".fields.json"))
+        for p in self.path.iterdir():
+            if p.name.startswith(("seg-", "deleted-")) and p.name not in keep:
+                p.unlink(missing_ok=True)
+
+
+def _sync(f) -> None:
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _write_file(path: Path, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+        _sync(f)
+
+
+def _sync_dir(path: Path) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _normalize(vecs: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vecs / norms
+
+
+def _top_k(sims: np.ndarray, k: int, alive: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+    if alive is not None:
+        sims[~alive] = -np.inf
+    k = min(k, len(sims))
+    idx = np.argpartition(-sims, k - 1)[:k]
+    idx = idx[np.argsort(-sims[idx])]
+    return idx, sims[idx]
+
+
+class HNSWIndex:
+    """分层可导航小世界图（余弦相似度，向量需已归一化）
+
+    只保存图结构，向量通过 `vectors()` 从所属存储读取，支持逐条增量插入。
+    """
+
+    def __init__(self, vectors, m: int = 16, ef_construction: int = 100, ef_search: int = 64, seed: int = 42):
+        self._vectors = vectors
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._ml = 1 / math.log(m)
+        self._rng = random.Random(seed)
+        self._graph: List[Dict[int, List[int]]] = []  # 每层: 节点 -> 邻居
+        self._entry: Optional[int] = None
+
+    def add(self, node: int) -> None:
+        vecs = self._vectors()
+        q = vecs[node]
+        level = int(-math.log(1.0 - self._rng.random()) * self._ml)
+        while len(self._graph) <= level:
+            self._graph.append({})
+        if self._entry is None:
+            for layer in range(level + 1):
+                self._graph[layer][node] = []
+            self._entry = node
+            return
+
+        top = self._top_level()
+        ep = [self._entry]
+        for layer in range(top, level, -1):
+            ep = [self._search_layer(vecs, q, ep, 1, layer)[0][1]]
+        for layer in range(min(level, top), -1, -1):
+            cands = self._search_layer(vecs, q, ep, self.ef_construction, layer)
+            cap = self.m0 if layer == 0 else self.m
+            neighbors = [n for _, n in cands[:cap]]
+            self._graph[layer][node] = neighbors
+            for n in neighbors:
+                links = self._graph[layer][n]
+                links.append(node)
+                if len(links) > cap:
+                    sims = vecs[links] @ vecs[n]
+                    keep = np.argsort(-sims)[:cap]
+                    self._graph[layer][n] = [links[i] for i in keep]
+            ep = [n for _, n in cands]
+        for layer in range(top + 1, level + 1):
+            self._graph[layer][node] = []
+        if level > top:
+            self._entry = node
+
+    def search(self, q: np.ndarray, k: int) -> tuple[List[int], List[float]]:
+        if self._entry is None:
+            return [], []
+        vecs = self._vectors()
+        ep = [self._entry]
+        for layer in range(self._top_level(), 0, -1):
+            ep = [self._search_layer(vecs, q, ep, 1, layer)[0][1]]
+        cands = self._search_layer(vecs, q, ep, max(self.ef_search, k), 0)[:k]
+        return [n for _, n in cands], [-d for d, _ in cands]
+
+    def _top_level(self) -> int:
+        return max(i for i, g in enumerate(self._graph) if self._entry in g)
+
+    def _search_layer(self, vecs, q, entry: List[int], ef: int, layer: int) -> List[tuple[float, int]]:
+        """返回按距离（-相似度）升序的 (dist, node) 列表"""
+        graph = self._graph[layer]
+        visited = set(entry)
+        dists = -(vecs[entry] @ q)
+        cand = [(float(d), n) for d, n in zip(dists, entry)]
+        heapq.heapify(cand)
+        best = [(-d, n) for d, n in cand]  # 最大堆（取负）
+        heapq.heapify(best)
+        while cand:
+            d, n = heapq.heappop(cand)
+            if d > -best[0][0] and len(best) >= ef:
+                break
+            fresh = [x for x in graph.get(n, ()) if x not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            for nd, x in zip(-(vecs[fresh] @ q), fresh):
+                nd = float(nd)
+                if len(best) < ef or nd < -best[0][0]:
+                    heapq.heappush(cand, (nd, x))
+                    heapq.heappush(best, (-nd, x))
+                    if len(best) > ef:
+                        heapq.heappop(best)
+        return sorted((-d, n) for d, n in best)
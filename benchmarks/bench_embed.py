@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+批量向量化基准
+=============
+
+对比旧的逐块 `embed_text` 循环与 `embed_pipeline.embed_in_batches`，
+使用带固定往返延迟的本地假 embedder，不访问 Gemini。
+
+使用方法：
+python benchmarks/bench_embed.py                         # 默认 400 块
+python benchmarks/bench_embed.py --chunks 1000 --latency 0.05 --batch-size 100 --concurrency 8
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+from embed_pipeline import embed_in_batches  # noqa: E402
+
+DIM = 768
+
+
+class FakeEmbedder:
+    """每次请求固定延迟 latency 秒，另加每条文本 per_item 秒"""
+
+    def __init__(self, latency: float, per_item: float):
+        self.latency = latency
+        self.per_item = per_item
+        self.calls = 0
+
+    def embed_one(self, text):
+        self.calls += 1
+        time.sleep(self.latency + self.per_item)
+        return [float(len(text) % 7)] * DIM
+
+    def embed_batch(self, texts):
+        self.calls += 1
+        time.sleep(self.latency + self.per_item * len(texts))
+        return [[float(len(t) % 7)] * DIM for t in texts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量向量化基准")
+    parser.add_argument("--chunks", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.02, help="单次请求往返延迟（秒）")
+    parser.add_argument("--per-item", type=float, default=0.0002, help="每条文本的服务端耗时（秒）")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    chunks = [f"[Slither] 严重程度:Informational | finding {i}" for i in range(args.chunks)]
+
+    serial = FakeEmbedder(args.latency, args.per_item)
+    t0 = time.perf_counter()
+    serial_vecs = [serial.embed_one(c) for c in chunks]
+    serial_s = time.perf_counter() - t0
+
+    batched = FakeEmbedder(args.latency, args.per_item)
+    t0 = time.perf_counter()
+    batched_vecs = embed_in_batches(
+        chunks, batched.embed_batch, batch_size=args.batch_size, max_concurrency=args.concurrency
+    )
+    batched_s = time.perf_counter() - t0
+
+    assert serial_vecs == batched_vecs, "批量结果与逐块结果不一致"
+
+    print(json.dumps({
+        "chunks": args.chunks,
+        "serial": {"seconds": round(serial_s, 4), "calls": serial.calls},
+        "batched": {
+            "seconds": round(batched_s, 4),
+            "calls": batched.calls,
+            "batch_size": args.batch_size,
+            "concurrency": args.concurrency,
+        },
+        "speedup": round(serial_s / batched_s, 2) if batched_s else None,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+进程内压测基准
+=============
+
+在同一进程内驱动 FastAPI 应用（httpx ASGITransport，不经过网络），外部依赖全部替换为本地替身：
+
+- Gemini：确定性的假 embedder（按文本哈希生成向量）与假 LLM，各自带可配置延迟；
+- 向量库：内存中的 `LocalVectorStore` + 新的 BM25 索引，预先灌入 `--corpus` 条发现；
+- Slither / Echidna：返回固定报告的协程，带可配置延迟。
+
+按给定并发对 `/ask`、`/ingest`、`/analyze` 各发送 `--requests` 个请求，输出吞吐与 p50/p95/p99 延迟（JSON，
+应用日志转到 stderr）。压测期间另有一个探针每 `--probe-interval` 秒请求一次 `/health`，
+其延迟（`health_ms`）反映同步调用是否占住了事件循环。
+`--output` 保存结果，`--compare` 与之前保存的结果对比，便于在提交之间比较。
+
+使用方法：
+python benchmarks/bench_load.py                                   # 默认三个场景
+python benchmarks/bench_load.py --scenarios ask --concurrency 16 --requests 400 --llm-latency 0.2
+python benchmarks/bench_load.py --output before.json
+python benchmarks/bench_load.py --compare before.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import types
+import zlib
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "app"))
+
+# 导入前设置：本地向量库、仅内存缓存、不启用 Echidna 容器池
+for key, value in {
+    "VECTOR_STORE": "local",
+    "LOCAL_VECTOR_STORE_PATH": "",
+    "EMBED_CACHE_PATH": "",
+    "ANALYSIS_CACHE_PATH": "",
+    "ECHIDNA_POOL_SIZE": "0",
+    "GOOGLE_API_KEY": "bench",
+}.items():
+    os.environ.setdefault(key, value)
+
+import httpx  # noqa: E402
+import numpy as np  # noqa: E402
+
+import rag_audit_api as api  # noqa: E402
+from analysis_cache import AnalysisCache  # noqa: E402
+from embed_cache import EmbeddingCache  # noqa: E402
+from lexical_index import BM25Index  # noqa: E402
+from semantic_cache import SemanticCache  # noqa: E402
+from vector_store import LocalVectorStore  # noqa: E402
+
+DETECTORS = [
+    ("reentrancy-eth", "High", "Reentrancy in {c}.withdraw() external call before state update"),
+    ("unchecked-transfer", "High", "{c}.sweep() ignores return value of token.transfer()"),
+    ("tx-origin", "Medium", "{c}.auth() uses tx.origin for authorization"),
+    ("naming-convention", "Informational", "Parameter {c}.set(uint256)._v{i} is not in mixedCase"),
+    ("solc-version", "Informational", "Pragma version ^0.{i}.0 allows old versions"),
+]
+QUESTIONS = [
+    "withdraw 函数有重入漏洞吗?",
+    "Which contracts use tx.origin for auth?",
+    "sweep() 是否检查 transfer 返回值?",
+    "有哪些 High 级别的问题?",
+    "naming-convention 问题多吗?",
+]
+
+
+# --------------------------- 替身 ----------------------------------------------
+
+def fake_vector(text: str, dim: int) -> list:
+    rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+    v = rng.standard_normal(dim).astype(np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+class FakeGenAI:
+    """替代 google.generativeai：embed_content / GenerativeModel"""
+
+    def __init__(self, embed_latency: float, llm_latency: float, dim: int):
+        self.embed_latency = embed_latency
+        self.llm_latency = llm_latency
+        self.dim = dim
+
+    def embed_content(self, model, content, task_type=None, **kw):
+        time.sleep(self.embed_latency)
+        if isinstance(content, list):
+            return {"embedding": [fake_vector(t, self.dim) for t in content]}
+        return {"embedding": fake_vector(content, self.dim)}
+
+    def GenerativeModel(self, name):
+        latency = self.llm_latency
+
+        def generate_content(prompt, stream=False):
+            answer = f"基于 {len(prompt)} 字符上下文的回答。"
+            if not stream:
+                time.sleep(latency)
+                return types.SimpleNamespace(text=answer)
+
+            def parts():
+                for piece in (answer[:8], answer[8:]):
+                    time.sleep(latency / 2)
+                    yield types.SimpleNamespace(text=piece)
+            return parts()
+
+        return types.SimpleNamespace(generate_content=generate_content)
+
+
+def slither_report(n: int, contract: str) -> dict:
+    detectors = []
+    for i in range(n):
+        check, impact, desc = DETECTORS[i % len(DETECTORS)]
+        detectors.append({
+            "check": check,
+            "impact": impact,
+            "confidence": "Medium",
+            "description": desc.format(c=contract, i=i),
+            "elements": [{"name": f"{contract}_e{i}"}],
+        })
+    return {"success": True, "results": {"detectors": detectors}, "slitherVersion": "0.10.0"}
+
+
+def install_fakes(args) -> None:
+    """替换外部依赖，并给应用一套全新的内存状态"""
+    api.genai = FakeGenAI(args.embed_latency, args.llm_latency, api.EMBED_DIM)
+    api.vector_store = LocalVectorStore(api.EMBED_DIM)
+    api.lexical_index = BM25Index()
+    api.embed_cache = EmbeddingCache(api.EMBED_MODEL, path=None)
+    api.analysis_cache = AnalysisCache()
+    api.answer_cache = SemanticCache(max_entries=1000 if args.answer_cache else 0)
+    api.echidna_pool = None
+    api._tool_versions = {"slither": "bench", "echidna": "bench"}
+
+    async def fake_slither(sol_path, root=None, remappings=None):
+        await asyncio.sleep(args.tool_latency)
+        return slither_report(args.findings, sol_path.stem)
+
+    async def fake_echidna(sol_path, contract_name, root=None):
+        await asyncio.sleep(args.tool_latency)
+        return {"fails": [{"property": "echidna_balance_never_negative", "trace": ["deposit()", "withdraw()"]}]}
+
+    api.run_slither = fake_slither
+    api.run_echidna = fake_echidna
+
+
+def seed_corpus(n: int) -> None:
+    per_doc = 50
+    for d in range(0, n, per_doc):
+        report = slither_report(min(per_doc, n - d), f"Seed{d // per_doc}")
+        api.insert_groups(f"Seed{d // per_doc}", api.dedup_findings(api.slither_items(report)))
+
+
+# --------------------------- 压测 ----------------------------------------------
+
+def request_factory(scenario: str, args):
+    if scenario == "ask":
+        def make(i):
+            q = QUESTIONS[i % len(QUESTIONS)]
+            return dict(method="POST", url="/ask", json={"question": f"{q} #{i}", "top_k": 5})
+    elif scenario == "ingest":
+        def make(i):
+            raw = json.dumps(slither_report(args.findings, f"Ingest{i}")).encode()
+            return dict(method="POST", url="/ingest",
+                        files=[("files", (f"ingest_{i}.json", io.BytesIO(raw), "application/json"))])
+    elif scenario == "analyze":
+        def make(i):
+            src = f"// SPDX-License-Identifier: MIT\npragma solidity ^0.8.0;\ncontract Bench{i} {{}}\n".encode()
+            return dict(method="POST", url="/analyze",
+                        files={"file": (f"Bench{i}.sol", io.BytesIO(src), "text/plain")},
+                        data={"wait": "true"})
+    else:
+        raise ValueError(f"未知场景: {scenario}")
+    return make
+
+
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+async def run_scenario(scenario: str, args) -> dict:
+    make = request_factory(scenario, args)
+    latencies, errors = [], 0
+    counter = iter(range(args.requests))
+    transport = httpx.ASGITransport(app=api.app)
+
+    probes: list = []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def probe():
+            while not done.is_set():
+                t0 = time.perf_counter()
+                await client.get("/health")
+                probes.append(time.perf_counter() - t0)
+                await asyncio.sleep(args.probe_interval)
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                t0 = time.perf_counter()
+                try:
+                    resp = await client.request(**make(i))
+                    ok = resp.status_code == 200
+                except Exception:
+                    ok = False
+                latencies.append(time.perf_counter() - t0)
+                errors += not ok
+
+        start = time.perf_counter()
+        prober = asyncio.create_task(probe())
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await prober
+
+    lat = sorted(latencies)
+    probes.sort()
+    ms = lambda v: round(v * 1000, 2)  # noqa: E731
+    return {
+        "requests": len(lat),
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(len(lat) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": ms(sum(lat) / len(lat)) if lat else 0.0,
+            "p50": ms(percentile(lat, 50)),
+            "p95": ms(percentile(lat, 95)),
+            "p99": ms(percentile(lat, 99)),
+            "max": ms(lat[-1]) if lat else 0.0,
+        },
+        "health_ms": {
+            "probes": len(probes),
+            "p50": ms(percentile(probes, 50)),
+            "p95": ms(percentile(probes, 95)),
+            "max": ms(probes[-1]) if probes else 0.0,
+        },
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(current: dict, baseline: dict) -> dict:
+    """各场景吞吐与延迟相对基线的比值（>1 表示数值变大）"""
+    out = {}
+    for name, cur in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        ratio = lambda a, b: round(a / b, 3) if b else None  # noqa: E731
+        out[name] = {
+            "throughput_rps": ratio(cur["throughput_rps"], base["throughput_rps"]),
+            **{f"{k}_ms": ratio(cur["latency_ms"][k], base["latency_ms"][k]) for k in ("p50", "p95", "p99")},
+        }
+        if "health_ms" in cur and "health_ms" in base:
+            out[name]["health_p95_ms"] = ratio(cur["health_ms"]["p95"], base["health_ms"]["p95"])
+    return {"baseline_commit": baseline.get("commit"), "ratios": out}
+
+
+def run(args) -> dict:
+    install_fakes(args)
+    seed_corpus(args.corpus)
+    result = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "scenarios": {},
+    }
+    for scenario in args.scenarios:
+        result["scenarios"][scenario] = asyncio.run(run_scenario(scenario, args))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="进程内压测基准（/ask、/ingest、/analyze）")
+    parser.add_argument("--scenarios", nargs="+", default=["ask", "ingest", "analyze"],
+                        choices=["ask", "ingest", "analyze"])
+    parser.add_argument("--requests", type=int, default=100, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--corpus", type=int, default=2000, help="预先入库的发现条数")
+    parser.add_argument("--findings", type=int, default=50, help="每份 Slither 报告的发现数")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="假 embedder 每次请求延迟（秒）")
+    parser.add_argument("--llm-latency", type=float, default=0.1, help="假 LLM 生成延迟（秒）")
+    parser.add_argument("--tool-latency", type=float, default=0.05, help="假 Slither / Echidna 延迟（秒）")
+    parser.add_argument("--probe-interval", type=float, default=0.02, help="/health 探针请求间隔（秒）")
+    parser.add_argument("--answer-cache", action="store_true", help="启用语义答案缓存（默认关闭以测生成路径）")
+    parser.add_argument("--output", help="结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的结果 JSON 对比")
+    args = parser.parse_args(argv)
+
+    # 应用日志打印到 stdout，压测期间转到 stderr，stdout 只输出结果 JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run(args)
+    if args.compare:
+        result["comparison"] = compare(result, json.loads(Path(args.compare).read_text()))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+向量量化基准
+===========
+
+同一批向量分别写入 float32 / float16 / int8 的 `LocalVectorStore`（量化库落盘到临时目录，
+用全精度向量重新打分），输出内存占用、查询延迟与相对 float32 精确检索的 recall@k。
+
+向量为带簇结构的合成数据（若干簇中心 + 噪声），比各向同性的随机向量更接近真实嵌入的分布。
+
+使用方法：
+python benchmarks/bench_quantize.py
+python benchmarks/bench_quantize.py --rows 50000 --dim 768 --queries 200 --top-k 10 --rescore-factor 2 4 8
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+from quantization import recall_at_k  # noqa: E402
+from vector_store import LocalVectorStore  # noqa: E402
+
+
+def clustered(n: int, dim: int, clusters: int, noise: float, rng) -> np.ndarray:
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    return centers[rng.integers(0, clusters, n)] + rng.normal(scale=noise, size=(n, dim)).astype(np.float32)
+
+
+def fill(store: LocalVectorStore, vecs: np.ndarray, batch: int = 5000) -> None:
+    for start in range(0, len(vecs), batch):
+        store.add([
+            {"doc_id": "bench", "content": str(i), "embedding": v}
+            for i, v in enumerate(vecs[start:start + batch], start)
+        ])
+
+
+def query(store: LocalVectorStore, queries: np.ndarray, k: int):
+    start = time.perf_counter()
+    ids = [[int(h["content"]) for h in store.search(q, k)] for q in queries]
+    return ids, (time.perf_counter() - start) / len(queries)
+
+
+def run(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    vecs = clustered(args.rows, args.dim, args.clusters, args.noise, rng)
+    queries = clustered(args.queries, args.dim, args.clusters, args.noise, rng)
+
+    baseline = LocalVectorStore(args.dim)
+    fill(baseline, vecs)
+    expected, latency = query(baseline, queries, args.top_k)
+    result = {
+        "params": vars(args),
+        "float32": {"bytes": baseline.nbytes, "query_ms": round(latency * 1000, 3), "recall": 1.0},
+    }
+    for mode in ("float16", "int8"):
+        for factor in args.rescore_factor:
+            with tempfile.TemporaryDirectory() as tmp:
+                store = LocalVectorStore(args.dim, path=tmp, quantization=mode, rescore_factor=factor)
+                fill(store, vecs)
+                actual, latency = query(store, queries, args.top_k)
+                result[f"{mode}/x{factor}"] = {
+                    "bytes": store.nbytes,
+                    "memory_ratio": round(baseline.nbytes / store.nbytes, 2),
+                    "query_ms": round(latency * 1000, 3),
+                    "recall": round(recall_at_k(expected, actual, args.top_k), 4),
+                }
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="量化向量存储：内存 / 延迟 / recall@k")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.6, help="簇内噪声标准差（簇中心各维为标准正态）")
+    parser.add_argument("--rescore-factor", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--seed", type=int, default=0)
+    result = run(parser.parse_args(argv))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+多 worker 内存基准：LocalVectorStore vs SharedVectorStore
+=======================================================
+
+同一批向量分别写入 `LocalVectorStore`（每个进程把 `vectors.f32` 载入自己的内存）与
+`SharedVectorStore`（各进程只读映射同一组段文件），再启动 `--workers` 个子进程同时打开并检索，
+输出每个 worker 的打开耗时、查询延迟、RSS，以及所有 worker 的 PSS 之和
+（PSS 把共享页平摊到映射它的进程，之和即整台机器为这些 worker 付出的内存）。
+
+需要 Linux（读取 /proc/self/smaps_rollup）。
+
+使用方法：
+python benchmarks/bench_shared_store.py
+python benchmarks/bench_shared_store.py --rows 200000 --dim 768 --workers 4 --queries 50
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+from vector_store import LocalVectorStore, SharedVectorStore  # noqa: E402
+
+
+def fill(store, vecs: np.ndarray, batch: int = 10000) -> None:
+    for start in range(0, len(vecs), batch):
+        store.add([
+            {"doc_id": f"doc-{i % 100}", "content": str(i), "embedding": v}
+            for i, v in enumerate(vecs[start:start + batch], start)
+        ])
+
+
+def memory_mb() -> dict:
+    out = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                out[key.lower() + "_mb"] = int(rest.split()[0]) / 1024
+    return out
+
+
+def worker(kind: str, path: str, dim: int, queries: np.ndarray, top_k: int, barrier, results) -> None:
+    start = time.perf_counter()
+    if kind == "local":
+        store = LocalVectorStore(dim, path=path)
+    else:
+        store = SharedVectorStore(dim, path, read_only=True)
+    opened = time.perf_counter() - start
+    start = time.perf_counter()
+    for q in queries:
+        store.search(q, top_k)
+    latency = (time.perf_counter() - start) / len(queries)
+    barrier.wait()  # 所有 worker 都已映射 / 载入后再读内存
+    results.put({"open_s": opened, "query_ms": latency * 1000, **memory_mb()})
+    barrier.wait()
+
+
+def run_workers(kind: str, path: str, args, queries: np.ndarray) -> dict:
+    ctx = mp.get_context("spawn")
+    barrier, results = ctx.Barrier(args.workers), ctx.Queue()
+    procs = [
+        ctx.Process(target=worker, args=(kind, path, args.dim, queries, args.top_k, barrier, results))
+        for _ in range(args.workers)
+    ]
+    for p in procs:
+        p.start()
+    stats = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    return {
+        "open_s": round(float(np.median([s["open_s"] for s in stats])), 3),
+        "query_ms": round(float(np.median([s["query_ms"] for s in stats])), 3),
+        "rss_mb_per_worker": round(float(np.median([s["rss_mb"] for s in stats])), 1),
+        "pss_mb_total": round(sum(s["pss_mb"] for s in stats), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多 worker：每进程载入 vs 共享内存映射")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    vecs = rng.normal(size=(args.rows, args.dim)).astype(np.float32)
+    queries = rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+    result = {"params": vars(args), "vector_mb": round(vecs.nbytes / 2**20, 1)}
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind, store in (
+            ("local", LocalVectorStore(args.dim, path=Path(tmp) / "local")),
+            ("shared", SharedVectorStore(args.dim, Path(tmp) / "shared")),
+        ):
+            fill(store, vecs)
+            del store
+            result[kind] = run_workers(kind, str(Path(tmp) / kind), args, queries)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return result
+
+
+if __name__ == "__main__":
+    main()
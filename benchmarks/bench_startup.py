@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+冷启动基准
+=========
+
+每轮在新的子进程中测量：
+
+- `import_s`：`import rag_audit_api` 耗时（含 FastAPI 与各 SDK 的导入）；
+- `health_s`：启动 `uvicorn rag_audit_api:app` 到 `/health` 首次返回 200 的时间（进程可接流量）；
+- `ready_s`：到 `/ready` 首次返回 200 的时间（客户端已在后台预热完毕；没有该端点时为 null）。
+
+默认使用本地向量库与仅内存缓存，不访问外部服务。输出各项的中位数与每轮明细（JSON）。
+
+使用方法：
+python benchmarks/bench_startup.py
+python benchmarks/bench_startup.py --rounds 5 --output before.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+APP_DIR = ROOT / "app"
+
+ENV = {
+    "VECTOR_STORE": "local",
+    "LOCAL_VECTOR_STORE_PATH": "",
+    "EMBED_CACHE_PATH": "",
+    "ANALYSIS_CACHE_PATH": "",
+    "ETHERSCAN_CACHE_PATH": "",
+    "ECHIDNA_POOL_SIZE": "0",
+    "GOOGLE_API_KEY": "bench",
+    "PYTHONWARNINGS": "ignore",
+}
+
+
+def child_env() -> dict:
+    env = {**os.environ}
+    for key, value in ENV.items():
+        env.setdefault(key, value)
+    return env
+
+
+def measure_import() -> float:
+    code = "import time; t = time.perf_counter(); import rag_audit_api; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, env=child_env(),
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def status(url: str) -> int | None:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def measure_server(timeout: float) -> dict:
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "rag_audit_api:app", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR, env=child_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    health = ready = None
+    try:
+        while time.perf_counter() - start < timeout:
+            if health is None and status(base + "/health") == 200:
+                health = time.perf_counter() - start
+            if health is not None:
+                code = status(base + "/ready")
+                if code == 404:
+                    break
+                if code == 200:
+                    ready = time.perf_counter() - start
+                    break
+            time.sleep(0.01)
+    finally:
+        proc.terminate()
+        proc.wait(10)
+    return {"health_s": health, "ready_s": ready}
+
+
+def median(values):
+    values = [v for v in values if v is not None]
+    return round(statistics.median(values), 3) if values else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冷启动：导入耗时与 /health、/ready 就绪时间")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    runs = []
+    for _ in range(args.rounds):
+        runs.append({"import_s": measure_import(), **measure_server(args.timeout)})
+    result = {
+        "python": sys.version.split()[0],
+        "median": {k: median([r[k] for r in runs]) for k in ("import_s", "health_s", "ready_s")},
+        "runs": runs,
+    }
+    text = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    print(text)
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -36,13 +36,24 @@ export interface AnalyzeResponse {
   doc_id: string
   slither_findings: number
   echidna_fails: number
+  status?: AnalysisStatus["status"]
+}
+
+export interface AnalysisStage {
+  name: string
+  status: "pending" | "running" | "completed" | "failed" | "cancelled" | "skipped"
+  started_at?: number
+  finished_at?: number
+  duration?: number
+  detail?: string
 }
 
 export interface AnalysisStatus {
   doc_id: string
-  status: "pending" | "running" | "completed" | "failed"
+  status: "pending" | "running" | "completed" | "failed" | "cancelled"
   progress: number
   message?: string
+  stages?: AnalysisStage[]
 }
 
 export const analyzeContract = async (data: AnalyzeRequest): Promise<AnalyzeResponse> => {
@@ -141,7 +152,7 @@ export function useContractAnalysis() {
           setAnalysis(result)
           clearInterval(pollInterval)
           setLoading(false)
-        } else if (status.status === "failed") {
+        } else if (status.status === "failed" || status.status === "cancelled") {
           setError(status.message || "分析失败")
           clearInterval(pollInterval)
           setLoading(false)
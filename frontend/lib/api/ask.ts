@@ -6,9 +6,19 @@ import { useState } from "react"
 
 import { apiClient } from "./client"
 
+export interface AskFilters {
+  doc_id?: string[]
+  tool?: string[]
+  detector?: string[]
+  impact?: string[]
+  confidence?: string[]
+  elements?: string[]
+}
+
 export interface AskRequest {
   question: string
   top_k?: number
+  filters?: AskFilters
   context?: string
   conversation_id?: string
 }
@@ -22,6 +32,13 @@ export interface AskResponse {
     metadata?: Record<string, any>
   }>
   conversation_id?: string
+  context?: {
+    candidates: number
+    kept: number
+    tokens: number
+    budget: number
+    dropped_for_budget: number
+  }
   tokens_used?: number
   response_time?: number
 }
@@ -92,6 +109,7 @@ export const askQuestionStream = async (
 
     let buffer = ""
     let fullResponse = ""
+    let sources: AskResponse["sources"] = undefined
 
     while (true) {
       const { done, value } = await reader.read()
@@ -106,13 +124,18 @@ export const askQuestionStream = async (
         if (line.startsWith("data: ")) {
           const data = line.slice(6)
           if (data === "[DONE]") {
-            onComplete({ answer: fullResponse })
+            onComplete({ answer: fullResponse, sources })
             return
           }
 
           try {
             const parsed = JSON.parse(data)
-            if (parsed.chunk) {
+            if (parsed.type === "metadata") {
+              sources = parsed.sources
+            } else if (parsed.type === "error") {
+              onError(new Error(parsed.error))
+              return
+            } else if (parsed.chunk) {
               fullResponse += parsed.chunk
               onChunk(parsed.chunk)
             }
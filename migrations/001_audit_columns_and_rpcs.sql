@@ -0,0 +1,114 @@
+-- 已有 audit_vectors 表（只有 id / content / embedding / metadata）的库升级到当前结构：
+-- 结构化字段与指纹列、过滤用索引、代码索引表，以及四个检索函数。可重复执行。
+--
+--   psql "$DATABASE_URL" -f migrations/001_audit_columns_and_rpcs.sql
+--
+-- VECTOR_QUANTIZATION=float16 时把下面的 VECTOR(768) 全部换成 HALFVEC(768)（pgvector >= 0.7）。
+
+CREATE EXTENSION IF NOT EXISTS vector;
+
+-- ----------------------------------------------------------------- audit_vectors
+ALTER TABLE audit_vectors
+  ADD COLUMN IF NOT EXISTS doc_id TEXT,
+  ADD COLUMN IF NOT EXISTS tool TEXT,
+  ADD COLUMN IF NOT EXISTS detector TEXT,
+  ADD COLUMN IF NOT EXISTS impact TEXT,
+  ADD COLUMN IF NOT EXISTS confidence TEXT,
+  ADD COLUMN IF NOT EXISTS elements TEXT[],
+  ADD COLUMN IF NOT EXISTS occurrences INT DEFAULT 1,
+  ADD COLUMN IF NOT EXISTS fingerprint TEXT;
+
+CREATE INDEX IF NOT EXISTS audit_vectors_doc_id_fingerprint_idx ON audit_vectors (doc_id, fingerprint);
+CREATE INDEX IF NOT EXISTS audit_vectors_tool_impact_idx ON audit_vectors (lower(tool), lower(impact));
+CREATE INDEX IF NOT EXISTS audit_vectors_detector_idx ON audit_vectors (lower(detector));
+CREATE INDEX IF NOT EXISTS audit_vectors_elements_idx ON audit_vectors USING GIN (elements);
+
+-- 返回列变化时 CREATE OR REPLACE 会失败，先删除旧定义
+DROP FUNCTION IF EXISTS match_documents(VECTOR, FLOAT, INT);
+DROP FUNCTION IF EXISTS match_documents_filtered(VECTOR, FLOAT, INT, JSONB);
+
+-- 两个检索函数返回相同的列：结果行带 doc_id / elements / fingerprint，
+-- 混合检索按 (doc_id, fingerprint) 融合、答案缓存按 doc_id 失效都依赖这些列
+CREATE FUNCTION match_documents(
+  query_embedding VECTOR(768), match_threshold FLOAT, match_count INT
+) RETURNS TABLE (id INT, doc_id TEXT, content TEXT, tool TEXT, detector TEXT, impact TEXT,
+                 confidence TEXT, elements TEXT[], occurrences INT, fingerprint TEXT, similarity FLOAT)
+LANGUAGE sql STABLE AS $$
+  SELECT v.id, v.doc_id, v.content, v.tool, v.detector, v.impact, v.confidence, v.elements,
+         v.occurrences, v.fingerprint, 1 - (v.embedding <=> query_embedding) AS similarity
+  FROM audit_vectors v
+  WHERE 1 - (v.embedding <=> query_embedding) >= match_threshold
+  ORDER BY v.embedding <=> query_embedding
+  LIMIT match_count;
+$$;
+
+-- filter 形如 {"doc_id": ["vault"], "impact": ["high"]}，值已统一为小写
+CREATE FUNCTION match_documents_filtered(
+  query_embedding VECTOR(768), match_threshold FLOAT, match_count INT, filter JSONB
+) RETURNS TABLE (id INT, doc_id TEXT, content TEXT, tool TEXT, detector TEXT, impact TEXT,
+                 confidence TEXT, elements TEXT[], occurrences INT, fingerprint TEXT, similarity FLOAT)
+LANGUAGE sql STABLE AS $$
+  SELECT v.id, v.doc_id, v.content, v.tool, v.detector, v.impact, v.confidence, v.elements,
+         v.occurrences, v.fingerprint, 1 - (v.embedding <=> query_embedding) AS similarity
+  FROM audit_vectors v
+  WHERE (NOT filter ? 'doc_id'     OR lower(v.doc_id)     IN (SELECT jsonb_array_elements_text(filter->'doc_id')))
+    AND (NOT filter ? 'tool'       OR lower(v.tool)       IN (SELECT jsonb_array_elements_text(filter->'tool')))
+    AND (NOT filter ? 'detector'   OR lower(v.detector)   IN (SELECT jsonb_array_elements_text(filter->'detector')))
+    AND (NOT filter ? 'impact'     OR lower(v.impact)     IN (SELECT jsonb_array_elements_text(filter->'impact')))
+    AND (NOT filter ? 'confidence' OR lower(v.confidence) IN (SELECT jsonb_array_elements_text(filter->'confidence')))
+    AND (NOT filter ? 'elements'   OR EXISTS (
+          SELECT 1 FROM unnest(v.elements) e
+          WHERE lower(e) IN (SELECT jsonb_array_elements_text(filter->'elements'))))
+    AND 1 - (v.embedding <=> query_embedding) >= match_threshold
+  ORDER BY v.embedding <=> query_embedding
+  LIMIT match_count;
+$$;
+
+-- ----------------------------------------------------------------- audit_code（CODE_INDEX）
+CREATE TABLE IF NOT EXISTS audit_code (
+  id SERIAL PRIMARY KEY,
+  doc_id TEXT,
+  content TEXT NOT NULL,
+  embedding VECTOR(768),
+  kind TEXT,
+  symbol TEXT,
+  path TEXT,
+  start_line INT,
+  end_line INT,
+  elements TEXT[],
+  findings TEXT[],
+  fingerprint TEXT,
+  created_at TIMESTAMP DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS audit_code_doc_id_fingerprint_idx ON audit_code (doc_id, fingerprint);
+CREATE INDEX IF NOT EXISTS audit_code_elements_idx ON audit_code USING GIN (elements);
+
+CREATE OR REPLACE FUNCTION match_code(
+  query_embedding VECTOR(768), match_threshold FLOAT, match_count INT
+) RETURNS TABLE (id INT, doc_id TEXT, content TEXT, kind TEXT, symbol TEXT, path TEXT, start_line INT,
+                 end_line INT, elements TEXT[], findings TEXT[], fingerprint TEXT, similarity FLOAT)
+LANGUAGE sql STABLE AS $$
+  SELECT c.id, c.doc_id, c.content, c.kind, c.symbol, c.path, c.start_line, c.end_line, c.elements,
+         c.findings, c.fingerprint, 1 - (c.embedding <=> query_embedding) AS similarity
+  FROM audit_code c
+  WHERE 1 - (c.embedding <=> query_embedding) >= match_threshold
+  ORDER BY c.embedding <=> query_embedding
+  LIMIT match_count;
+$$;
+
+CREATE OR REPLACE FUNCTION match_code_filtered(
+  query_embedding VECTOR(768), match_threshold FLOAT, match_count INT, filter JSONB
+) RETURNS TABLE (id INT, doc_id TEXT, content TEXT, kind TEXT, symbol TEXT, path TEXT, start_line INT,
+                 end_line INT, elements TEXT[], findings TEXT[], fingerprint TEXT, similarity FLOAT)
+LANGUAGE sql STABLE AS $$
+  SELECT c.id, c.doc_id, c.content, c.kind, c.symbol, c.path, c.start_line, c.end_line, c.elements,
+         c.findings, c.fingerprint, 1 - (c.embedding <=> query_embedding) AS similarity
+  FROM audit_code c
+  WHERE (NOT filter ? 'doc_id'   OR lower(c.doc_id) IN (SELECT jsonb_array_elements_text(filter->'doc_id')))
+    AND (NOT filter ? 'elements' OR EXISTS (
+          SELECT 1 FROM unnest(c.elements) e
+          WHERE lower(e) IN (SELECT jsonb_array_elements_text(filter->'elements'))))
+    AND 1 - (c.embedding <=> query_embedding) >= match_threshold
+  ORDER BY c.embedding <=> query_embedding
+  LIMIT match_count;
+$$;
@@ -6,8 +6,9 @@ if [ -f .env ]; then
   export $(grep -v '^#' .env | xargs)
 fi
 
-# 默认使用多进程 workers=2，可按需调整
+# 默认使用多进程 workers=2，可按需调整；WEB_CONCURRENCY 告知应用进程数（多 worker 时默认关闭混合检索）
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-${UVICORN_WORKERS:-2}}
 exec uvicorn app.rag_audit_api:app \
     --host 0.0.0.0 \
     --port 8000 \
-    --workers ${UVICORN_WORKERS:-2}
+    --workers ${WEB_CONCURRENCY}
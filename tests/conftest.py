@@ -6,9 +6,30 @@ sys.path.insert(0, str(BASE_DIR))
 sys.path.insert(0, str(APP_DIR))
 
 import types, builtins, pytest
+from dataclasses import replace
 from fastapi.testclient import TestClient
+import rag_audit_api
 from rag_audit_api import app
 
+CACHE_PATHS = {
+    "EMBED_CACHE_PATH": ("embed_cache", "embeddings.sqlite3"),
+    "ANALYSIS_CACHE_PATH": ("analysis_cache", "analysis.sqlite3"),
+    "ETHERSCAN_CACHE_PATH": ("etherscan_client", "etherscan.sqlite3"),
+}
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(monkeypatch, tmp_path):
+    """各缓存文件写到本测试的 tmp_path，测试不往工作区的 .cache 写入任何东西"""
+    paths = {env: str(tmp_path / filename) for env, (_, filename) in CACHE_PATHS.items()}
+    for env, path in paths.items():
+        monkeypatch.setenv(env, path)  # 测试内 Settings.from_env() 创建的应用
+    # 默认应用的这几个客户端换成指向 tmp_path 的新实例（首次使用时创建）
+    fresh = rag_audit_api.Clients(replace(rag_audit_api.settings, **{env.lower(): p for env, p in paths.items()}))
+    for env, (name, _) in CACHE_PATHS.items():
+        monkeypatch.setitem(rag_audit_api.clients, name, fresh[name])
+
+
 @pytest.fixture
 def client(monkeypatch):
     # 1. mock Supabase
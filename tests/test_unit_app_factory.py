@@ -0,0 +1,178 @@
+"""应用工厂、延迟创建客户端与 /ready 单元测试"""
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import rag_audit_api
+from lazy import Lazy, LazyProxy
+from settings import Settings
+
+APP_DIR = os.path.dirname(rag_audit_api.__file__)
+
+
+NO_CACHE_FILES = dict(embed_cache_path=None, analysis_cache_path=None, etherscan_cache_path=None)
+LOCAL = dict(vector_store="local", google_api_key="k", local_vector_store_path=None, **NO_CACHE_FILES)
+
+
+def test_lazy_creates_once_and_does_not_cache_errors():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        time.sleep(0.05)
+        return object()
+
+    lazy = Lazy(factory, "x")
+    with pytest.raises(RuntimeError):
+        lazy.get()
+    assert lazy.status() == {"ready": False, "error": "boom"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(lazy.get())) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 2
+    assert len({id(r) for r in results}) == 1
+    assert lazy.ready and lazy.error is None
+
+    lazy.reset(lambda: "new")
+    assert not lazy.ready
+    assert lazy.get() == "new"
+
+
+def test_lazy_proxy_forwards_attributes_and_len():
+    lazy = Lazy(lambda: [1, 2, 3], "items")
+    proxy = LazyProxy(lazy)
+    assert not lazy.ready
+    assert "未创建" in repr(proxy)
+    assert len(proxy) == 3
+    assert proxy.count(2) == 1
+    assert lazy.ready
+
+
+def test_settings_from_env_and_validate():
+    s = Settings.from_env({"VECTOR_STORE": "local", "GEMINI_API_KEY": "k", "EMBED_CACHE_PATH": "",
+                           "WARMUP_CLIENTS": "0"})
+    assert s.google_api_key == "k"
+    assert s.embed_cache_path is None
+    assert s.warmup is False
+    s.validate()
+    with pytest.raises(RuntimeError, match="SUPABASE_URL"):
+        Settings(vector_store="supabase").validate()
+    with pytest.raises(RuntimeError, match="不支持"):
+        Settings(vector_store="pinecone", google_api_key="k").validate()
+
+
+def test_import_does_not_load_sdks_or_require_credentials():
+    env = {k: v for k, v in os.environ.items()
+           if k not in ("SUPABASE_URL", "SUPABASE_KEY", "GOOGLE_API_KEY", "GEMINI_API_KEY", "VECTOR_STORE")}
+    code = (
+        "import sys, rag_audit_api; "
+        "print(sorted(m for m in ('google.generativeai', 'supabase', 'requests') if m in sys.modules))"
+    )
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=APP_DIR, env=env,
+                         capture_output=True, text=True, timeout=60)
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.strip().splitlines()[-1] == "[]"
+
+
+def test_missing_credentials_reported_by_ready_not_health():
+    app = rag_audit_api.create_app(Settings(vector_store="supabase", warmup=False, **NO_CACHE_FILES))
+    client = TestClient(app)
+    assert client.get("/health").status_code == 200
+    # 预热关闭：客户端在首次使用时创建，/ready 不等待
+    assert client.get("/ready").status_code == 200
+
+    with pytest.raises(RuntimeError, match="SUPABASE_URL"):
+        app.state.clients.bind(len)(rag_audit_api.vector_store)
+    status = app.state.clients["vector_store"].status()
+    assert status["ready"] is False and "SUPABASE_URL" in status["error"]
+
+
+def test_ready_after_warmup():
+    app = rag_audit_api.create_app(Settings(**LOCAL))
+    app.state.clients["genai"].reset(lambda: object())  # 不导入真实 SDK
+    with TestClient(app) as client:
+        assert client.get("/health").status_code == 200
+        deadline = time.time() + 10
+        while client.get("/ready").status_code != 200 and time.time() < deadline:
+            time.sleep(0.05)
+        body = client.get("/ready").json()
+    assert body["status"] == "ready"
+    assert all(c["ready"] for c in body["clients"].values())
+    assert app.state.settings.vector_store == "local"
+
+
+def test_ready_reports_failed_client():
+    app = rag_audit_api.create_app(Settings(vector_store="supabase", **NO_CACHE_FILES))
+    app.state.clients["genai"].reset(lambda: object())
+    with TestClient(app) as client:
+        deadline = time.time() + 10
+        body = client.get("/ready").json()
+        while body["clients"]["vector_store"]["error"] is None and time.time() < deadline:
+            time.sleep(0.05)
+            body = client.get("/ready").json()
+        resp = client.get("/ready")
+    assert resp.status_code == 503
+    assert "SUPABASE_URL" in resp.json()["clients"]["vector_store"]["error"]
+
+
+def test_apps_keep_their_own_settings_and_clients(monkeypatch):
+    monkeypatch.setattr(rag_audit_api, "embed_in_batches",
+                        lambda chunks, *a, **kw: [[1.0] + [0.0] * (rag_audit_api.EMBED_DIM - 1) for _ in chunks])
+    default = rag_audit_api.settings
+    first = rag_audit_api.create_app(Settings(**LOCAL, warmup=False, hybrid_search=True))
+    second = rag_audit_api.create_app(Settings(**LOCAL, warmup=False, hybrid_search=True))
+    broken = rag_audit_api.create_app(Settings(vector_store="supabase", warmup=False, **NO_CACHE_FILES))
+    assert rag_audit_api.settings is default and rag_audit_api.app.state.clients is rag_audit_api.clients
+    assert first.state.settings is not second.state.settings
+
+    report = {"results": {"detectors": [{"check": "a", "impact": "High", "description": "a in Vault.x()",
+                                         "elements": [{"name": "x"}]}]}}
+    raw = io.BytesIO(json.dumps(report).encode())
+    resp = TestClient(first).post("/ingest", files=[("files", ("Vault.json", raw, "application/json"))])
+    assert resp.status_code == 200
+    # /ingest 写入的是所属应用的向量库与词法索引
+    assert len(first.state.clients["vector_store"].get()) == 1
+    assert len(second.state.clients["vector_store"].get()) == 0
+    assert len(first.state.clients.state["lexical_index"].get()) == 1
+    assert len(second.state.clients.state["lexical_index"].get()) == 0
+    assert not broken.state.clients["vector_store"].ready
+    with pytest.raises(RuntimeError, match="SUPABASE_URL"):
+        broken.state.clients.bind(len)(rag_audit_api.vector_store)
+
+
+def test_apps_do_not_share_process_state(monkeypatch):
+    first = rag_audit_api.create_app(Settings(**LOCAL, warmup=False))
+    second = rag_audit_api.create_app(Settings(**LOCAL, warmup=False, hybrid_search=False))
+    a, b = first.state.clients, second.state.clients
+    assert a.bind(rag_audit_api.hybrid_search)() and not b.bind(rag_audit_api.hybrid_search)()
+
+    # 重试队列：A 的待重试行只会由 A 的重试线程写入 A 的向量库
+    row = {"doc_id": "Vault", "content": "pending", "fingerprint": "f1"}
+    a.bind(lambda: rag_audit_api.embed_retry.put(("Vault", "pending"), row))()
+    monkeypatch.setattr(rag_audit_api, "embed_texts", lambda texts: [[1.0] + [0.0] * (rag_audit_api.EMBED_DIM - 1)
+                                                                      for _ in texts])
+    assert b.bind(rag_audit_api.retry_pending_embeddings)() == 0
+    assert len(b["vector_store"].get()) == 0
+    assert a.bind(rag_audit_api.retry_pending_embeddings)() == 1
+    assert len(a["vector_store"].get()) == 1
+
+    # 答案缓存、后台任务、Gemini 限流熔断与线程池各自独立
+    for name in ("answer_cache", "job_manager", "gemini", "data_executor", "stream_executor", "lexical_index"):
+        assert a.state[name].get() is not b.state[name].get()
+    ctx = [{"doc_id": "Vault", "content": "x"}]
+    a.bind(lambda: rag_audit_api.answer_cache.store([1.0, 0.0], ctx, "答案"))()
+    assert a.bind(lambda: rag_audit_api.answer_cache.lookup([1.0, 0.0], ctx))() == "答案"
+    assert b.bind(lambda: rag_audit_api.answer_cache.lookup([1.0, 0.0], ctx))() is None
@@ -0,0 +1,74 @@
+"""/ask/stream SSE 单元测试（mock 检索与 Gemini 流式输出）"""
+import asyncio
+import json
+import time
+import types
+
+from fastapi.testclient import TestClient
+
+import rag_audit_api
+
+
+def fake_genai(parts, produced=None, delay=0.0):
+    def generate_content(prompt, stream=False):
+        def gen():
+            for p in parts:
+                if delay:
+                    time.sleep(delay)
+                if produced is not None:
+                    produced.append(p)
+                yield types.SimpleNamespace(text=p)
+        return gen()
+
+    return types.SimpleNamespace(
+        GenerativeModel=lambda name: types.SimpleNamespace(generate_content=generate_content)
+    )
+
+
+def parse_sse(body):
+    return [line[len("data: "):] for line in body.splitlines() if line.startswith("data: ")]
+
+
+def test_ask_stream_sends_metadata_then_chunks(monkeypatch):
+    monkeypatch.setattr(rag_audit_api, "retrieve", lambda q, k, filters=None: (None, [
+        {"doc_id": "Vault", "content": "reentrancy in withdraw()", "similarity": 0.91}
+    ]))
+    monkeypatch.setattr(rag_audit_api, "genai", fake_genai(["存在", "重入", "风险"]))
+
+    resp = TestClient(rag_audit_api.app).post("/ask/stream", json={"question": "有没有重入漏洞?"})
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(resp.text)
+    meta = json.loads(events[0])
+    assert meta["type"] == "metadata"
+    assert meta["sources"] == [{"title": "Vault", "content": "reentrancy in withdraw()", "score": 0.91, "metadata": {}}]
+    assert meta["cached"] is False
+    assert [json.loads(e)["chunk"] for e in events[1:-1]] == ["存在", "重入", "风险"]
+    assert events[-1] == "[DONE]"
+
+
+def test_ask_stream_reports_generation_error(monkeypatch):
+    def broken(name):
+        raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(rag_audit_api, "retrieve", lambda q, k, filters=None: (None, []))
+    monkeypatch.setattr(rag_audit_api, "genai", types.SimpleNamespace(GenerativeModel=broken))
+    events = parse_sse(TestClient(rag_audit_api.app).post("/ask/stream", json={"question": "q"}).text)
+    assert json.loads(events[1]) == {"type": "error", "error": "quota exceeded"}
+    assert events[-1] == "[DONE]"
+
+
+def test_stream_generation_stops_upstream_when_consumer_leaves(monkeypatch):
+    produced = []
+    monkeypatch.setattr(rag_audit_api, "genai", fake_genai([str(i) for i in range(200)], produced, delay=0.005))
+
+    async def consume_two():
+        gen = rag_audit_api.stream_generation("prompt")
+        got = [await gen.__anext__(), await gen.__anext__()]
+        await gen.aclose()  # 模拟客户端断开
+        return got
+
+    assert asyncio.run(consume_two()) == [("chunk", "0"), ("chunk", "1")]
+    time.sleep(0.1)
+    stopped_at = len(produced)
+    time.sleep(0.1)
+    assert len(produced) == stopped_at < 200
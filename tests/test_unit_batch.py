@@ -0,0 +1,202 @@
+"""批量分析单元测试（mock Slither/Echidna/入库）"""
+import asyncio
+import io
+import time
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+import jobs
+import rag_audit_api
+from analysis_cache import AnalysisCache
+from batch import InsertBatcher, doc_ids_for, extract_sol_archive, list_sol_members, parse_addresses
+from etherscan import address_doc_id
+from vector_store import LocalVectorStore
+
+ADDR_A = "0x" + "a" * 40
+ADDR_B = "0x" + "b" * 40
+
+
+def make_zip(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    return buf.getvalue()
+
+
+def test_archive_members_are_filtered_and_extracted(tmp_path):
+    data = make_zip({
+        "proto/Vault.sol": "contract Vault {}",
+        "proto/lib/Math.sol": "library Math {}",
+        "__MACOSX/proto/._Vault.sol": "junk",
+        "../escape.sol": "contract Evil {}",
+        "README.md": "docs",
+    })
+    assert list_sol_members(data, 10, 1 << 20) == ["proto/Vault.sol", "proto/lib/Math.sol"]
+    assert extract_sol_archive(data, tmp_path) == ["proto/Vault.sol", "proto/lib/Math.sol"]
+    assert (tmp_path / "proto" / "lib" / "Math.sol").read_text() == "library Math {}"
+    assert not (tmp_path.parent / "escape.sol").exists()
+
+
+def test_archive_limits_and_bad_zip():
+    data = make_zip({f"C{i}.sol": "contract C {}" for i in range(3)})
+    with pytest.raises(ValueError):
+        list_sol_members(data, 2, 1 << 20)
+    with pytest.raises(ValueError):
+        list_sol_members(data, 10, 10)
+    with pytest.raises(ValueError):
+        list_sol_members(b"not a zip", 10, 1 << 20)
+
+
+def test_parse_addresses_and_doc_ids():
+    assert parse_addresses(f"{ADDR_A}, {ADDR_B}\n{ADDR_A.upper().replace('0X', '0x')}") == [ADDR_A, ADDR_B]
+    assert parse_addresses(f'["{ADDR_B}"]') == [ADDR_B]
+    with pytest.raises(ValueError):
+        parse_addresses("0x1234")
+    assert doc_ids_for(["a/Token.sol", "b/Token.sol", "Vault.sol"]) == ["a_Token", "b_Token", "Vault"]
+    # 地址取完整小写地址并带链：前缀相同的地址、不同链上的同一地址互不覆盖
+    assert address_doc_id(ADDR_A.upper().replace("0X", "0x"), "ethereum") == f"eip155:1:{ADDR_A}"
+    assert address_doc_id("0xaaaa" + "1" * 36, 1) != address_doc_id(ADDR_A, 1)
+    assert address_doc_id(ADDR_A, "base") == f"eip155:8453:{ADDR_A}"
+    with pytest.raises(ValueError):
+        address_doc_id(ADDR_A, "nochain")
+
+
+def test_insert_batcher_shares_flushes():
+    calls = []
+
+    async def go():
+        batcher = InsertBatcher(lambda docs: calls.append([d for d, _ in docs]), producers=4, max_chunks=3)
+
+        async def producer(i, n):
+            await asyncio.sleep(0.01 * i)
+            if n is None:
+                await batcher.skip()
+            else:
+                await batcher.add(f"d{i}", list(range(n)))
+
+        await asyncio.gather(producer(0, 2), producer(1, 2), producer(2, None), producer(3, 1))
+        return batcher.flushes
+
+    assert asyncio.run(go()) == 2
+    assert calls == [["d0", "d1"], ["d3"]]  # 第一批凑满 3 块，其余在最后一个生产者结束时入库
+
+
+def test_insert_batcher_propagates_errors():
+    def boom(docs):
+        raise RuntimeError("db down")
+
+    async def go():
+        batcher = InsertBatcher(boom, producers=1)
+        await batcher.add("d", [1])
+
+    with pytest.raises(RuntimeError, match="db down"):
+        asyncio.run(go())
+
+
+@pytest.fixture
+def api(monkeypatch):
+    running = {"now": 0, "max": 0}
+
+    async def fake_slither(path, root=None, remappings=None):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.05)
+        running["now"] -= 1
+        if path.stem == "Broken":
+            raise RuntimeError("compile error")
+        return {"results": {"detectors": [{"impact": "High", "description": f"bug in {path.stem}", "elements": []}]}}
+
+    async def fake_echidna(path, name, root=None):
+        return {"fails": []}
+
+    inserted = []
+    monkeypatch.setattr(rag_audit_api, "run_slither", fake_slither)
+    monkeypatch.setattr(rag_audit_api, "run_echidna", fake_echidna)
+    monkeypatch.setattr(rag_audit_api, "insert_group_batches",
+                        lambda docs: inserted.append([d for d, _ in docs]) or sum(len(g) for _, g in docs))
+    monkeypatch.setattr(rag_audit_api, "job_manager", jobs.JobManager(workers=2))
+    monkeypatch.setattr(rag_audit_api, "vector_store", LocalVectorStore(4))
+    monkeypatch.setattr(rag_audit_api, "CODE_INDEX", False)  # 代码索引另有测试
+    monkeypatch.setattr(rag_audit_api, "analysis_cache", AnalysisCache())
+    monkeypatch.setattr(rag_audit_api, "_tool_versions", {"slither": "0.10.0", "echidna": "sha256:test"})
+    monkeypatch.setattr(rag_audit_api, "BATCH_WORKERS", 2)
+    return TestClient(rag_audit_api.app), inserted, running
+
+
+def test_batch_archive_reports_items_and_shares_inserts(api):
+    client, inserted, running = api
+    files = {f"proto/C{i}.sol": f"contract C{i} {{}}" for i in range(5)}
+    files["proto/Broken.sol"] = "contract Broken {"
+    resp = client.post("/analyze/batch", files={"archive": ("proto.zip", make_zip(files), "application/zip")},
+                       data={"wait": "true"})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["status"] == "completed" and body["progress"] == 100
+    items = {i["doc_id"]: i for i in body["items"]}
+    assert items["Broken"]["status"] == "failed" and "compile error" in items["Broken"]["message"]
+    assert items["C3"]["status"] == "completed" and items["C3"]["slither_findings"] == 1
+    assert items["C3"]["source"] == "proto/C3.sol"
+
+    assert running["max"] == 2                                # 并发受 BATCH_WORKERS 限制
+    assert len(inserted) == 1 and len(inserted[0]) == 5       # 5 个合约共享一次入库
+    assert client.get("/analyze/C3").json()["slither_findings"] == 1
+    assert client.get(f"/analyze/batch/{body['batch_id']}").json()["items"] == body["items"]
+
+
+def test_batch_rerun_hits_cache_and_validates_input(api):
+    client, inserted, _ = api
+    data = make_zip({"A.sol": "contract A {}"})
+    first = client.post("/analyze/batch", files={"archive": ("a.zip", data, "application/zip")}, data={"wait": "true"})
+    again = client.post("/analyze/batch", files={"archive": ("a.zip", data, "application/zip")}, data={"wait": "true"})
+    assert first.json()["items"][0]["status"] == again.json()["items"][0]["status"] == "completed"
+    assert len(inserted) == 1
+
+    assert client.post("/analyze/batch").status_code == 400
+    assert client.post("/analyze/batch", data={"addresses": "0x12"}).status_code == 400
+    assert client.post("/analyze/batch", files={"archive": ("x.zip", b"nope", "application/zip")}).status_code == 400
+    assert client.get("/analyze/batch/batch-missing").status_code == 404
+
+
+def test_batch_addresses_use_etherscan_sources(api, monkeypatch):
+    client, inserted, _ = api
+
+    def fake_load(address, chain, dest):
+        dest.mkdir(parents=True)
+        path = dest / "Token.sol"
+        path.write_text(f"contract Token {{}} // {address}")
+        return path, rag_audit_api.ContractSource(address, 1, "Token", {"Token.sol": path.read_text()}, "Token.sol")
+
+    monkeypatch.setattr(rag_audit_api, "load_address_source", fake_load)
+    resp = client.post("/analyze/batch", data={"addresses": f"{ADDR_A}\n{ADDR_B}", "wait": "true"})
+    assert [i["doc_id"] for i in resp.json()["items"]] == [f"eip155:1:{ADDR_A}", f"eip155:1:{ADDR_B}"]
+    assert sorted(inserted[0]) == [f"eip155:1:{ADDR_A}", f"eip155:1:{ADDR_B}"]
+
+    # 单个地址分析：前缀相同的两个地址各自一个 doc_id，互不删除对方的发现
+    twin = "0xaaaa" + "1" * 36
+    monkeypatch.setattr(rag_audit_api, "insert_chunks", lambda doc_id, chunks, metadata=None: len(chunks))
+    for addr in (ADDR_A, twin):
+        resp = client.post("/analyze", data={"address": addr, "wait": "true", "force": "true"})
+        assert resp.json()["doc_id"] == f"eip155:1:{addr}"
+    assert client.get(f"/analyze/eip155:1:{twin}/status").json()["status"] == "completed"
+    assert client.post("/analyze", data={"address": ADDR_A, "chain": "nochain"}).status_code == 400
+
+
+def test_batch_cancel(api, monkeypatch):
+    client, _, _ = api
+
+    async def slow(path, root=None, remappings=None):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(rag_audit_api, "run_slither", slow)
+    resp = client.post("/analyze/batch", files={"archive": ("s.zip", make_zip({"S.sol": "contract S {}"}), "application/zip")})
+    batch_id = resp.json()["batch_id"]
+    time.sleep(0.1)
+    assert client.delete(f"/analyze/batch/{batch_id}").status_code == 200
+    deadline = time.time() + 5
+    while time.time() < deadline and client.get(f"/analyze/batch/{batch_id}").json()["status"] != "cancelled":
+        time.sleep(0.01)
+    body = client.get(f"/analyze/batch/{batch_id}").json()
+    assert body["status"] == "cancelled" and body["items"][0]["status"] == "cancelled"
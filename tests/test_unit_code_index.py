@@ -0,0 +1,197 @@
+"""Solidity 代码索引单元测试（分块、关联发现、增量入库与问答取代码）"""
+import types
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import jobs
+import rag_audit_api
+from analysis_cache import AnalysisCache
+from code_index import element_key, identifiers, link_findings, mask_source, parse_solidity
+from context_builder import estimate_tokens
+from lexical_index import BM25Index
+from semantic_cache import SemanticCache
+from vector_store import LocalVectorStore
+
+VAULT = '''// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.0;
+
+/// @title 简单金库
+contract Vault {
+    mapping(address => uint256) public balances;  // {不是代码块}
+    address public owner = address(0);
+    event Withdrawn(address indexed who, uint256 amount);
+
+    modifier onlyOwner() {
+        require(msg.sender == owner, "not owner }");
+        _;
+    }
+
+    function deposit() public payable {
+        balances[msg.sender] += msg.value;
+    }
+
+    /// @notice 取出余额
+    function withdraw(uint256 amount) public {
+        require(balances[msg.sender] >= amount);
+        (bool ok, ) = msg.sender.call{value: amount}("");
+        require(ok);
+        balances[msg.sender] -= amount;
+    }
+
+    receive() external payable {}
+}
+
+interface IVault { function withdraw(uint256 amount) external; }
+
+function double(uint256 x) pure returns (uint256) { return x * 2; }
+'''
+
+
+def test_mask_source_blanks_comments_and_strings_keeping_positions():
+    src = 'a = "x{;}" // c{\n/* }; */ b;'
+    masked = mask_source(src)
+    assert len(masked) == len(src) and masked.count("\n") == 1
+    assert "{" not in masked and masked.count(";") == 1 and masked.rstrip().endswith("b;")
+
+
+def test_parse_solidity_chunks_with_line_ranges_and_symbols():
+    chunks = parse_solidity(VAULT, "src/Vault.sol")
+    summary = [(c.kind, c.qualified_name, c.start_line, c.end_line) for c in chunks]
+    assert summary == [
+        ("contract", "Vault", 4, 28),
+        ("modifier", "Vault.onlyOwner", 10, 13),
+        ("function", "Vault.deposit", 15, 17),
+        ("function", "Vault.withdraw", 19, 25),
+        ("function", "Vault.receive", 27, 27),
+        ("contract", "IVault", 30, 30),
+        ("function", "IVault.withdraw", 30, 30),
+        ("function", "double", 32, 32),
+    ]
+    contract, withdraw = chunks[0], chunks[3]
+    assert contract.symbols == ["Vault", "balances", "owner", "Withdrawn"]
+    assert "function withdraw(uint256 amount) public { ... }" in contract.text
+    assert "msg.sender.call" not in contract.text  # 合约块只保留成员签名
+    assert withdraw.text.startswith("    /// @notice 取出余额\n    function withdraw")
+    assert withdraw.content().startswith("// src/Vault.sol:19-25 function Vault.withdraw\n")
+
+    long = parse_solidity(VAULT, max_chars=40)[3]
+    assert long.text.endswith("（截断）") and long.end_line == 25
+
+
+def test_link_findings_by_element_name():
+    chunks = parse_solidity(VAULT, "Vault.sol")
+    assert element_key("Vault.withdraw(uint256)") == "withdraw"
+    links = link_findings(chunks, [("fp-reentrancy", ["withdraw(uint256)", "balances"]), ("fp-other", ["Token"])])
+    by_name = {c.qualified_name: c.findings for c in chunks}
+    assert by_name["Vault.withdraw"] == ["fp-reentrancy"]
+    assert by_name["IVault.withdraw"] == ["fp-reentrancy"]  # 同名函数都关联
+    assert by_name["Vault"] == ["fp-reentrancy"]           # 状态变量在合约块中声明
+    assert by_name["Vault.deposit"] == []
+    assert links == 3
+    row = chunks[3].row("Vault")
+    assert row["elements"] == ["withdraw", "Vault"] and row["findings"] == ["fp-reentrancy"]
+    assert identifiers("show me how `withdraw` handles balances") == ["show", "how", "withdraw", "handles", "balances"]
+
+
+def embed_by_keyword(texts):
+    """按关键词给出可区分的向量：withdraw 的函数体与 withdraw 问题最相近，只提到 withdraw 的次之"""
+    def vec(t):
+        if "msg.sender.call" in t:
+            return [1.0, 0.0, 0.0, 0.1]
+        return [0.6, 0.8, 0.0, 0.1] if "withdraw" in t else [0.0, 1.0, 0.0, 0.1]
+    return [vec(t) for t in texts]
+
+
+def test_index_code_is_incremental(monkeypatch):
+    store = LocalVectorStore(4)
+    embedded = []
+    monkeypatch.setattr(rag_audit_api, "code_store", store)
+    monkeypatch.setattr(rag_audit_api, "embed_in_batches",
+                        lambda texts, *a, **kw: embedded.extend(texts) or embed_by_keyword(texts))
+    group = types.SimpleNamespace(key="fp1", elements=["withdraw"])
+
+    assert rag_audit_api.index_code("Vault", parse_solidity(VAULT, "Vault.sol"), [group]) == 8
+    assert len(store) == 8
+    assert rag_audit_api.index_code("Vault", parse_solidity(VAULT, "Vault.sol"), [group]) == 0  # 未变：不再向量化
+
+    changed = VAULT.replace("balances[msg.sender] += msg.value;", "balances[msg.sender] += msg.value * 1;")
+    embedded.clear()
+    assert rag_audit_api.index_code("Vault", parse_solidity(changed, "Vault.sol"), [group]) == 1
+    assert len(embedded) == 1 and "msg.value * 1" in embedded[0]
+    assert len(store) == 8
+    # 发现不再引用某函数：该块以新指纹重写，关联随之更新
+    rag_audit_api.index_code("Vault", parse_solidity(changed, "Vault.sol"), [])
+    assert all(r["findings"] == [] for r in store.scan())
+
+
+def test_ask_attaches_code_for_question_and_linked_findings(monkeypatch):
+    findings = LocalVectorStore(4)
+    findings.add([{
+        "doc_id": "Vault", "content": "[Slither] 严重程度:High | Reentrancy in Vault.withdraw | 元素:withdraw",
+        "tool": "slither", "elements": ["withdraw"], "fingerprint": "fp1", "embedding": [1.0, 0.0, 0.0, 0.1],
+    }])
+    code = LocalVectorStore(4)
+    monkeypatch.setattr(rag_audit_api, "code_store", code)
+    monkeypatch.setattr(rag_audit_api, "embed_in_batches", lambda texts, *a, **kw: embed_by_keyword(texts))
+    rag_audit_api.index_code("Vault", parse_solidity(VAULT, "Vault.sol"), [types.SimpleNamespace(
+        key="fp1", elements=["withdraw"])])
+
+    prompts = []
+    monkeypatch.setattr(rag_audit_api, "vector_store", findings)
+    monkeypatch.setattr(rag_audit_api, "lexical_index", BM25Index())
+    monkeypatch.setattr(rag_audit_api, "answer_cache", SemanticCache())
+    monkeypatch.setattr(rag_audit_api, "embed_text", lambda text: [1.0, 0.0, 0.0, 0.1])
+    monkeypatch.setattr(rag_audit_api, "CODE_TOP_K", 2)
+    monkeypatch.setattr(rag_audit_api, "genai", types.SimpleNamespace(
+        GenerativeModel=lambda name: types.SimpleNamespace(
+            generate_content=lambda prompt: prompts.append(prompt) or types.SimpleNamespace(text="ok")
+        )
+    ))
+    resp = TestClient(rag_audit_api.app).post(
+        "/ask", json={"question": "show me how withdraw handles balances", "top_k": 1}
+    )
+    assert resp.status_code == 200
+    stats = resp.json()["context"]
+    assert stats["kept"] == 1 and stats["code"]["kept"] <= 2
+
+    prompt = prompts[0]
+    findings_part, code_part = prompt.split("### 相关代码")
+    assert "Reentrancy in Vault.withdraw" in findings_part
+    assert "function Vault.withdraw" in code_part and "msg.sender.call" in code_part
+    assert "msg.value" not in code_part  # 无关的 deposit 不在上下文中
+    assert estimate_tokens(code_part) < estimate_tokens(VAULT)
+
+
+def test_analyze_indexes_uploaded_source_linked_to_findings(monkeypatch):
+    async def fake_slither(path, root=None, remappings=None):
+        return {"results": {"detectors": [{
+            "check": "reentrancy-eth", "impact": "High", "confidence": "Medium",
+            "description": "Reentrancy in Vault.withdraw(uint256)",
+            "elements": [{"type": "function", "name": "withdraw"}],
+        }]}}
+
+    async def fake_echidna(path, name, root=None):
+        return {"fails": []}
+
+    code = LocalVectorStore(4)
+    monkeypatch.setattr(rag_audit_api, "run_slither", fake_slither)
+    monkeypatch.setattr(rag_audit_api, "run_echidna", fake_echidna)
+    monkeypatch.setattr(rag_audit_api, "insert_chunks", lambda doc_id, chunks, metadata=None: len(chunks))
+    monkeypatch.setattr(rag_audit_api, "embed_in_batches", lambda texts, *a, **kw: embed_by_keyword(texts))
+    monkeypatch.setattr(rag_audit_api, "vector_store", LocalVectorStore(4))
+    monkeypatch.setattr(rag_audit_api, "code_store", code)
+    monkeypatch.setattr(rag_audit_api, "job_manager", jobs.JobManager(workers=1))
+    monkeypatch.setattr(rag_audit_api, "analysis_cache", AnalysisCache())
+    monkeypatch.setattr(rag_audit_api, "_tool_versions", {"slither": "0.10.0", "echidna": "sha256:test"})
+
+    resp = TestClient(rag_audit_api.app).post(
+        "/analyze", files={"file": ("Vault.sol", VAULT.encode(), "text/plain")}, data={"wait": "true"}
+    )
+    assert resp.status_code == 200 and resp.json()["slither_findings"] == 1
+    rows = {r["symbol"]: r for r in code.scan()}
+    assert set(rows) >= {"Vault", "Vault.withdraw", "Vault.deposit"}
+    assert rows["Vault.withdraw"]["doc_id"] == "Vault" and len(rows["Vault.withdraw"]["findings"]) == 1
+    assert rows["Vault.deposit"]["findings"] == []
+    hit = code.search(np.array([1.0, 0, 0, 0.1]), 1, filters={"elements": ["withdraw"], "doc_id": ["vault"]})[0]
+    assert (hit["start_line"], hit["end_line"]) == (19, 25)
@@ -0,0 +1,57 @@
+"""上下文组装（重排 / MMR / token 预算）单元测试"""
+import rag_audit_api
+from context_builder import build_context, estimate_tokens, mmr_order, rerank
+
+
+def test_estimate_tokens_counts_cjk_per_char():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("重入漏洞，") == 5
+    assert estimate_tokens("重入 withdraw") == 2 + 3
+
+
+def test_rerank_prefers_similar_and_overlapping_rows():
+    rows = [
+        {"content": "solc-version too old", "similarity": 0.72},
+        {"content": "Reentrancy in Vault.withdraw()", "similarity": 0.80, "bm25": 4.0},
+    ]
+    scored = rerank("withdraw reentrancy", rows)
+    assert scored[0][1]["content"].startswith("Reentrancy")
+    assert scored[0][0] > scored[1][0]
+
+
+def test_mmr_demotes_near_duplicate_chunks():
+    scored = [
+        (1.00, {"content": "Reentrancy in Vault.withdraw() external call"}),
+        (0.99, {"content": "Reentrancy in Vault.withdraw() external call again"}),
+        (0.80, {"content": "tx-origin used for auth in Token.owner"}),
+    ]
+    order = [r["content"] for r in mmr_order(scored, lambda_=0.5)]
+    assert order[1].startswith("tx-origin")
+
+
+def test_build_context_respects_chunk_and_token_budget():
+    big = {"content": "x" * 400, "similarity": 0.99}                # ≈100 tokens
+    small = [{"content": f"finding {i} withdraw", "similarity": 0.9 - i * 0.01} for i in range(5)]
+    selected, stats = build_context("withdraw", [big, *small], max_chunks=3, token_budget=30)
+    assert big not in selected and len(selected) == 3
+    assert stats.tokens <= 30 and stats.candidates == 6 and stats.kept == 3
+    assert stats.dropped_for_budget == 1
+
+    unlimited, stats = build_context("withdraw", [big, *small], max_chunks=10, token_budget=0)
+    assert len(unlimited) == 6 and stats.tokens == sum(estimate_tokens(r["content"]) for r in [big, *small])
+
+
+def test_gather_context_overfetches_then_trims(monkeypatch):
+    calls = []
+
+    def fake_retrieve(question, k, filters=None):
+        calls.append(k)
+        return [1.0], [{"content": f"c{i} withdraw", "similarity": 1 - i / 100} for i in range(k)]
+
+    monkeypatch.setattr(rag_audit_api, "retrieve", fake_retrieve)
+    monkeypatch.setattr(rag_audit_api, "CONTEXT_OVERFETCH", 4)
+    monkeypatch.setattr(rag_audit_api, "CONTEXT_TOKEN_BUDGET", 1000)
+    _, matches, stats = rag_audit_api.gather_context("withdraw?", 3)
+    assert calls == [12]
+    assert len(matches) == 3 and stats["candidates"] == 12 and stats["kept"] == 3
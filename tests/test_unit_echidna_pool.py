@@ -0,0 +1,127 @@
+"""Echidna 容器池单元测试（LocalWorker 作为容器替身）"""
+import asyncio
+import json
+import sys
+
+import rag_audit_api
+from echidna_pool import EchidnaPool, LocalWorker
+
+# 假 echidna：读取任务目录中的源码，输出 JSON 报告
+FAKE_ECHIDNA = (
+    "import json, os, sys; src = [a for a in sys.argv if a.endswith('.sol')][0];"
+    "print(json.dumps({'fails': [], 'file': src, 'exists': os.path.exists(src)}))"
+)
+
+
+def make_pool(root, **kw):
+    workers = []
+
+    def factory():
+        w = LocalWorker(root, prefix=[sys.executable, "-c", FAKE_ECHIDNA])
+        workers.append(w)
+        return w
+
+    return EchidnaPool(factory, root, **kw), workers
+
+
+def test_pool_reuses_workers_and_uses_job_dirs(tmp_path):
+    pool, workers = make_pool(tmp_path, max_size=2)
+
+    async def go():
+        outs = []
+        for _ in range(5):
+            name, path = pool.job_dir()
+            (path / "A.sol").write_text("contract A {}")
+            _, out, _ = await pool.run(["A.sol"], name, timeout=30)
+            outs.append(json.loads(out))
+        return outs
+
+    outs = asyncio.run(go())
+    assert all(o["exists"] for o in outs)
+    assert len(workers) == 1                      # 串行任务复用同一成员
+    assert pool.stats()["jobs"] == 5
+
+
+def test_pool_bounds_size_and_recycles(tmp_path):
+    pool, workers = make_pool(tmp_path, max_size=2, max_jobs_per_worker=3)
+
+    async def go():
+        async def one():
+            name, _ = pool.job_dir()
+            return await pool.run(["x.sol"], name, timeout=30)
+
+        await asyncio.gather(*(one() for _ in range(8)))
+
+    asyncio.run(go())
+    stats = pool.stats()
+    assert stats["size"] <= 2
+    assert stats["recycled"] >= 2                 # 满 3 个任务即回收
+    assert all(w.jobs_done <= 3 for w in workers)
+
+
+def test_pool_discards_unhealthy_and_broken_workers(tmp_path):
+    pool, workers = make_pool(tmp_path, max_size=1, health_check_interval=0)
+
+    async def go():
+        name, _ = pool.job_dir()
+        await pool.run(["x.sol"], name, timeout=30)
+        workers[0].stopped = True                 # 模拟容器退出
+        await pool.run(["x.sol"], name, timeout=30)
+        try:
+            await pool.run([], name, timeout=0.0001)  # 超时：成员被销毁
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(go())
+    assert pool.stats()["unhealthy"] == 1
+    assert pool.stats()["size"] == 0
+    assert len(workers) == 2                      # 不健康的成员被替换，超时的成员被销毁
+
+
+def test_health_check_runs_outside_pool_lock(tmp_path):
+    pool, workers = make_pool(tmp_path, max_size=2, health_check_interval=0)
+
+    async def go():
+        name, _ = pool.job_dir()
+        await pool.run(["x.sol"], name, timeout=30)
+        checking, release = asyncio.Event(), asyncio.Event()
+
+        async def slow_healthy():
+            checking.set()
+            await release.wait()
+            return True
+
+        workers[0].healthy = slow_healthy
+        first = asyncio.create_task(pool.run(["x.sol"], name, timeout=30))
+        await checking.wait()
+        # 空闲成员检查期间，其他任务不必等锁：直接新建成员执行
+        await asyncio.wait_for(pool.run(["x.sol"], name, timeout=30), 5)
+        release.set()
+        await first
+
+    asyncio.run(go())
+    assert len(workers) == 2 and pool.stats()["jobs"] == 3 and pool.stats()["size"] == 2
+
+
+def test_run_echidna_uses_pool(monkeypatch, tmp_path):
+    pool, _ = make_pool(tmp_path / "pool")
+    monkeypatch.setattr(rag_audit_api, "echidna_pool", pool)
+    sol = tmp_path / "Vault.sol"
+    sol.write_text("contract Vault {}")
+
+    report = asyncio.run(rag_audit_api.run_echidna(sol, "Vault"))
+    assert report["fails"] == [] and report["exists"]
+    assert list((tmp_path / "pool").iterdir()) == []   # 任务目录已清理
+
+
+def test_run_echidna_copies_source_tree(monkeypatch, tmp_path):
+    pool, _ = make_pool(tmp_path / "pool")
+    monkeypatch.setattr(rag_audit_api, "echidna_pool", pool)
+    tree = tmp_path / "src"
+    (tree / "contracts").mkdir(parents=True)
+    (tree / "contracts" / "Vault.sol").write_text('import "../lib/Lib.sol"; contract Vault {}')
+    (tree / "lib").mkdir()
+    (tree / "lib" / "Lib.sol").write_text("library Lib {}")
+
+    report = asyncio.run(rag_audit_api.run_echidna(tree / "contracts" / "Vault.sol", "Vault", tree))
+    assert report["file"] == "contracts/Vault.sol" and report["exists"]
@@ -0,0 +1,52 @@
+"""向量缓存单元测试"""
+from embed_cache import EmbeddingCache, cache_key
+
+
+def test_cache_key_depends_on_model_task_and_text():
+    base = cache_key("m1", "retrieval_document", "hello")
+    assert base != cache_key("m2", "retrieval_document", "hello")
+    assert base != cache_key("m1", "retrieval_query", "hello")
+    assert base != cache_key("m1", "retrieval_document", "hello!")
+
+
+def test_memory_lru_eviction_and_counters():
+    cache = EmbeddingCache("m", max_memory_items=2)
+    cache.put("a", [1.0], "t")
+    cache.put("b", [2.0], "t")
+    assert cache.get("a", "t") == [1.0]      # a 变为最近使用
+    cache.put("c", [3.0], "t")               # 淘汰 b
+    assert cache.get("b", "t") is None
+    assert cache.get_many(["a", "c"], "t") == [[1.0], [3.0]]
+    stats = cache.stats()
+    assert stats["memory_hits"] == 3 and stats["misses"] == 1
+
+
+def test_disk_layer_survives_restart(tmp_path):
+    db = tmp_path / "emb.sqlite3"
+    cache = EmbeddingCache("m", path=db)
+    cache.put_many(["x", "y"], [[0.5, 0.25], [1.5, -2.0]], "t")
+    cache.close()
+
+    reopened = EmbeddingCache("m", path=db)
+    assert reopened.get_many(["y", "x", "z"], "t") == [[1.5, -2.0], [0.5, 0.25], None]
+    assert reopened.stats()["disk_hits"] == 2
+
+
+def test_purge_other_models(tmp_path):
+    db = tmp_path / "emb.sqlite3"
+    old = EmbeddingCache("old-model", path=db)
+    old.put("x", [1.0], "t")
+    old.close()
+
+    new = EmbeddingCache("new-model", path=db)
+    assert new.get("x", "t") is None
+    assert new.purge_other_models() == 1
+    assert new.stats()["disk_items"] == 0
+
+
+def test_disk_size_limit(tmp_path):
+    cache = EmbeddingCache("m", path=tmp_path / "emb.sqlite3", max_memory_items=1, max_disk_items=5)
+    for i in range(20):
+        cache.put(str(i), [float(i)], "t")
+    assert cache.stats()["disk_items"] <= 5
+    assert cache.get("19", "t") == [19.0]
@@ -0,0 +1,52 @@
+"""批量向量化流水线单元测试（本地假 embedder，不访问 Gemini）"""
+import threading
+import time
+
+import pytest
+
+from embed_pipeline import embed_in_batches, make_batches
+
+
+def fake_embed_batch(texts):
+    return [[float(len(t)), float(i)] for i, t in enumerate(texts)]
+
+
+def test_make_batches_sizes():
+    batches = list(make_batches([str(i) for i in range(10)], 4))
+    assert [len(b) for b in batches] == [4, 4, 2]
+
+
+def test_embed_in_batches_keeps_order():
+    texts = ["x" * n for n in range(1, 50)]
+
+    def slow_reversed(texts):
+        # 越靠前的批次越慢，验证乱序完成时仍按输入顺序返回
+        time.sleep(0.001 * (60 - len(texts[0])) / 10)
+        return [[float(len(t))] for t in texts]
+
+    vectors = embed_in_batches(texts, slow_reversed, batch_size=7, max_concurrency=4)
+    assert [v[0] for v in vectors] == [float(len(t)) for t in texts]
+
+
+def test_embed_in_batches_bounded_concurrency():
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def tracking(texts):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight -= 1
+        return fake_embed_batch(texts)
+
+    embed_in_batches([str(i) for i in range(100)], tracking, batch_size=5, max_concurrency=3)
+    assert 1 < peak <= 3
+
+
+def test_embed_in_batches_rejects_size_mismatch():
+    with pytest.raises(RuntimeError):
+        embed_in_batches(["a", "b"], lambda texts: [[0.0]], batch_size=2)
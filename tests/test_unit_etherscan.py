@@ -0,0 +1,122 @@
+"""Etherscan 客户端单元测试（假 Session，不访问网络）"""
+import json
+import time
+
+import pytest
+
+from etherscan import ContractSource, EtherscanClient, SourceCache, TokenBucket, chain_id, parse_source_code
+
+STANDARD_JSON = {
+    "language": "Solidity",
+    "sources": {
+        "contracts/Vault.sol": {"content": 'import "@oz/Ownable.sol";\ncontract Vault is Ownable {}'},
+        "@oz/Ownable.sol": {"content": "abstract contract Ownable {}"},
+        "../../evil.sol": {"content": "contract Evil {}"},
+    },
+    "settings": {"remappings": ["@oz/=lib/oz/"]},
+}
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    def __init__(self, *bodies):
+        self.bodies = list(bodies)
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None):
+        self.calls.append(params)
+        return FakeResponse(self.bodies.pop(0))
+
+
+def ok(source_code, name="Vault"):
+    return {"status": "1", "result": [{"SourceCode": source_code, "ContractName": name, "CompilerVersion": "v0.8.20"}]}
+
+
+def test_chain_id_accepts_names_and_numbers():
+    assert chain_id("Ethereum") == 1
+    assert chain_id("bsc") == 56
+    assert chain_id("8453") == 8453
+    assert chain_id(137) == 137
+    with pytest.raises(ValueError):
+        chain_id("nope")
+
+
+def test_parse_single_file():
+    files, main, remaps = parse_source_code("contract Vault {}", "Vault")
+    assert files == {"Vault.sol": "contract Vault {}"} and main == "Vault.sol" and remaps == []
+
+
+def test_parse_standard_json_double_braces_and_safe_paths():
+    raw = "{" + json.dumps(STANDARD_JSON) + "}"
+    files, main, remaps = parse_source_code(raw, "Vault")
+    assert set(files) == {"contracts/Vault.sol", "@oz/Ownable.sol", "evil.sol"}  # 不允许逃出根目录
+    assert main == "contracts/Vault.sol"
+    assert remaps == ["@oz/=lib/oz/"]
+
+
+def test_parse_legacy_multi_file_picks_declaring_file():
+    raw = json.dumps({"A.sol": {"content": "contract VaultBase {}"}, "B.sol": {"content": "contract Vault {}"}})
+    _, main, _ = parse_source_code(raw, "Vault")
+    assert main == "B.sol"
+
+
+def test_parse_unverified_raises():
+    with pytest.raises(RuntimeError):
+        parse_source_code("", "", "0xabc")
+
+
+def test_write_tree(tmp_path):
+    files, main, _ = parse_source_code(json.dumps(STANDARD_JSON), "Vault")
+    src = ContractSource("0xabc", 1, "Vault", files, main)
+    path = src.write_tree(tmp_path)
+    assert path == tmp_path / "contracts" / "Vault.sol" and path.exists()
+    assert (tmp_path / "@oz" / "Ownable.sol").read_text() == "abstract contract Ownable {}"
+
+
+def test_fetch_caches_per_chain_and_address(tmp_path):
+    session = FakeSession(ok("contract Vault {}"), ok("contract Vault {} // bsc"))
+    client = EtherscanClient("key", cache=SourceCache(tmp_path / "src.sqlite3"), rate=0, session=session)
+
+    first = client.fetch("0xAbC", "ethereum")
+    assert client.fetch("0xabc", 1).files == first.files           # 同链同地址（大小写无关）命中缓存
+    assert client.fetch("0xabc", "bsc").files["Vault.sol"].endswith("// bsc")
+    assert [c["chainid"] for c in session.calls] == [1, 56]
+
+    # 新进程（新客户端）从磁盘缓存读取，不发请求
+    reopened = EtherscanClient("key", cache=SourceCache(tmp_path / "src.sqlite3"), rate=0, session=FakeSession())
+    assert reopened.fetch("0xabc").contract_name == "Vault"
+    assert reopened.stats()["requests"] == 0
+
+
+def test_fetch_retries_on_rate_limit(monkeypatch):
+    monkeypatch.setattr(time, "sleep", lambda s: None)
+    session = FakeSession({"status": "0", "result": "Max rate limit reached"}, ok("contract Vault {}"))
+    client = EtherscanClient("key", rate=0, session=session)
+    assert client.fetch("0x1").main_file == "Vault.sol"
+    assert len(session.calls) == 2
+
+
+def test_fetch_error_and_missing_key():
+    client = EtherscanClient("key", rate=0, session=FakeSession({"status": "0", "result": "Invalid address"}))
+    with pytest.raises(RuntimeError, match="Invalid address"):
+        client.fetch("0x1")
+    with pytest.raises(RuntimeError, match="ETHERSCAN_API_KEY"):
+        EtherscanClient(None, session=FakeSession()).fetch("0x1")
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09  # 首个令牌立即可用，其余 5 个各约 20ms
@@ -0,0 +1,94 @@
+"""有界线程池与请求路径并发单元测试（mock 检索与 Gemini）"""
+import asyncio
+import threading
+import time
+import types
+
+import httpx
+import pytest
+
+import rag_audit_api
+from executors import BoundedExecutor, ExecutorBusy
+
+
+def test_bounded_executor_limits_workers_and_rejects_overflow():
+    pool = BoundedExecutor("t", workers=2, max_pending=3)
+    gate = threading.Event()
+    running, peak = 0, 0
+    lock = threading.Lock()
+
+    def work(i):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        gate.wait(2)
+        with lock:
+            running -= 1
+        return i
+
+    futures = [pool.submit(work, i) for i in range(3)]
+    with pytest.raises(ExecutorBusy):
+        pool.submit(work, 3)
+    gate.set()
+    assert [f.result(2) for f in futures] == [0, 1, 2]
+    assert peak == 2
+    assert pool.stats() == {"workers": 2, "max_pending": 3, "pending": 0, "completed": 3, "rejected": 1}
+    pool.shutdown()
+
+
+def test_run_does_not_block_event_loop():
+    pool = BoundedExecutor("t", workers=1)
+
+    async def go():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            for _ in range(5):
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        result, _ = await asyncio.gather(pool.run(lambda s: time.sleep(s) or "done", 0.1), ticker())
+        return result, ticks
+
+    assert asyncio.run(go()) == ("done", 5)
+    pool.shutdown()
+
+
+@pytest.fixture
+def blocked_ask(monkeypatch):
+    """检索阻塞在同步调用里，直到测试放行"""
+    release = threading.Event()
+
+    def slow_retrieve(q, k, filters=None):
+        release.wait(5)
+        return None, [{"doc_id": "Vault", "content": "reentrancy in withdraw()", "similarity": 0.9}]
+
+    monkeypatch.setattr(rag_audit_api, "retrieve", slow_retrieve)
+    monkeypatch.setattr(rag_audit_api, "genai", types.SimpleNamespace(
+        GenerativeModel=lambda name: types.SimpleNamespace(
+            generate_content=lambda prompt: types.SimpleNamespace(text="有重入风险"))
+    ))
+    monkeypatch.setattr(rag_audit_api, "data_executor", BoundedExecutor("data", workers=2, max_pending=2))
+    return release
+
+
+def test_health_answers_while_ask_is_blocked(blocked_ask):
+    async def go():
+        transport = httpx.ASGITransport(app=rag_audit_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as client:
+            asks = [asyncio.create_task(client.post("/ask", json={"question": f"q{i}"})) for i in range(2)]
+            await asyncio.sleep(0.05)
+            start = time.perf_counter()
+            health = await client.get("/health")
+            elapsed = time.perf_counter() - start
+            busy = await client.post("/ask", json={"question": "q3"})  # 在途已满
+            blocked_ask.set()
+            return health, elapsed, busy, await asyncio.gather(*asks)
+
+    health, elapsed, busy, answers = asyncio.run(go())
+    assert health.status_code == 200 and elapsed < 0.5
+    assert busy.status_code == 503
+    assert [a.json()["answer"] for a in answers] == ["有重入风险", "有重入风险"]
+    assert rag_audit_api.data_executor.stats()["rejected"] == 1
@@ -0,0 +1,166 @@
+"""入库前发现去重单元测试"""
+import io
+import json
+
+from fastapi.testclient import TestClient
+
+import rag_audit_api
+from lexical_index import BM25Index
+from finding_dedup import FindingDeduper, diff_findings, normalize
+from vector_store import LocalVectorStore
+
+
+def naming(i, name=None):
+    name = name or f"_value{i}"
+    return {
+        "check": "naming-convention",
+        "impact": "Informational",
+        "description": f"Parameter Token.transfer(address,uint256).{name} (src/Token.sol#{10 + i}) is not in mixedCase",
+        "elements": [{"name": name}],
+    }
+
+
+def test_normalize_masks_elements_locations_and_numbers():
+    a = normalize("Parameter Foo.bar(uint256)._x (a.sol#12-14) is not in mixedCase", ["_x"])
+    b = normalize("Parameter Foo.bar(uint256)._yy (a.sol#99) is not in mixedCase", ["_yy"])
+    assert a == b
+    assert "_x" not in a and "<loc>" in a
+
+
+def test_exact_and_near_duplicates_grouped_within_scope():
+    d = FindingDeduper(threshold=0.8)
+    d.add("s:naming", "Parameter Foo._a (a.sol#1) is not in mixedCase", ["_a"])
+    d.add("s:naming", "Parameter Foo._b (a.sol#2) is not in mixedCase", ["_b"])           # 精确（归一化后）
+    d.add("s:naming", "Parameter Foo._c (a.sol#3) is not in mixedCase style", ["_c"])     # 近似
+    d.add("s:other", "Parameter Foo._d (a.sol#4) is not in mixedCase", ["_d"])            # 不同 scope
+    d.add("s:naming", "Reentrancy in Vault.withdraw() (v.sol#5) external call before state write", ["withdraw"])
+    groups = d.drain()
+    assert [g.count for g in groups] == [3, 1, 1]
+    assert groups[0].elements == ["_a", "_b", "_c"]
+    assert d.stats()["exact_duplicates"] == 1 and d.stats()["near_duplicates"] == 1
+    assert len(d) == 0
+
+
+def test_group_chunk_lists_count_and_capped_elements():
+    d = FindingDeduper(max_elements=2)
+    for name in ["_a", "_b", "_c", "_d"]:
+        d.add("s", f"Parameter {name} is not in mixedCase", [name])
+    (group,) = d.drain()
+    assert group.chunk() == (
+        "Parameter _a is not in mixedCase | 相似发现:4 处 | 涉及元素:_a, _b 等另 2 个"
+    )
+    single = FindingDeduper()
+    single.add("s", "only once", [])
+    assert single.drain()[0].chunk() == "only once"
+
+
+def test_dedup_findings_shrinks_embedding_input():
+    items = [("slither", naming(i)) for i in range(300)]
+    items.append(("slither", {"check": "reentrancy-eth", "impact": "High",
+                              "description": "Reentrancy in Vault.withdraw()", "elements": [{"name": "withdraw"}]}))
+    items.append(("echidna", {"property": "echidna_balance", "trace": ["deposit()"]}))
+    groups = rag_audit_api.dedup_findings(items)
+    assert len(groups) == 3
+    chunk = groups[0].chunk()
+    assert "相似发现:300 处" in chunk and "_value0, _value1" in chunk
+    assert groups[0].meta["detector"] == "naming-convention" and groups[2].meta["tool"] == "echidna"
+
+
+def test_fingerprints_without_dedup_do_not_depend_on_order(monkeypatch):
+    monkeypatch.setattr(rag_audit_api, "DEDUP_FINDINGS", False)
+    items = [("slither", naming(1)), ("slither", naming(2)), ("slither", naming(2))]
+    keys = [g.key for g in rag_audit_api.dedup_findings(items)]
+    assert len(set(keys)) == 3  # 完全相同的两条按出现次序区分
+
+    # 前面多出一条发现：已有发现的指纹不变
+    again = [g.key for g in rag_audit_api.dedup_findings([("slither", naming(0))] + items)]
+    assert again[1:] == keys
+
+
+def test_ingest_inserts_one_chunk_per_group(monkeypatch):
+    inserted = []
+    monkeypatch.setattr(rag_audit_api, "insert_chunks", lambda doc_id, chunks, metadata=None: inserted.extend(chunks) or len(chunks))
+    monkeypatch.setattr(rag_audit_api, "vector_store", LocalVectorStore(4))
+    report = {"results": {"detectors": [naming(i) for i in range(120)]}, "slitherVersion": "0.10.0"}
+    client = TestClient(rag_audit_api.app)
+    resp = client.post("/ingest", files=[("files", ("s.json", io.BytesIO(json.dumps(report).encode()), "application/json"))])
+    assert resp.json() == {"files": 1, "chunks_inserted": 1}
+    assert "相似发现:120 处" in inserted[0]
+
+
+def test_fingerprint_is_stable_and_diff_classifies_rows():
+    d = FindingDeduper()
+    a = d.add("s:naming", "Parameter Foo._a (a.sol#1) is not in mixedCase", ["_a"])
+    b = d.add("s:reentrancy", "Reentrancy in Vault.withdraw() (v.sol#5)", ["withdraw"])
+    again = FindingDeduper().add("s:naming", "Parameter Foo._z (a.sol#40) is not in mixedCase", ["_z"])
+    assert a.key == again.key and a.key != b.key  # 行号、元素名变化不影响指纹
+
+    stored = [
+        {"fingerprint": a.key, "content": "old chunk"},
+        {"fingerprint": "gone", "content": "fixed finding"},
+        {"fingerprint": None, "content": "row from before fingerprints"},
+    ]
+    diff = diff_findings(stored, [a, b])
+    assert diff.new == [b] and diff.changed == [a] and diff.unchanged == 0
+    assert diff.stale == ["gone", None]
+    assert diff_findings([{"fingerprint": a.key, "content": a.chunk()}], [a]).unchanged == 1
+    dup = diff_findings([{"fingerprint": b.key, "content": b.chunk()}] * 2, [b])
+    assert dup.new == [b] and dup.stale == [b.key]  # 重复行全部删除后重新入库
+
+
+def test_reanalysis_embeds_only_new_findings(monkeypatch):
+    embedded = []
+    monkeypatch.setattr(rag_audit_api, "vector_store", LocalVectorStore(4))
+    monkeypatch.setattr(rag_audit_api, "lexical_index", BM25Index())
+    monkeypatch.setattr(rag_audit_api, "embed_in_batches",
+                        lambda chunks, *a, **kw: embedded.extend(chunks) or [[1.0, 0, 0, 0] for _ in chunks])
+    reentrancy = {"check": "reentrancy-eth", "impact": "High",
+                  "description": "Reentrancy in Vault.withdraw()", "elements": [{"name": "withdraw"}]}
+    tx_origin = {"check": "tx-origin", "impact": "Medium",
+                 "description": "Vault.auth() uses tx.origin", "elements": [{"name": "auth"}]}
+
+    first = rag_audit_api.dedup_findings([("slither", naming(0)), ("slither", reentrancy)])
+    assert rag_audit_api.upsert_groups("Vault", first) == 2
+
+    # 修复重入后重新分析：命名问题多了一处（只更新文本），新增 tx-origin
+    embedded.clear()
+    second = rag_audit_api.dedup_findings([("slither", naming(0)), ("slither", naming(1)), ("slither", tx_origin)])
+    assert rag_audit_api.upsert_groups("Vault", second) == 1
+    assert embedded == [second[1].chunk()]
+
+    store = rag_audit_api.vector_store
+    assert sorted(r["content"] for r in store.scan()) == sorted(g.chunk() for g in second)
+    assert rag_audit_api.lexical_index.search("reentrancy", 5) == []
+    assert "相似发现:2 处" in rag_audit_api.lexical_index.search("mixedCase", 1)[0]["content"]
+
+    embedded.clear()
+    assert rag_audit_api.upsert_groups("Vault", second) == 0 and embedded == []
+
+
+def test_repeated_ingest_is_idempotent_across_batches(monkeypatch):
+    embedded = []
+    monkeypatch.setattr(rag_audit_api, "INGEST_READ_SIZE", 64)
+    monkeypatch.setattr(rag_audit_api, "INGEST_BATCH_SIZE", 3)
+    monkeypatch.setattr(rag_audit_api, "vector_store", LocalVectorStore(4))
+    monkeypatch.setattr(rag_audit_api, "lexical_index", BM25Index())
+    monkeypatch.setattr(rag_audit_api, "embed_in_batches",
+                        lambda chunks, *a, **kw: embedded.extend(chunks) or [[1.0, 0, 0, 0] for _ in chunks])
+    detector = lambda check, name: {"check": check, "impact": "High", "elements": [{"name": name}],
+                                    "description": f"{check} found in Vault.{name}()"}
+    # 每 3 组一批：a、b 在第二批中再次出现
+    report = {"results": {"detectors": [detector("a", "x1"), detector("b", "x2"), detector("c", "x3"),
+                                        detector("a", "y1"), detector("b", "y2"), detector("d", "x4")]}}
+    client = TestClient(rag_audit_api.app)
+
+    def ingest():
+        embedded.clear()
+        raw = io.BytesIO(json.dumps(report).encode())
+        assert client.post("/ingest", files=[("files", ("Vault.json", raw, "application/json"))]).status_code == 200
+        return sorted(r["content"] for r in rag_audit_api.vector_store.scan())
+
+    first = ingest()
+    assert len(first) == 4 and len(embedded) == 4
+    assert any("a found" in c and "相似发现:2 处" in c and "x1, y1" in c for c in first)
+    for _ in range(2):
+        assert ingest() == first and embedded == []
+    assert len(rag_audit_api.lexical_index.search("found", 10)) == 4
@@ -0,0 +1,273 @@
+"""Gemini 调用层单元测试（自适应限流 / 熔断 / 重试队列，不访问 Gemini）"""
+import asyncio
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import rag_audit_api
+from embed_cache import EmbeddingCache
+from gemini_client import (
+    FATAL,
+    RATE_LIMITED,
+    TRANSIENT,
+    AdaptiveLimiter,
+    CircuitBreaker,
+    CircuitOpenError,
+    GeminiClient,
+    RetryQueue,
+    classify_error,
+    service_answered,
+)
+from lexical_index import BM25Index
+from vector_store import LocalVectorStore
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+def test_classify_error():
+    assert classify_error(ResourceExhausted("Quota exceeded")) == RATE_LIMITED
+    assert classify_error(RuntimeError("429 Too Many Requests")) == RATE_LIMITED
+    assert classify_error(RuntimeError("504 Deadline Exceeded")) == TRANSIENT
+    assert classify_error(ConnectionError("reset by peer")) == TRANSIENT
+    assert classify_error(ValueError("400 API key not valid")) == FATAL
+
+
+def test_limiter_halves_on_rate_limit_and_recovers():
+    limiter = AdaptiveLimiter(initial=8, max_limit=8, cooldown=60)
+    limiter.on_rate_limit()
+    limiter.on_rate_limit()  # 同一冷却窗口内只减一次
+    assert limiter.limit == 4 and limiter.rate_limited == 2
+    for _ in range(20):
+        limiter.on_success()
+    assert 4 < limiter.limit <= 8
+
+
+def test_limiter_bounds_thread_concurrency():
+    limiter = AdaptiveLimiter(initial=3, max_limit=3)
+    running, peak = 0, 0
+    lock = threading.Lock()
+
+    def work():
+        nonlocal running, peak
+        with limiter.slot():
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.01)
+            with lock:
+                running -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak == 3 and limiter.inflight == 0
+
+
+def test_async_waiters_do_not_block_event_loop():
+    limiter = AdaptiveLimiter(initial=1, max_limit=1)
+    limiter.acquire()  # 名额被工作线程占用
+
+    async def go():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        tick = asyncio.create_task(ticker())
+        waiter = asyncio.create_task(limiter.acquire_async())
+        cancelled = asyncio.create_task(limiter.acquire_async())
+        await asyncio.sleep(0.05)
+        assert not waiter.done() and ticks > 3
+        cancelled.cancel()
+        threading.Timer(0.01, limiter.release).start()
+        await asyncio.wait_for(waiter, 1)
+        tick.cancel()
+        limiter.release()
+
+    asyncio.run(go())
+    assert limiter.inflight == 0
+
+
+def test_circuit_breaker_opens_fails_fast_and_probes():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+    breaker.before_call()
+    breaker.on_failure()
+    breaker.on_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    now[0] = 11
+    breaker.before_call()  # 半开：放行一个探测
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.on_failure()  # 探测失败重新打开
+    assert breaker.state == CircuitBreaker.OPEN
+
+    now[0] = 22
+    breaker.before_call()
+    breaker.on_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.rejected == 2
+
+
+def test_client_retries_rate_limits_and_not_fatal_errors():
+    errors = []
+    client = GeminiClient(base_delay=0, on_error=lambda op, kind, retry: errors.append((op, kind, retry)))
+    outcomes = [ResourceExhausted("429"), "ok"]
+
+    def flaky():
+        out = outcomes.pop(0)
+        if isinstance(out, Exception):
+            raise out
+        return out
+
+    assert client.call("batch", flaky) == "ok"
+    assert errors == [("batch", RATE_LIMITED, True)] and client.limiter.rate_limited == 1
+
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise ValueError("400 invalid argument")
+
+    with pytest.raises(ValueError):
+        client.call("query", bad_request)
+    assert len(calls) == 1  # 参数错误不重试
+
+
+def test_client_opens_circuit_after_transient_failures():
+    client = GeminiClient(breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60), max_retries=3, base_delay=0)
+    calls = []
+
+    def down():
+        calls.append(1)
+        raise RuntimeError("503 Service Unavailable")
+
+    with pytest.raises(RuntimeError, match="503"):
+        client.call("query", down)
+    assert len(calls) == 3 and client.stats()["circuit"] == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        client.call("query", down)
+    assert len(calls) == 3  # 熔断期间不再访问 API
+
+
+def test_only_service_answers_reset_the_circuit():
+    assert service_answered(ValueError("400 API key not valid"))
+    assert service_answered(types.SimpleNamespace(code=404)) and not service_answered(KeyError("400"))
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    client = GeminiClient(breaker=breaker, max_retries=1, base_delay=0)
+
+    def down():
+        raise RuntimeError("503 Service Unavailable")
+
+    def bug():
+        return {}["embedding"]
+
+    def bad_request():
+        raise ValueError("400 invalid argument")
+
+    with pytest.raises(RuntimeError):
+        client.call("query", down)
+    with pytest.raises(KeyError):
+        client.call("query", bug)  # 程序错误：不清零失败计数
+    with pytest.raises(RuntimeError):
+        client.call("query", down)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    breaker = client.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    with pytest.raises(RuntimeError):
+        client.call("query", down)
+    with pytest.raises(ValueError):
+        client.call("query", bad_request)  # 服务有应答：视为可用
+    with pytest.raises(RuntimeError):
+        client.call("query", down)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_call_async_backs_off_without_blocking_loop():
+    client = GeminiClient(base_delay=0.05)
+    outcomes = [RuntimeError("504 Deadline Exceeded"), "answer"]
+
+    def flaky():
+        out = outcomes.pop(0)
+        if isinstance(out, Exception):
+            raise out
+        return out
+
+    async def go():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            for _ in range(10):
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        result, _ = await asyncio.gather(client.call_async("generate", flaky), ticker())
+        return result, ticks
+
+    assert asyncio.run(go()) == ("answer", 10)
+
+
+def test_async_call_not_starved_by_sync_waiters_in_shared_pool():
+    # 共享线程池只有一个线程且被等待名额的同步调用占用时，持有名额的协程仍能执行
+    client = GeminiClient(limiter=AdaptiveLimiter(initial=1, max_limit=1))
+
+    async def go():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        client.limiter.acquire()
+        holder = asyncio.create_task(client.call_async("generate", lambda: "async"))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(asyncio.to_thread(client.call, "query", lambda: "sync"))
+        await asyncio.sleep(0.01)
+        client.limiter.release()
+        return await asyncio.wait_for(asyncio.gather(holder, waiter), 2)
+
+    assert asyncio.run(go()) == ["async", "sync"]
+
+
+def test_retry_queue_dedups_and_drops_oldest():
+    q = RetryQueue(max_items=2)
+    q.put("a", 1)
+    q.put("b", 2)
+    q.put("a", 3)  # 同 key 替换并移到队尾
+    q.put("c", 4)
+    assert q.stats() == {"pending": 2, "dropped": 1}
+    assert q.take(10) == [3, 4] and len(q) == 0
+
+
+def test_failed_embeddings_are_queued_then_inserted(monkeypatch):
+    up = {"ok": False}
+
+    def embed_content(model, content, task_type):
+        if not up["ok"]:
+            raise RuntimeError("503 Service Unavailable")
+        return {"embedding": [[1.0, 0.0, 0.0, 0.0] for _ in content]}
+
+    monkeypatch.setattr(rag_audit_api, "genai", types.SimpleNamespace(embed_content=embed_content))
+    monkeypatch.setattr(rag_audit_api, "gemini", GeminiClient(base_delay=0))
+    monkeypatch.setattr(rag_audit_api, "embed_retry", RetryQueue())
+    monkeypatch.setattr(rag_audit_api, "embed_cache", EmbeddingCache(rag_audit_api.EMBED_MODEL))  # 仅内存
+    monkeypatch.setattr(rag_audit_api, "vector_store", LocalVectorStore(4))
+    monkeypatch.setattr(rag_audit_api, "lexical_index", BM25Index())
+
+    chunks = ["reentrancy in withdraw", "tx-origin in transfer"]
+    assert rag_audit_api.insert_chunks("Vault", chunks, [{"fingerprint": "r"}, {"fingerprint": "t"}]) == 0
+    assert len(rag_audit_api.embed_retry) == 2
+
+    rag_audit_api.delete_findings("Vault", ["t"])  # 重新分析后已消失的发现不再补入库
+    up["ok"] = True
+    assert rag_audit_api.retry_pending_embeddings() == 1
+    assert [r["content"] for r in rag_audit_api.vector_store.scan()] == chunks[:1]
+    assert len(rag_audit_api.embed_retry) == 0
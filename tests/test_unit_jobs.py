@@ -0,0 +1,244 @@
+"""后台分析任务单元测试（mock Slither/Echidna/入库）"""
+import asyncio
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import jobs
+import rag_audit_api
+from analysis_cache import AnalysisCache, analysis_key
+from vector_store import LocalVectorStore
+
+
+def wait_until(pred, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if pred():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_job_manager_runs_stages_and_records_timings():
+    manager = jobs.JobManager(workers=1)
+
+    async def work(job):
+        with job.stage("a"):
+            await asyncio.sleep(0.01)
+        with job.stage("b"):
+            pass
+        return 42
+
+    job = manager.submit("doc", ["a", "b"], work)
+    assert wait_until(lambda: job.status == jobs.COMPLETED)
+    status = job.to_status()
+    assert status["progress"] == 100
+    assert [s["status"] for s in status["stages"]] == ["completed", "completed"]
+    assert status["stages"][0]["duration"] >= 0.01
+    assert job.result == 42
+
+
+def test_job_manager_cancel_and_failure():
+    manager = jobs.JobManager(workers=1)
+    torn_down = []
+
+    async def slow(job):
+        try:
+            with job.stage("a"):
+                await asyncio.sleep(10)
+        finally:
+            await asyncio.sleep(0.2)  # 如等待被终止的子进程退出
+            torn_down.append(job.status)
+
+    async def boom(job):
+        raise RuntimeError("boom")
+
+    job = manager.submit("slow", ["a"], slow)
+    assert wait_until(lambda: job.status == jobs.RUNNING)
+    with pytest.raises(jobs.JobRunning):
+        manager.submit("slow", ["a"], slow)
+    assert manager.cancel("slow")
+    # 清理完成前仍是 cancelling，同 id 的新提交继续被拒绝
+    assert job.status == jobs.CANCELLING
+    with pytest.raises(jobs.JobRunning):
+        manager.submit("slow", ["a"], slow)
+    assert wait_until(lambda: job.finished_at is not None)
+    assert job.status == jobs.CANCELLED and torn_down == [jobs.CANCELLING]
+
+    queued = [manager.submit(f"q{i}", ["a"], slow) for i in range(2)]
+    assert manager.cancel("q1")  # 排队中（等待并发名额）被取消
+    assert wait_until(lambda: queued[1].status == jobs.CANCELLED)
+    assert manager.cancel("q0")
+    assert wait_until(lambda: queued[0].status == jobs.CANCELLED)
+
+    failed = manager.submit("boom", [], boom)
+    assert wait_until(lambda: failed.status == jobs.FAILED)
+    assert failed.message == "boom"
+    assert not manager.cancel("boom")
+
+
+@pytest.fixture
+def api(monkeypatch):
+    async def fake_slither(path, root=None, remappings=None):
+        await asyncio.sleep(0.2)
+        return {"results": {"detectors": [{"impact": "High", "description": "reentrancy", "elements": []}]}}
+
+    async def fake_echidna(path, name, root=None):
+        await asyncio.sleep(0.2)
+        return {"fails": []}
+
+    monkeypatch.setattr(rag_audit_api, "run_slither", fake_slither)
+    monkeypatch.setattr(rag_audit_api, "run_echidna", fake_echidna)
+    inserted = []
+    monkeypatch.setattr(rag_audit_api, "insert_chunks",
+                        lambda doc_id, chunks, metadata=None: inserted.append((doc_id, chunks)) or len(chunks))
+    monkeypatch.setattr(rag_audit_api, "vector_store", LocalVectorStore(4))
+    monkeypatch.setattr(rag_audit_api, "job_manager", jobs.JobManager(workers=2))
+    monkeypatch.setattr(rag_audit_api, "CODE_INDEX", False)  # 代码索引另有测试
+    monkeypatch.setattr(rag_audit_api, "analysis_cache", AnalysisCache())
+    monkeypatch.setattr(rag_audit_api, "_tool_versions", {"slither": "0.10.0", "echidna": "sha256:test"})
+    return TestClient(rag_audit_api.app), inserted
+
+
+def test_analyze_returns_immediately_then_completes(api):
+    client, inserted = api
+    resp = client.post("/analyze", files={"file": ("Vault.sol", b"contract Vault {}", "text/plain")})
+    assert resp.status_code == 200
+    assert resp.json()["doc_id"] == "Vault"
+
+    assert wait_until(lambda: client.get("/analyze/Vault/status").json()["status"] == "completed")
+    status = client.get("/analyze/Vault/status").json()
+    assert status["progress"] == 100
+    assert [s["name"] for s in status["stages"]] == rag_audit_api.ANALYZE_STAGES
+
+    result = client.get("/analyze/Vault").json()
+    assert result == {"doc_id": "Vault", "slither_findings": 1, "echidna_fails": 0, "status": "completed"}
+    assert inserted[0][0] == "Vault"
+
+
+def test_analyze_wait_and_unknown_job(api):
+    client, _ = api
+    resp = client.post("/analyze", files={"file": ("Token.sol", b"contract Token {}", "text/plain")},
+                       data={"wait": "true"})
+    assert resp.json()["slither_findings"] == 1
+    assert client.get("/analyze/missing/status").status_code == 404
+    assert client.delete("/analyze/Token").status_code == 409
+
+
+def test_analyze_same_doc_while_running_is_rejected(api):
+    client, inserted = api
+    first = client.post("/analyze", files={"file": ("Busy.sol", b"contract Busy {}", "text/plain")})
+    assert first.json()["status"] in ("pending", "running")
+    # 任务未结束时再次上传（内容不同）：返回 409，而不是悄悄丢弃新源码
+    again = client.post("/analyze", files={"file": ("Busy.sol", b"contract Busy { uint x; }", "text/plain")})
+    assert again.status_code == 409
+
+    assert wait_until(lambda: client.get("/analyze/Busy/status").json()["status"] == "completed")
+    resp = client.post("/analyze", files={"file": ("Busy.sol", b"contract Busy { uint x; }", "text/plain")},
+                       data={"wait": "true"})
+    assert resp.status_code == 200 and len(inserted) == 2
+
+
+def test_slither_and_echidna_run_concurrently(api):
+    client, _ = api
+    resp = client.post("/analyze", files={"file": ("Pair.sol", b"contract Pair {}", "text/plain")},
+                       data={"wait": "true"})
+    assert resp.status_code == 200
+    stages = {s["name"]: s for s in client.get("/analyze/Pair/status").json()["stages"]}
+    # 两个 0.2s 的工具并行：Echidna 在 Slither 结束前就已开始
+    assert stages["echidna"]["started_at"] < stages["slither"]["finished_at"]
+
+
+def test_run_command_kills_on_timeout():
+    async def go():
+        start = time.time()
+        with pytest.raises(asyncio.TimeoutError):
+            await rag_audit_api.run_command(
+                [sys.executable, "-c", "import time; time.sleep(30)"], timeout=0.3
+            )
+        return time.time() - start
+
+    assert asyncio.run(go()) < 5
+
+
+def test_run_echidna_without_docker_returns_empty_report(monkeypatch, tmp_path):
+    async def missing(*args, **kwargs):
+        raise FileNotFoundError("docker")
+
+    monkeypatch.setattr(rag_audit_api, "run_command", missing)
+    monkeypatch.setattr(rag_audit_api, "ECHIDNA_POOL_SIZE", 0)
+    report = asyncio.run(rag_audit_api.run_echidna(tmp_path / "A.sol", "A"))
+    assert report["fails"] == [] and "docker" in report["error"]
+
+
+def test_analysis_key_covers_source_contract_tools_and_config():
+    tools = {"slither": "0.10.0"}
+    base = analysis_key(b"contract A {}", "A", tools, {"args": []})
+    assert base == analysis_key(b"contract A {}", "A", dict(tools), {"args": []})
+    assert base != analysis_key(b"contract A {} ", "A", tools, {"args": []})
+    assert base != analysis_key(b"contract A {}", "B", tools, {"args": []})
+    assert base != analysis_key(b"contract A {}", "A", {"slither": "0.10.1"}, {"args": []})
+    assert base != analysis_key(b"contract A {}", "A", tools, {"args": ["--detect", "x"]})
+
+
+def test_resubmitted_source_hits_analysis_cache(api):
+    client, inserted = api
+    src = b"contract Cached {}"
+    first = client.post("/analyze", files={"file": ("Cached.sol", src, "text/plain")}, data={"wait": "true"})
+    assert first.json()["slither_findings"] == 1 and len(inserted) == 1
+
+    # 同一源码换个文件名再次提交：立即返回原 doc_id，不再运行工具、不再入库
+    again = client.post("/analyze", files={"file": ("Copy.sol", src, "text/plain")},
+                        data={"contract_name": "Cached"})
+    assert again.json() == first.json()
+    assert len(inserted) == 1
+    assert client.get("/analyze/Cached/status").json()["status"] == "completed"
+
+    forced = client.post("/analyze", files={"file": ("Cached.sol", src, "text/plain")},
+                         data={"wait": "true", "force": "true"})
+    assert forced.status_code == 200 and len(inserted) == 2
+
+
+def test_resubmitting_old_version_after_reanalysis_restores_its_findings(monkeypatch):
+    async def slither_by_source(path, root=None, remappings=None):
+        check = "reentrancy-eth" if "call" in path.read_text() else "tx-origin"
+        return {"results": {"detectors": [{"check": check, "impact": "High", "description": f"{check} in withdraw",
+                                           "elements": [{"name": "withdraw"}]}]}}
+
+    async def no_fails(path, name, root=None):
+        return {"fails": []}
+
+    store = LocalVectorStore(4)
+    monkeypatch.setattr(rag_audit_api, "run_slither", slither_by_source)
+    monkeypatch.setattr(rag_audit_api, "run_echidna", no_fails)
+    monkeypatch.setattr(rag_audit_api, "embed_in_batches", lambda texts, *a, **kw: [[1.0, 0, 0, 0] for _ in texts])
+    monkeypatch.setattr(rag_audit_api, "vector_store", store)
+    monkeypatch.setattr(rag_audit_api.settings, "hybrid_search", False)
+    monkeypatch.setattr(rag_audit_api, "CODE_INDEX", False)
+    monkeypatch.setattr(rag_audit_api, "job_manager", jobs.JobManager(workers=1))
+    monkeypatch.setattr(rag_audit_api, "analysis_cache", AnalysisCache())
+    monkeypatch.setattr(rag_audit_api, "_tool_versions", {"slither": "0.10.0", "echidna": "sha256:test"})
+    client = TestClient(rag_audit_api.app)
+
+    def submit(src):
+        resp = client.post("/analyze", files={"file": ("Vault.sol", src, "text/plain")}, data={"wait": "true"})
+        assert resp.status_code == 200
+        return [r["content"] for r in store.scan()]
+
+    v1, v2 = b"contract Vault { function withdraw() { msg.sender.call(''); } }", b"contract Vault { tx.origin; }"
+    assert "reentrancy-eth" in submit(v1)[0]
+    assert "tx-origin" in submit(v2)[0]
+    # v2 改写了 Vault 的已存行：v1 的缓存条目随之失效，再次提交 v1 会重新分析并写回
+    rows = submit(v1)
+    assert len(rows) == 1 and "reentrancy-eth" in rows[0]
+
+
+def test_analysis_cache_invalidation_visible_to_other_workers(tmp_path):
+    path = tmp_path / "analyses.sqlite"
+    a, b = AnalysisCache(path), AnalysisCache(path)
+    a.put("k", {"doc_id": "Vault", "slither_findings": 1, "echidna_fails": 0})
+    assert b.get("k")["doc_id"] == "Vault"
+    assert a.invalidate_doc("Vault") == 1
+    assert b.get("k") is None
@@ -0,0 +1,195 @@
+"""BM25 词法索引与混合检索单元测试"""
+import types
+
+import numpy as np
+import pytest
+
+import rag_audit_api
+from lexical_index import BM25Index, reciprocal_rank_fusion, tokenize
+from settings import Settings
+from vector_store import LocalVectorStore, SharedVectorStore, SupabaseVectorStore
+
+
+def test_tokenize_chinese_and_solidity_identifiers():
+    tokens = tokenize("重入漏洞: withdraw() 缺少 onlyOwner, naming-convention")
+    assert {"重入", "漏洞", "withdraw", "onlyowner", "only", "owner",
+            "naming-convention", "naming", "convention"} <= set(tokens)
+    assert "(" not in tokens and "withdraw()" not in tokens
+
+
+def test_bm25_ranks_exact_identifier_hits_first():
+    index = BM25Index()
+    index.add([
+        {"doc_id": "A", "content": "[Slither] 严重程度:High | Reentrancy in Vault.withdraw() | 元素:withdraw"},
+        {"doc_id": "A", "content": "[Slither] 严重程度:Informational | solc-version 0.8.0 过旧"},
+        {"doc_id": "B", "content": "[Slither] 严重程度:Medium | 缺少 onlyOwner 修饰符 | 元素:setOwner"},
+    ])
+    hits = index.search("withdraw 有重入问题吗", 2)
+    assert hits[0]["content"].startswith("[Slither] 严重程度:High") and hits[0]["bm25"] > 0
+    assert index.search("onlyOwner", 5)[0]["doc_id"] == "B"
+    assert index.search("completely unrelated", 5) == []
+    index.add([{"doc_id": "C", "content": "withdraw withdraw", "embedding": [0.1]}])
+    assert len(index) == 4 and "embedding" not in index.search("withdraw", 1)[0]
+
+
+def test_bm25_remove_by_doc_and_fingerprint():
+    index = BM25Index()
+    index.add([
+        {"doc_id": "Vault", "fingerprint": "a", "content": "Reentrancy in Vault.withdraw()"},
+        {"doc_id": "Vault", "content": "legacy withdraw row"},
+        {"doc_id": "Token", "fingerprint": "a", "content": "withdraw in Token"},
+    ])
+    assert index.remove("Vault", ["a", None]) == 2
+    assert len(index) == 1
+    assert [h["doc_id"] for h in index.search("withdraw", 5)] == ["Token"]
+    assert index.search("reentrancy", 5) == []
+
+
+def test_rrf_merges_by_content_and_keeps_vector_fields():
+    vec = [{"content": "a", "similarity": 0.9}, {"content": "b", "similarity": 0.8}]
+    lex = [{"content": "b", "bm25": 3.0}, {"content": "c", "bm25": 1.0}]
+    fused = reciprocal_rank_fusion([vec, lex], top_k=3, k=60)
+    assert [r["content"] for r in fused] == ["b", "a", "c"]
+    assert fused[0]["similarity"] == 0.8 and fused[0]["bm25"] == 3.0
+    assert fused[0]["rrf"] > fused[1]["rrf"]
+
+
+def test_rrf_keeps_identical_findings_from_different_documents():
+    vec = [{"doc_id": "A", "fingerprint": "fa", "content": "same", "similarity": 0.9},
+           {"doc_id": "B", "fingerprint": "fb", "content": "same", "similarity": 0.8}]
+    lex = [{"doc_id": "B", "fingerprint": "fb", "content": "same", "bm25": 2.0}]
+    fused = reciprocal_rank_fusion([vec, lex], top_k=5, k=60)
+    assert [r["doc_id"] for r in fused] == ["B", "A"]
+    assert fused[0]["similarity"] == 0.8 and fused[0]["bm25"] == 2.0
+
+
+def test_retrieve_falls_back_to_lexical_not_arbitrary_rows(monkeypatch):
+    dim = rag_audit_api.EMBED_DIM
+    basis = np.eye(dim, dtype=np.float32)
+    store, index = LocalVectorStore(dim), BM25Index()
+    rows = [
+        {"doc_id": "Vault", "content": "solc-version pragma 过旧", "embedding": basis[1]},
+        {"doc_id": "Vault", "content": "unchecked-transfer in Vault.sweep()", "embedding": basis[2]},
+    ]
+    store.add(rows)
+    index.add(rows)
+    monkeypatch.setattr(rag_audit_api, "vector_store", store)
+    monkeypatch.setattr(rag_audit_api, "lexical_index", index)
+    monkeypatch.setattr(rag_audit_api, "embed_text", lambda text: list(basis[0]))  # 与所有行都不相似
+
+    _, matches = rag_audit_api.retrieve("sweep() 有什么问题?", 5)
+    assert [m["content"] for m in matches] == ["unchecked-transfer in Vault.sweep()"]
+    _, matches = rag_audit_api.retrieve("完全无关", 5)
+    assert matches == []
+
+
+def test_insert_chunks_updates_lexical_index(monkeypatch):
+    index = BM25Index()
+    monkeypatch.setattr(rag_audit_api, "vector_store", LocalVectorStore(4))
+    monkeypatch.setattr(rag_audit_api, "lexical_index", index)
+    monkeypatch.setattr(rag_audit_api, "embed_in_batches", lambda chunks, *a, **kw: [[1.0, 0, 0, 0] for _ in chunks])
+    rag_audit_api.insert_chunks("Token", ["tx-origin used in Token.auth()"])
+    assert index.search("tx-origin", 1)[0]["doc_id"] == "Token"
+
+
+def test_lexical_index_follows_other_workers_writes_to_shared_store(monkeypatch, tmp_path):
+    dim = rag_audit_api.EMBED_DIM
+    basis = np.eye(dim, dtype=np.float32)
+    mine, other = SharedVectorStore(dim, tmp_path), SharedVectorStore(dim, tmp_path)  # 同一目录上的两个 worker
+    monkeypatch.setattr(rag_audit_api, "vector_store", mine)
+    index = BM25Index()
+    monkeypatch.setattr(rag_audit_api, "lexical_index", index)
+    monkeypatch.setattr(rag_audit_api.settings, "hybrid_search", True)
+    monkeypatch.setattr(rag_audit_api, "embed_text", lambda text: list(basis[0]))  # 只有词法检索能命中
+
+    other.add([{"doc_id": "Vault", "content": "unchecked-transfer in Vault.sweep()", "fingerprint": "f1",
+                "embedding": basis[1]}])
+    _, matches = rag_audit_api.retrieve("sweep() 有什么问题?", 5)
+    assert [m["content"] for m in matches] == ["unchecked-transfer in Vault.sweep()"]
+
+    other.delete("Vault", ["f1"])
+    _, matches = rag_audit_api.retrieve("sweep() 有什么问题?", 5)
+    assert matches == []
+    monkeypatch.setattr(mine, "scan", lambda: pytest.fail("版本未变：不应重建"))
+    rag_audit_api.retrieve("sweep", 5)
+    assert index.version == mine.version
+
+
+class FakeSupabase:
+    """内存中的 Supabase 表：select 只返回请求的列，delete 支持 eq / in_ 条件"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        return self
+
+    def select(self, cols):
+        names = [c.strip() for c in cols.split(",")]
+        return types.SimpleNamespace(range=lambda start, end: types.SimpleNamespace(
+            execute=lambda: types.SimpleNamespace(data=[{c: r.get(c) for c in names} for r in self.rows[start:end + 1]])
+        ))
+
+    def delete(self):
+        conds = []
+
+        def execute():
+            gone = [r for r in self.rows if all(cond(r) for cond in conds)]
+            self.rows[:] = [r for r in self.rows if r not in gone]
+            return types.SimpleNamespace(data=gone)
+
+        query = types.SimpleNamespace(execute=execute)
+        query.eq = lambda k, v: conds.append(lambda r: r.get(k) == v) or query
+        query.in_ = lambda k, vs: conds.append(lambda r: r.get(k) in vs) or query
+        return query
+
+
+def test_lexical_index_rebuilt_from_supabase_follows_deletes(monkeypatch):
+    client = FakeSupabase([{
+        "id": 1, "doc_id": "Vault", "content": "unchecked-transfer in Vault.sweep()", "fingerprint": "f1",
+        "tool": "slither", "detector": "unchecked-transfer", "impact": "High", "confidence": "Medium",
+        "elements": ["sweep"], "embedding": [1.0, 0.0],
+    }])
+    index = BM25Index()
+    monkeypatch.setattr(rag_audit_api, "vector_store", SupabaseVectorStore(client))
+    monkeypatch.setattr(rag_audit_api, "lexical_index", index)
+    monkeypatch.setattr(rag_audit_api.settings, "hybrid_search", True)
+
+    rag_audit_api._build_lexical_index()  # 重启后从库重建
+    hit = index.search("sweep", 5, filters={"impact": ["high"], "elements": ["sweep"]})[0]
+    assert hit["fingerprint"] == "f1" and "embedding" not in hit
+    assert rag_audit_api.delete_findings("Vault", ["f1"]) == 1
+    assert index.search("sweep", 5) == []
+
+
+def test_scan_pages_through_supabase_and_local_rows():
+    data = [{"doc_id": "d", "content": str(i)} for i in range(5)]
+    ranges = []
+
+    def select(cols):
+        assert "fingerprint" in cols and "impact" in cols
+
+        def range_(start, end):
+            ranges.append((start, end))
+            return types.SimpleNamespace(execute=lambda: types.SimpleNamespace(data=data[start:end + 1]))
+        return types.SimpleNamespace(range=range_)
+
+    client = types.SimpleNamespace(table=lambda name: types.SimpleNamespace(select=select))
+    assert list(SupabaseVectorStore(client).scan(batch_size=2)) == data
+    assert ranges == [(0, 1), (2, 3), (4, 5)]
+
+    local = LocalVectorStore(2)
+    local.add([{"doc_id": "d", "content": "x", "embedding": [1.0, 0.0]}])
+    assert list(local.scan()) == [{"doc_id": "d", "content": "x"}]
+
+
+def test_hybrid_search_off_by_default_with_several_workers():
+    def hybrid(**env):
+        return Settings.from_env({"GOOGLE_API_KEY": "k", **env}).hybrid_search
+
+    # 其他 worker 的写入与删除不会进入本进程的 BM25：多 worker 默认关闭，显式开启仍生效
+    assert hybrid(VECTOR_STORE="supabase", WEB_CONCURRENCY="1")
+    assert not hybrid(VECTOR_STORE="supabase", WEB_CONCURRENCY="2")
+    assert not hybrid(VECTOR_STORE="shared")
+    assert hybrid(VECTOR_STORE="supabase", WEB_CONCURRENCY="2", HYBRID_SEARCH="1")
+    assert not Settings(vector_store="local", workers=3).hybrid_search
@@ -0,0 +1,90 @@
+"""指标与 /metrics 端点单元测试"""
+import asyncio
+import types
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import metrics
+import rag_audit_api
+from gemini_client import GeminiClient, RetryQueue
+from vector_store import LocalVectorStore
+
+
+def test_histogram_counter_gauge_render_prometheus_text():
+    reg = metrics.Registry()
+    h = metrics.Histogram("t_seconds", "耗时", ["op"], buckets=(0.1, 1.0), registry=reg)
+    c = metrics.Counter("t_total", "次数", registry=reg)
+    g = metrics.Gauge("t_inflight", "在途", ["stage"], registry=reg)
+    h.labels("a").observe(0.05)
+    h.labels(op="a").observe(0.5)
+    h.labels("a").observe(5)
+    c.inc(3)
+    with metrics.inflight(g.labels("x")):
+        assert g.labels("x").value == 1
+    text = reg.render()
+    assert '# TYPE t_seconds histogram' in text
+    assert 't_seconds_bucket{op="a",le="0.1"} 1' in text
+    assert 't_seconds_bucket{op="a",le="1"} 2' in text
+    assert 't_seconds_bucket{op="a",le="+Inf"} 3' in text
+    assert 't_seconds_count{op="a"} 3' in text and 't_seconds_sum{op="a"} 5.55' in text
+    assert "t_total 3" in text and 't_inflight{stage="x"} 0' in text
+    with pytest.raises(ValueError):
+        h.labels()
+
+
+def test_timed_counts_errors_but_not_cancellation():
+    reg = metrics.Registry()
+    h = metrics.Histogram("e_seconds", "耗时", registry=reg)
+    errors = metrics.Counter("e_errors_total", "错误", registry=reg)
+    with pytest.raises(RuntimeError):
+        with metrics.timed(h, errors):
+            raise RuntimeError("boom")
+    with pytest.raises(asyncio.CancelledError):
+        with metrics.timed(h, errors):
+            raise asyncio.CancelledError()
+    assert errors.labels().value == 1 and h.labels().count == 2
+
+
+def test_metrics_endpoint_reports_ask_stages(monkeypatch):
+    monkeypatch.setattr(rag_audit_api, "gather_context", lambda q, k, f=None: (None, [], {}))
+    monkeypatch.setattr(rag_audit_api, "genai", types.SimpleNamespace(
+        GenerativeModel=lambda name: types.SimpleNamespace(
+            generate_content=lambda prompt: types.SimpleNamespace(text="ok")
+        )
+    ))
+    client = TestClient(rag_audit_api.app)
+    before = rag_audit_api.GENERATION_SECONDS.labels("sync").count
+    assert client.post("/ask", json={"question": "q"}).status_code == 200
+    assert rag_audit_api.GENERATION_SECONDS.labels("sync").count == before + 1
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200 and resp.headers["content-type"].startswith("text/plain")
+    assert 'rag_generation_seconds_count{mode="sync"}' in resp.text
+    assert "# TYPE rag_inflight gauge" in resp.text
+
+
+def test_embed_retries_deferral_and_retrieval_fallback_counted(monkeypatch):
+    def failing_embed(**kw):
+        raise RuntimeError("429 quota exceeded")
+
+    monkeypatch.setattr(rag_audit_api, "genai", types.SimpleNamespace(embed_content=failing_embed))
+    monkeypatch.setattr(rag_audit_api, "gemini", GeminiClient(base_delay=0, on_error=rag_audit_api._gemini_error))
+    monkeypatch.setattr(rag_audit_api, "embed_retry", RetryQueue())
+    monkeypatch.setattr(rag_audit_api, "vector_store", LocalVectorStore(4))
+    deferred = rag_audit_api.EMBED_DEFERRED.labels().value
+    retries = rag_audit_api.EMBED_RETRIES.labels("batch").value
+    texts = [f"metrics-deferral-{uuid.uuid4()}" for _ in range(2)]
+    assert rag_audit_api.insert_chunks("doc", texts) == 0  # 不再以零向量入库
+    assert len(rag_audit_api.vector_store) == 0 and len(rag_audit_api.embed_retry) == 2
+    assert rag_audit_api.EMBED_DEFERRED.labels().value == deferred + 2
+    assert rag_audit_api.EMBED_RETRIES.labels("batch").value == retries + 2
+
+    def broken_embed(text):
+        raise RuntimeError("down")
+
+    monkeypatch.setattr(rag_audit_api, "embed_text", broken_embed)
+    before = rag_audit_api.RETRIEVAL_FALLBACKS.labels("no_query_vector").value
+    rag_audit_api.retrieve("anything", 3)
+    assert rag_audit_api.RETRIEVAL_FALLBACKS.labels("no_query_vector").value == before + 1
@@ -0,0 +1,31 @@
+"""向量量化单元测试"""
+import numpy as np
+import pytest
+
+from quantization import CodeView, check_quantization, dequantize, quantize, recall_at_k, scores
+
+
+def test_int8_round_trip_and_scores():
+    vecs = np.random.default_rng(0).normal(size=(20, 32)).astype(np.float32)
+    vecs[3] = 0  # 零向量不产生 NaN
+    codes, scales = quantize(vecs, "int8")
+    assert codes.dtype == np.int8 and scales.shape == (20,) and scales[3] == 1.0
+    assert np.abs(dequantize(codes, scales) - vecs).max() <= scales.max() / 2 + 1e-6
+    q = vecs[0]
+    assert np.allclose(scores(codes, scales, q), vecs @ q, atol=0.2)
+    assert np.allclose(CodeView(codes, scales)[[0, 5]], dequantize(codes[[0, 5]], scales[[0, 5]]))
+    assert np.allclose(CodeView(codes, scales)[5], dequantize(codes, scales)[5])
+
+
+def test_float16_and_mode_check():
+    vecs = np.random.default_rng(1).normal(size=(4, 8)).astype(np.float32)
+    codes, _ = quantize(vecs, "float16")
+    assert codes.dtype == np.float16 and np.allclose(codes, vecs, atol=1e-2)
+    assert check_quantization("INT8") == "int8"
+    with pytest.raises(ValueError):
+        check_quantization("int4")
+
+
+def test_recall_at_k():
+    assert recall_at_k([[1, 2, 3, 4]], [[4, 3, 9, 8]]) == 0.5
+    assert recall_at_k([[1, 2], [3, 4]], [[1, 2], [5, 6]], k=2) == 0.5
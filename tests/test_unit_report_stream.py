@@ -0,0 +1,96 @@
+"""报告流式解析单元测试"""
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import rag_audit_api
+from report_stream import ReportStreamParser
+from vector_store import LocalVectorStore
+
+
+def slither_report(n):
+    return {
+        "success": True,
+        "results": {
+            "printers": [{"description": "ignored [ ] { }"}],
+            "detectors": [
+                {
+                    "check": "naming-convention",
+                    "impact": "Informational",
+                    "description": f'Parameter "_v{i}" 不符合 mixedCase \\ [x] {{y}}',
+                    "elements": [{"name": f"_v{i}", "source_mapping": {"lines": [i, i + 1]}}],
+                }
+                for i in range(n)
+            ],
+        },
+        "slitherVersion": "0.10.0",
+    }
+
+
+def parse_all(raw: bytes, chunk_size: int):
+    parser = ReportStreamParser()
+    items = []
+    for i in range(0, len(raw), chunk_size):
+        items += parser.feed(raw[i:i + chunk_size])
+    items += parser.close()
+    return parser, items
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_slither_stream_matches_full_parse(chunk_size):
+    report = slither_report(30)
+    raw = json.dumps(report, ensure_ascii=False, indent=1).encode("utf-8")
+    parser, items = parse_all(raw, chunk_size)
+    assert parser.kind == "slither"
+    assert [rag_audit_api.flatten_item(k, it) for k, it in items] == rag_audit_api.flatten_slither(report)
+
+
+def test_echidna_formats():
+    old = {"fails": [{"property": "echidna_balance", "trace": ["deposit()", "withdraw()"]}]}
+    new = {"echidnaVersion": "2.2", "results": [{"contract": "T", "test": "t", "status": "failed", "error": "x"}]}
+    for report in (old, new):
+        parser, items = parse_all(json.dumps(report).encode(), 5)
+        assert parser.kind == "echidna"
+        assert [rag_audit_api.flatten_item(k, it) for k, it in items] == rag_audit_api.flatten_echidna(report)
+
+
+def test_unknown_and_truncated_reports():
+    parser, items = parse_all(b'{"foo": [1, 2, {"bar": []}]}', 3)
+    assert parser.kind is None and items == []
+    with pytest.raises(ValueError):
+        parse_all(json.dumps(slither_report(3)).encode()[:-10], 64)
+
+
+def test_buffer_stays_bounded_for_large_reports():
+    raw = json.dumps(slither_report(5000)).encode()
+    parser = ReportStreamParser()
+    peak = 0
+    count = 0
+    for i in range(0, len(raw), 4096):
+        count += len(parser.feed(raw[i:i + 4096]))
+        peak = max(peak, len(parser._buf))
+    count += len(parser.close())
+    assert count == 5000
+    assert peak < 4096 + 1024          # 读块 + 单个元素，而非整份报告
+    assert len(raw) > 100 * peak
+
+
+def test_ingest_streams_in_bounded_batches(monkeypatch):
+    batches = []
+    monkeypatch.setattr(rag_audit_api, "INGEST_READ_SIZE", 2048)
+    monkeypatch.setattr(rag_audit_api, "INGEST_BATCH_SIZE", 40)
+    monkeypatch.setattr(rag_audit_api, "DEDUP_FINDINGS", False)  # 100 条同模板发现，关闭去重以观察分批
+    monkeypatch.setattr(rag_audit_api, "insert_chunks", lambda doc_id, chunks, metadata=None: batches.append((doc_id, len(chunks))) or len(chunks))
+    monkeypatch.setattr(rag_audit_api, "vector_store", LocalVectorStore(4))
+    client = TestClient(rag_audit_api.app)
+
+    raw = json.dumps(slither_report(100)).encode()
+    resp = client.post("/ingest", files=[("files", ("big_slither.json", io.BytesIO(raw), "application/json"))])
+    assert resp.json() == {"files": 1, "chunks_inserted": 100}
+    assert all(doc == "big_slither" for doc, _ in batches)
+    assert sum(n for _, n in batches) == 100 and len(batches) >= 3
+
+    bad = client.post("/ingest", files=[("files", ("x.json", io.BytesIO(b'{"foo": 1}'), "application/json"))])
+    assert bad.status_code == 400
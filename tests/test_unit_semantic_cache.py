@@ -0,0 +1,68 @@
+"""语义答案缓存单元测试"""
+import time
+import types
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import rag_audit_api
+from semantic_cache import SemanticCache
+from lexical_index import BM25Index
+from vector_store import LocalVectorStore
+
+CTX = [{"id": 1, "doc_id": "Vault", "content": "reentrancy"}]
+
+
+def test_hit_requires_similarity_and_same_context():
+    cache = SemanticCache(threshold=0.9)
+    cache.store([1.0, 0.0, 0.0], CTX, "answer")
+    assert cache.lookup([0.99, 0.05, 0.0], CTX) == "answer"
+    assert cache.lookup([0.5, 0.5, 0.0], CTX) is None                     # 问题不够相似
+    assert cache.lookup([1.0, 0.0, 0.0], CTX + [{"id": 2, "content": "x"}]) is None  # 上下文变了
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 2}
+
+
+def test_ttl_lru_and_doc_invalidation():
+    cache = SemanticCache(threshold=0.9, ttl=0.05, max_entries=2)
+    cache.store([1.0, 0.0], CTX, "a")
+    time.sleep(0.06)
+    assert cache.lookup([1.0, 0.0], CTX) is None                           # 过期
+
+    cache = SemanticCache(threshold=0.9, max_entries=2)
+    cache.store([1.0, 0.0], CTX, "a")
+    cache.store([0.0, 1.0], CTX, "b")
+    cache.store([-1.0, 0.0], [{"doc_id": "Token", "content": "c"}], "c")   # 淘汰 a
+    assert cache.lookup([1.0, 0.0], CTX) is None
+    assert cache.invalidate_doc("Vault") == 1
+    assert cache.stats()["entries"] == 1
+
+
+def test_ask_reuses_answer_until_doc_reingested(monkeypatch):
+    dim = rag_audit_api.EMBED_DIM
+    basis = np.eye(dim, dtype=np.float32)
+    store = LocalVectorStore(dim)
+    store.add([{"doc_id": "Vault", "content": "reentrancy in withdraw()", "embedding": basis[0]}])
+    question_vecs = {
+        "有没有重入漏洞?": basis[0],
+        "reentrancy issues?": basis[0] * 0.98 + basis[1] * 0.05,
+    }
+    generated = []
+    monkeypatch.setattr(rag_audit_api, "vector_store", store)
+    monkeypatch.setattr(rag_audit_api, "lexical_index", BM25Index())
+    monkeypatch.setattr(rag_audit_api, "answer_cache", SemanticCache(threshold=0.95))
+    monkeypatch.setattr(rag_audit_api, "embed_text", lambda text: list(question_vecs[text]))
+    monkeypatch.setattr(rag_audit_api, "embed_texts", lambda texts: [list(basis[2]) for _ in texts])
+    monkeypatch.setattr(rag_audit_api, "genai", types.SimpleNamespace(
+        GenerativeModel=lambda name: types.SimpleNamespace(
+            generate_content=lambda prompt: generated.append(prompt) or types.SimpleNamespace(text="有")
+        )
+    ))
+    client = TestClient(rag_audit_api.app)
+
+    for q in question_vecs:
+        assert client.post("/ask", json={"question": q, "top_k": 1}).json()["answer"] == "有"
+    assert len(generated) == 1
+
+    rag_audit_api.insert_chunks("Vault", ["new finding"])
+    client.post("/ask", json={"question": "有没有重入漏洞?", "top_k": 1})
+    assert len(generated) == 2
@@ -0,0 +1,358 @@
+"""向量存储单元测试（本地 NumPy 后端 + Supabase 适配层）"""
+import json
+import os
+import pathlib
+import re
+import subprocess
+import sys
+import types
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import rag_audit_api
+from semantic_cache import SemanticCache
+from lexical_index import BM25Index
+from vector_store import FILTER_FIELDS, LocalVectorStore, SharedVectorStore, SupabaseVectorStore
+
+DIM = 16
+
+
+def rows_for(vectors, doc_id="doc"):
+    return [{"doc_id": doc_id, "content": f"chunk-{i}", "embedding": v} for i, v in enumerate(vectors)]
+
+
+def random_vectors(n, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, DIM)).astype(np.float32)
+
+
+def test_exact_search_ranks_by_cosine_and_applies_threshold():
+    store = LocalVectorStore(DIM)
+    vecs = random_vectors(50)
+    store.add(rows_for(vecs))
+
+    hits = store.search(vecs[7] * 3.0, top_k=3)
+    assert hits[0]["content"] == "chunk-7"
+    assert abs(hits[0]["similarity"] - 1.0) < 1e-5
+    assert [h["similarity"] for h in hits] == sorted((h["similarity"] for h in hits), reverse=True)
+    assert "embedding" not in hits[0]
+    assert all(h["similarity"] >= 0.99 for h in store.search(vecs[7], top_k=10, threshold=0.99))
+
+
+def test_incremental_adds_and_persistence(tmp_path):
+    store = LocalVectorStore(DIM, path=tmp_path)
+    vecs = random_vectors(3000, seed=1)   # 超过初始容量，触发矩阵扩容
+    store.add(rows_for(vecs[:1000]))
+    store.add(rows_for(vecs[1000:], doc_id="other"))
+    assert len(store) == 3000
+
+    reloaded = LocalVectorStore(DIM, path=tmp_path)
+    assert len(reloaded) == 3000
+    hit = reloaded.search(vecs[2500], top_k=1)[0]
+    assert hit["doc_id"] == "other" and hit["content"] == "chunk-1500"
+
+
+def test_hnsw_index_recall_against_exact():
+    vecs = random_vectors(1500, seed=2)
+    exact = LocalVectorStore(DIM)
+    ann = LocalVectorStore(DIM, ann_min_rows=500)
+    for store in (exact, ann):
+        store.add(rows_for(vecs[:700]))
+        store.add(rows_for(vecs[700:], doc_id="b"))
+    assert ann._index is not None
+
+    queries = random_vectors(50, seed=3)
+    recall = np.mean([
+        len({h["content"] + h["doc_id"] for h in ann.search(q, 10)}
+            & {h["content"] + h["doc_id"] for h in exact.search(q, 10)}) / 10
+        for q in queries
+    ])
+    assert recall >= 0.9
+
+
+def test_supabase_store_uses_table_and_rpc():
+    calls = []
+    client = types.SimpleNamespace(
+        table=lambda name: types.SimpleNamespace(
+            insert=lambda rows: types.SimpleNamespace(execute=lambda: calls.append(("insert", name, len(rows)))),
+            select=lambda cols: types.SimpleNamespace(
+                limit=lambda n: types.SimpleNamespace(execute=lambda: types.SimpleNamespace(data=[{"content": "x"}]))
+            ),
+        ),
+        rpc=lambda fn, params: types.SimpleNamespace(
+            execute=lambda: calls.append(("rpc", fn, params["match_count"])) or types.SimpleNamespace(data=None)
+        ),
+    )
+    store = SupabaseVectorStore(client)
+    assert store.add([{"doc_id": "d", "content": "c", "embedding": [0.0]}]) == 1
+    assert store.search([0.1], top_k=4, threshold=0.7) == []
+    assert store.sample(1) == [{"content": "x"}]
+    assert calls == [("insert", "audit_vectors", 1), ("rpc", "match_documents", 4)]
+
+
+def test_ask_uses_local_vector_store(monkeypatch):
+    store = LocalVectorStore(rag_audit_api.EMBED_DIM)
+    basis = np.eye(rag_audit_api.EMBED_DIM, dtype=np.float32)
+    store.add([
+        {"doc_id": "Vault", "content": "reentrancy in withdraw()", "embedding": basis[0]},
+        {"doc_id": "Vault", "content": "solc-version", "embedding": basis[1]},
+    ])
+    prompts = []
+    monkeypatch.setattr(rag_audit_api, "vector_store", store)
+    monkeypatch.setattr(rag_audit_api, "lexical_index", BM25Index())
+    monkeypatch.setattr(rag_audit_api, "answer_cache", SemanticCache())
+    monkeypatch.setattr(rag_audit_api, "embed_text", lambda text: list(basis[0]))
+    monkeypatch.setattr(rag_audit_api, "genai", types.SimpleNamespace(
+        GenerativeModel=lambda name: types.SimpleNamespace(
+            generate_content=lambda prompt: prompts.append(prompt) or types.SimpleNamespace(text="mock answer")
+        )
+    ))
+
+    resp = TestClient(rag_audit_api.app).post("/ask", json={"question": "重入?", "top_k": 1})
+    assert resp.json()["answer"] == "mock answer"
+    assert "reentrancy in withdraw()" in prompts[0] and "solc-version" not in prompts[0]
+
+
+def test_local_store_prefilters_by_metadata():
+    basis = np.eye(4, dtype=np.float32)
+    store = LocalVectorStore(4)
+    store.add([
+        {"doc_id": "Vault", "content": "v-high", "tool": "slither", "impact": "High",
+         "elements": ["withdraw"], "embedding": basis[0]},
+        {"doc_id": "Vault", "content": "v-info", "tool": "slither", "impact": "Informational",
+         "elements": ["_x"], "embedding": basis[0] * 0.9 + basis[1] * 0.1},
+        {"doc_id": "Token", "content": "t-high", "tool": "slither", "impact": "High",
+         "elements": ["transfer"], "embedding": basis[0]},
+        {"doc_id": "Token", "content": "t-echidna", "tool": "echidna", "embedding": basis[2]},
+    ])
+    q = basis[0]
+    assert [r["content"] for r in store.search(q, 10, filters={"doc_id": ["Vault"]})] == ["v-high", "v-info"]
+    assert [r["content"] for r in store.search(q, 10, filters={"impact": ["high"], "doc_id": ["Token"]})] == ["t-high"]
+    assert [r["content"] for r in store.search(q, 10, filters={"elements": ["withdraw", "transfer"]})] == ["v-high", "t-high"]
+    assert store.search(q, 10, filters={"doc_id": ["Nope"]}) == []
+    assert len(store.search(q, 10, filters={"impact": []})) == 4  # 空条件等同不过滤
+    with pytest.raises(ValueError):
+        store.search(q, 1, filters={"severity": ["High"]})
+
+
+def test_local_store_update_delete_and_compaction(tmp_path):
+    store = LocalVectorStore(DIM, path=tmp_path)
+    vecs = random_vectors(6, seed=4)
+    store.add([{**r, "fingerprint": f"fp{i}"} for i, r in enumerate(rows_for(vecs, "Vault"))])
+    store.add(rows_for(vecs[:1], "Vault2"))  # 大小写/前缀不同的 doc_id 不受影响
+
+    assert store.update("Vault", [{"fingerprint": "fp1", "content": "chunk-1 | 相似发现:2 处"}]) == 1
+    hit = store.search(vecs[1], top_k=1)[0]
+    assert hit["content"] == "chunk-1 | 相似发现:2 处" and hit["similarity"] > 0.99  # 原向量保留
+    assert store.delete("Vault", ["fp0", "fp2"]) == 2
+    assert len(store) == 5
+    assert "chunk-0" not in [h["content"] for h in store.search(vecs[0], top_k=10, filters={"doc_id": ["vault"]})]
+    assert sorted(r["fingerprint"] for r in store.fingerprints("Vault")) == ["fp1", "fp3", "fp4", "fp5"]
+
+    reloaded = LocalVectorStore(DIM, path=tmp_path)  # 重启后应用 deleted.txt
+    assert len(reloaded) == 5 and reloaded.search(vecs[1], top_k=1)[0]["content"] == "chunk-1 | 相似发现:2 处"
+
+    reloaded.delete("Vault", ["fp1", "fp3", "fp4"])  # 删除过半，触发压缩
+    assert reloaded._size == len(reloaded) == 2 and not (tmp_path / "deleted.txt").exists()
+    assert [r["content"] for r in LocalVectorStore(DIM, path=tmp_path).scan()] == ["chunk-5", "chunk-0"]
+
+
+def test_hnsw_search_skips_deleted_rows():
+    vecs = random_vectors(600, seed=5)
+    store = LocalVectorStore(DIM, ann_min_rows=100)
+    store.add([{**r, "fingerprint": str(i)} for i, r in enumerate(rows_for(vecs))])
+    store.delete("doc", ["7"])
+    hits = store.search(vecs[7], top_k=3)
+    assert len(hits) == 3 and "chunk-7" not in [h["content"] for h in hits]
+
+
+@pytest.mark.parametrize("mode,ratio", [("float16", 2.0), ("int8", 3.7)])
+def test_quantized_store_saves_memory_and_keeps_recall(tmp_path, mode, ratio):
+    dim = 128
+    vecs = np.random.default_rng(6).normal(size=(3000, dim)).astype(np.float32)
+    rows = [{"doc_id": "doc", "content": f"chunk-{i}", "embedding": v} for i, v in enumerate(vecs)]
+    exact = LocalVectorStore(dim)
+    quant = LocalVectorStore(dim, path=tmp_path, quantization=mode)
+    exact.add(rows)
+    quant.add(rows)
+    assert exact.nbytes / quant.nbytes >= ratio
+
+    queries = vecs[:40] + np.random.default_rng(7).normal(scale=0.8, size=(40, dim)).astype(np.float32)
+    recall = np.mean([
+        len({h["content"] for h in quant.search(q, 10)} & {h["content"] for h in exact.search(q, 10)}) / 10
+        for q in queries
+    ])
+    assert recall >= 0.97
+    hit, ref = quant.search(queries[0], 1)[0], exact.search(queries[0], 1)[0]
+    assert hit["content"] == ref["content"] and abs(hit["similarity"] - ref["similarity"]) < 1e-5  # 全精度重新打分
+
+
+def test_int8_store_keeps_full_precision_through_update_and_reload(tmp_path):
+    vecs = random_vectors(8, seed=8)
+    store = LocalVectorStore(DIM, path=tmp_path, quantization="int8", ann_min_rows=4)
+    store.add([{**r, "fingerprint": f"fp{i}"} for i, r in enumerate(rows_for(vecs))])
+    store.update("doc", [{"fingerprint": "fp3", "content": "chunk-3 v2"}])
+    store.delete("doc", ["fp0", "fp1", "fp2", "fp4"])  # 删除过半，压缩时从磁盘读取全精度向量
+
+    reloaded = LocalVectorStore(DIM, path=tmp_path, quantization="int8")
+    assert reloaded._matrix.dtype == np.int8
+    for store_ in (store, reloaded):
+        hit = store_.search(vecs[3], top_k=1)[0]
+        assert hit["content"] == "chunk-3 v2" and hit["similarity"] == pytest.approx(1.0, abs=1e-6)
+    assert np.allclose(np.fromfile(tmp_path / "vectors.f32", dtype=np.float32).reshape(-1, DIM), store.vectors, atol=0.02)
+
+
+
+def test_shared_store_readers_map_writer_segments_and_match_local(tmp_path):
+    vecs = random_vectors(300, seed=9)
+    rows = [{**r, "impact": "High" if i % 3 else "Low"} for i, r in enumerate(rows_for(vecs))]
+    writer = SharedVectorStore(DIM, tmp_path)
+    reader = SharedVectorStore(DIM, tmp_path, read_only=True)
+    local = LocalVectorStore(DIM)
+    assert len(reader) == 0 and reader.search(vecs[0], 3) == []
+    for start in range(0, 300, 40):  # 多次追加：新段对读取方可见，末尾小段被合并
+        writer.add(rows[start:start + 40])
+        local.add(rows[start:start + 40])
+        assert len(reader) == start + len(rows[start:start + 40])
+
+    segments = reader._snapshot().segments
+    assert len(segments) <= 4
+    assert all(isinstance(s.vectors, np.memmap) and s.vectors.mode == "r" for s in segments)
+    for q in random_vectors(10, seed=10):
+        for filters in (None, {"impact": ["high"]}):
+            got = reader.search(q, 5, filters=filters)
+            want = local.search(q, 5, filters=filters)
+            assert [h["content"] for h in got] == [h["content"] for h in want]
+            assert [h["similarity"] for h in got] == pytest.approx([h["similarity"] for h in want], abs=1e-5)
+    with pytest.raises(PermissionError):
+        reader.add(rows[:1])
+
+
+def test_shared_store_update_delete_compaction_and_orphans(tmp_path):
+    vecs = random_vectors(6, seed=11)
+    store = SharedVectorStore(DIM, tmp_path)
+    store.add([{**r, "fingerprint": f"fp{i}"} for i, r in enumerate(rows_for(vecs, "Vault"))])
+    (tmp_path / "seg-99999999.f32").write_bytes(b"\0" * 8)  # 中断写入的残留：未被清单引用
+
+    assert store.update("Vault", [{"fingerprint": "fp1", "content": "chunk-1 v2"}]) == 1
+    assert not (tmp_path / "seg-99999999.f32").exists()
+    assert store.delete("Vault", ["fp0", "fp2"]) == 2
+    reopened = SharedVectorStore(DIM, tmp_path, read_only=True)
+    assert len(reopened) == 4
+    hit = reopened.search(vecs[1], top_k=1)[0]
+    assert hit["content"] == "chunk-1 v2" and hit["similarity"] == pytest.approx(1.0, abs=1e-5)
+    assert sorted(r["fingerprint"] for r in reopened.fingerprints("Vault")) == ["fp1", "fp3", "fp4", "fp5"]
+
+    store.delete("Vault", ["fp3", "fp4"])  # 删除过半：合并为一个段，墓碑清空
+    manifest = json.loads((tmp_path / "MANIFEST.json").read_text())
+    assert len(manifest["segments"]) == 1 and manifest["deleted"] is None
+    assert sorted(r["content"] for r in reopened.scan()) == ["chunk-1 v2", "chunk-5"]
+    assert sorted(p.name for p in tmp_path.glob("seg-*.f32")) == [manifest["segments"][0]["name"] + ".f32"]
+
+
+
+def test_shared_store_old_snapshot_survives_merge_and_gc(tmp_path):
+    vecs = random_vectors(20, seed=12)
+    rows = [{**r, "impact": "High" if i % 2 else "Low"} for i, r in enumerate(rows_for(vecs))]
+    writer = SharedVectorStore(DIM, tmp_path)
+    reader = SharedVectorStore(DIM, tmp_path, read_only=True)
+    writer.add(rows[:10])
+    old = reader._snapshot()
+    old_files = sorted(tmp_path.glob(f"{old.segments[0].name}.*"))
+
+    writer.add(rows[10:])  # 新段与旧段合并，旧段文件随即被删除
+    assert not any(p.exists() for p in old_files)
+    seg = old.segments[0]
+    ids = seg.filter_ids({"impact": ["high"]})
+    assert [seg.row(int(i))["content"] for i in ids] == [f"chunk-{i}" for i in range(1, 10, 2)]
+    assert len(reader) == 20
+
+def test_shared_store_serializes_writers_across_processes(tmp_path):
+    code = (
+        "import sys, numpy as np; from vector_store import SharedVectorStore; "
+        "s = SharedVectorStore(16, sys.argv[1]); rng = np.random.default_rng(int(sys.argv[2])); "
+        "[s.add([{'doc_id': sys.argv[2], 'content': str(i), 'embedding': rng.normal(size=16)}]) for i in range(15)]"
+    )
+    app_dir = os.path.dirname(rag_audit_api.__file__)
+    procs = [
+        subprocess.Popen([sys.executable, "-c", code, str(tmp_path), str(seed)], cwd=app_dir)
+        for seed in range(3)
+    ]
+    assert [p.wait(60) for p in procs] == [0, 0, 0]
+    store = SharedVectorStore(DIM, tmp_path, read_only=True)
+    assert len(store) == 45
+    assert sorted((r["doc_id"], int(r["content"])) for r in store.scan()) == [
+        (str(seed), i) for seed in range(3) for i in range(15)
+    ]
+
+
+def test_supabase_store_sends_half_precision_vectors():
+    sent = []
+    client = types.SimpleNamespace(
+        table=lambda name: types.SimpleNamespace(
+            insert=lambda rows: sent.append(rows) or types.SimpleNamespace(execute=lambda: None)),
+        rpc=lambda fn, params: sent.append(params) or types.SimpleNamespace(
+            execute=lambda: types.SimpleNamespace(data=[])),
+    )
+    vec = np.random.default_rng(9).normal(size=768).astype(np.float32) / 28
+    full, half = SupabaseVectorStore(client), SupabaseVectorStore(client, quantization="float16")
+    full.add([{"doc_id": "d", "content": "c", "embedding": [float(x) for x in vec]}])
+    half.add([{"doc_id": "d", "content": "c", "embedding": [float(x) for x in vec]}])
+    half.search(vec, top_k=1)
+    size = [len(json.dumps(rows[0]["embedding"])) for rows in sent[:2]]
+    assert size[1] * 2 < size[0]
+    assert np.allclose(sent[1][0]["embedding"], vec, atol=1e-3) and sent[2]["query_embedding"] == sent[1][0]["embedding"]
+    with pytest.raises(ValueError):
+        SupabaseVectorStore(client, quantization="int8")
+
+
+def test_supabase_store_uses_filtered_rpc():
+    calls = []
+    client = types.SimpleNamespace(rpc=lambda fn, params: calls.append((fn, params.get("filter")))
+                                   or types.SimpleNamespace(execute=lambda: types.SimpleNamespace(data=[])))
+    store = SupabaseVectorStore(client)
+    store.search([0.1], top_k=3, filters={"impact": ["High"], "tool": []})
+    store.search([0.1], top_k=3)
+    assert calls == [("match_documents_filtered", {"impact": ["high"]}), ("match_documents", None)]
+
+
+def _rpc_columns(sql):
+    """SQL 文本中每个检索函数 RETURNS TABLE 的列名"""
+    found = re.findall(r"FUNCTION (\w+)\(.*?RETURNS TABLE \((.*?)\)\s*LANGUAGE", sql, re.S)
+    return {name: [c.split()[0] for c in cols.split(",")] for name, cols in found}
+
+
+def test_supabase_rpcs_return_the_same_columns():
+    root = pathlib.Path(__file__).resolve().parents[1]
+    migration = _rpc_columns((root / "migrations" / "001_audit_columns_and_rpcs.sql").read_text(encoding="utf-8"))
+    readme = _rpc_columns((root / "README.md").read_text(encoding="utf-8"))
+    # 两个函数结果行都带指纹与全部过滤字段（混合检索融合、答案缓存失效依赖它们）
+    assert migration["match_documents"] == migration["match_documents_filtered"]
+    assert {"content", "fingerprint", *FILTER_FIELDS} <= set(migration["match_documents"])
+    for name in ("match_documents", "match_documents_filtered", "match_code", "match_code_filtered"):
+        assert readme[name] == migration[name]
+
+
+def test_ask_filters_scope_retrieval(monkeypatch):
+    dim = rag_audit_api.EMBED_DIM
+    basis = np.eye(dim, dtype=np.float32)
+    store = LocalVectorStore(dim)
+    monkeypatch.setattr(rag_audit_api, "vector_store", store)
+    monkeypatch.setattr(rag_audit_api, "lexical_index", BM25Index())
+    monkeypatch.setattr(rag_audit_api, "embed_in_batches", lambda chunks, *a, **kw: [list(basis[0]) for _ in chunks])
+    monkeypatch.setattr(rag_audit_api, "embed_text", lambda text: list(basis[0]))
+    for doc in ("Vault", "Token"):
+        groups = rag_audit_api.dedup_findings([("slither", {
+            "check": "reentrancy-eth", "impact": "High", "confidence": "Medium",
+            "description": f"Reentrancy in {doc}.withdraw()", "elements": [{"name": "withdraw"}],
+        })])
+        rag_audit_api.insert_groups(doc, groups)
+
+    _, matches = rag_audit_api.retrieve("重入?", 5, {"doc_id": ["Token"], "detector": ["reentrancy-eth"]})
+    assert [m["doc_id"] for m in matches] == ["Token"]
+    assert matches[0]["impact"] == "High" and matches[0]["elements"] == ["withdraw"]
+    assert rag_audit_api.sources_of(matches)[0]["metadata"]["detector"] == "reentrancy-eth"
+
+    body = rag_audit_api.AskSchema(question="q", filters={"impact": ["High"], "tool": None})
+    assert body.filters.to_filters() == {"impact": ["High"]}